@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Measures the work done per watchdog event against the size of the library: a burst of new files and a new
+album directory are reported to the event handler of the daemon, and the time and files handled per event
+are compared with the full rescan the former handler ran on every event.
+Events are fed to the handler directly, so that the watchdog backend does not blur the measure.
+Run from the repository root: python -m benchmarks.events --help
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+from watchdog.events import FileCreatedEvent, DirCreatedEvent, FileModifiedEvent
+
+from google_music_manager_uploader.uploader_daemon import MusicToUpload, SettleQueue
+from google_music_manager_uploader.scanner import scan
+from benchmarks.library import empty_tree
+
+
+def burst(library: str, files: int, album_files: int) -> list:
+    """
+    Writes new files in an existing album and a new album directory
+    :return: events watchdog reports for them: creation then modification of each file, creation of the directory
+    """
+    events = []
+    album = os.path.join(library, 'Artist 0', 'Album 0')
+    for number in range(files):
+        path = os.path.join(album, 'new %03d.mp3' % number)
+        open(path, 'wb').close()
+        events.extend([FileCreatedEvent(path), FileModifiedEvent(path)])
+    new_album = os.path.join(library, 'New Artist', 'New Album')
+    os.makedirs(new_album)
+    for number in range(album_files):
+        open(os.path.join(new_album, '%02d.flac' % number), 'wb').close()
+    events.append(DirCreatedEvent(os.path.dirname(new_album)))
+    return events
+
+
+def measure(size: int, files: int, album_files: int, directory: str) -> dict:
+    """
+    :return: microseconds and files handed to the settle queue per event, and the same for the former full rescan
+    """
+    library = os.path.join(directory, 'library %d' % size)
+    audio = empty_tree(library, size)
+    events = burst(library, files, album_files)
+    released = []
+    handler = MusicToUpload()
+    handler.path = library
+    handler.logger = logging.getLogger(__name__)
+    handler.settle_queue = SettleQueue(released.append, settle_time=0)
+    start = time.perf_counter()
+    for event in events:
+        if isinstance(event, FileModifiedEvent):
+            handler.on_modified(event)
+        else:
+            handler.on_created(event)
+    elapsed = time.perf_counter() - start
+    # the former handler listed the whole library on every event
+    start = time.perf_counter()
+    listed = sum(1 for _ in scan(library))
+    rescan = time.perf_counter() - start
+    return {
+        'library_files': audio,
+        'events': len(events),
+        'microseconds_per_event': elapsed / len(events) * 1000000,
+        'files_per_event': len(released) / len(events),
+        'former_files_per_event': listed,
+        'former_microseconds_per_event': rescan * 1000000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the work per watchdog event against the library size")
+    parser.add_argument("--sizes", default='1000,10000,100000',
+                        help="Comma separated entries of the synthetic libraries (default: 1000,10000,100000)")
+    parser.add_argument("--files", type=int, default=100,
+                        help="New files dropped in an existing album (default: 100)")
+    parser.add_argument("--album_files", type=int, default=12, help="Files of the new album directory (default: 12)")
+    parser.add_argument("--json", action='store_true', help="Print the results as JSON (default: False)")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = {
+            size: measure(size, args.files, args.album_files, tmp_dir)
+            for size in (int(size) for size in args.sizes.split(','))
+        }
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+        return
+    print("%10s %8s %14s %12s %16s %16s" % (
+        'library', 'events', 'us/event', 'files/event', 'former files', 'former us/event'
+    ))
+    for result in results.values():
+        print("%10d %8d %14.1f %12.2f %16d %16.0f" % (
+            result['library_files'],
+            result['events'],
+            result['microseconds_per_event'],
+            result['files_per_event'],
+            result['former_files_per_event'],
+            result['former_microseconds_per_event'],
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Local stand-in for the Music Manager endpoints, so that uploads can be measured without network nor Google account
+"""
+
+import json
+import time
+import uuid
+import random
+import inspect
+import threading
+import functools
+import contextlib
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from gmusicapi.protocol import musicmanager, upload_pb2, download_pb2
+
+GOOGLE_HOSTS = (
+    'https://android.clients.google.com', 'https://uploadsj.clients.google.com', 'https://music.google.com'
+)
+# tracks per page of the account listing
+LIST_PAGE_SIZE = 1000
+
+
+class FakeMusicManager:
+    """
+    Speaks enough of the Music Manager protocol for Manager.upload: OAuth token refresh, upauth, metadata,
+    sample, uploadstate, GetUploadSession and the UploadFile PUT, plus the paged listing of the account tracks.
+    The server runs in its own process so that the CPU and memory it uses are not charged to the uploader.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        session_error_rate: float = 0.0,
+        match_ratio: float = 0.0,
+        sample_ratio: float = 0.0,
+        bandwidth: float = 0,
+        seed: int = 0,
+        tracks: list = (),
+    ) -> None:
+        """
+        :param latency: Float. seconds added to every answer. 0 by default
+        :param error_rate: Float. share of calls answered with HTTP 503. 0 by default
+        :param session_error_rate: Float. share of GetUploadSession answered with a "still syncing" error. 0 by default
+        :param match_ratio: Float. share of tracks matched instead of uploaded. 0 by default
+        :param sample_ratio: Float. share of tracks for which a scan and match sample is requested
+            (cutting samples needs ffmpeg). 0 by default
+        :param bandwidth: Float. bytes per second accepted by UploadFile, 0 for unlimited. 0 by default
+        :param seed: Integer. seed of the random answers. 0 by default
+        :param tracks: list of dicts with the keys of Musicmanager.get_uploaded_songs but id and track_size,
+            tracks already in the account. Empty by default
+        """
+        self.config = {
+            'latency': latency,
+            'error_rate': error_rate,
+            'session_error_rate': session_error_rate,
+            'match_ratio': match_ratio,
+            'sample_ratio': sample_ratio,
+            'bandwidth': bandwidth,
+            'seed': seed,
+            'tracks': list(tracks),
+        }
+        self.url = None
+        self._process = None
+
+    def start(self) -> None:
+        ports = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_serve, args=(self.config, ports), daemon=True)
+        self._process.start()
+        self.url = 'http://127.0.0.1:%d' % ports.get(timeout=30)
+
+    def stop(self) -> None:
+        self._process.terminate()
+        self._process.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+@contextlib.contextmanager
+def redirect(url: str):
+    """
+    Points every Music Manager call of this process to a FakeMusicManager while the context is active.
+    A nested redirect wins until it ends
+    :param url: FakeMusicManager.url
+    """
+    from google_music_manager_uploader.manager import MyProvideSample
+
+    def redirected(build_request):
+        # the Google URL is only built by the original build_request, not by an enclosing redirect
+        build_request = inspect.unwrap(build_request)
+
+        @functools.wraps(build_request)
+        def build(*args, **kwargs):
+            request = build_request(*args, **kwargs)
+            if request.get('url', '').startswith(GOOGLE_HOSTS):
+                request['url'] = url + request['url'][request['url'].index('/', len('https://')):]
+            return request
+        return staticmethod(build)
+
+    calls = [value for value in vars(musicmanager).values() if isinstance(value, type)] + [MyProvideSample]
+    # build_request is generated with the call URL when the class is created, wrap it rather than the URL
+    originals = {call: vars(call)['build_request'] for call in calls if 'build_request' in vars(call)}
+    for call in originals:
+        call.build_request = redirected(call.build_request)
+    try:
+        yield
+    finally:
+        for call, build_request in originals.items():
+            call.build_request = build_request
+
+
+def write_credentials(oauth_path: str, url: str) -> None:
+    """
+    Writes an oauth file whose token refresh goes to a FakeMusicManager
+    :param oauth_path: Path of the oauth file to write
+    :param url: FakeMusicManager.url
+    """
+    from oauth2client.client import OAuth2Credentials
+    from oauth2client.file import Storage
+    credentials = OAuth2Credentials(
+        None, 'benchmark', 'benchmark', 'benchmark', None, url + '/token', 'benchmark'
+    )
+    Storage(oauth_path).put(credentials)
+
+
+def _serve(config: dict, ports) -> None:
+    rng = random.Random(config['seed'])
+    lock = threading.Lock()
+
+    def chance(ratio: float) -> bool:
+        with lock:
+            return rng.random() < ratio
+
+    def track_response(client_id: str):
+        response = upload_pb2.TrackSampleResponse()
+        response.client_track_id = client_id
+        response.server_track_id = str(uuid.uuid4())
+        response.response_code = (
+            upload_pb2.TrackSampleResponse.MATCHED
+            if chance(config['match_ratio']) else upload_pb2.TrackSampleResponse.UPLOAD_REQUESTED
+        )
+        return response
+
+    def metadata(body: bytes):
+        request = upload_pb2.UploadMetadataRequest()
+        request.ParseFromString(body)
+        response = upload_pb2.UploadResponse()
+        response.response_type = upload_pb2.UploadResponse.METADATA_RESPONSE
+        for track in request.track:
+            if chance(config['sample_ratio']):
+                challenge = response.metadata_response.signed_challenge_info.add()
+                challenge.challenge_info.client_track_id = track.client_id
+                challenge.challenge_info.start_millis = 0
+                challenge.challenge_info.duration_millis = 15000
+                challenge.signature = b'benchmark'
+            else:
+                response.metadata_response.track_sample_response.extend([track_response(track.client_id)])
+        return response
+
+    def export(body: bytes):
+        request = download_pb2.GetTracksToExportRequest()
+        request.ParseFromString(body)
+        start = int(request.continuation_token or 0)
+        response = download_pb2.GetTracksToExportResponse()
+        response.status = download_pb2.GetTracksToExportResponse.OK
+        for number, track in enumerate(config['tracks'][start:start + LIST_PAGE_SIZE], start):
+            info = response.download_track_info.add()
+            info.id = 'track-%d' % number
+            info.track_size = 0
+            for key, value in track.items():
+                setattr(info, key, value)
+        if start + LIST_PAGE_SIZE < len(config['tracks']):
+            response.continuation_token = str(start + LIST_PAGE_SIZE)
+        return response
+
+    def sample(body: bytes):
+        request = upload_pb2.UploadSampleRequest()
+        request.ParseFromString(body)
+        response = upload_pb2.UploadResponse()
+        response.response_type = upload_pb2.UploadResponse.SAMPLE_RESPONSE
+        for track_sample in request.track_sample:
+            response.sample_response.track_sample_response.extend([track_response(track_sample.track.client_id)])
+        return response
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _body(self) -> bytes:
+            if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0], 16)
+                    chunk = self.rfile.read(size + 2)[:size]
+                    if not size:
+                        return b''.join(chunks)
+                    chunks.append(chunk)
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def _send(self, status: int, body: bytes, content_type: str = 'application/x-protobuf') -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, message: dict) -> None:
+            self._send(200, json.dumps(message).encode(), 'application/json')
+
+        def _handle(self) -> None:
+            path = self.path.split('?')[0]
+            body = self._body()
+            if config['latency']:
+                time.sleep(config['latency'])
+            if path == '/token':
+                return self._json({'access_token': 'benchmark', 'expires_in': 3600, 'token_type': 'Bearer'})
+            if path != '/upsj/upauth' and chance(config['error_rate']):
+                return self._send(503, b'Service Unavailable', 'text/plain')
+            if path == '/upsj/upauth':
+                response = upload_pb2.UploadResponse()
+                response.response_type = upload_pb2.UploadResponse.AUTH_RESPONSE
+                response.auth_status = upload_pb2.UploadResponse.OK
+            elif path == '/upsj/metadata':
+                response = metadata(body)
+            elif path == '/upsj/sample':
+                response = sample(body)
+            elif path == '/music/exportids':
+                response = export(body)
+            elif path == '/upsj/uploadstate':
+                response = upload_pb2.UploadResponse()
+                response.response_type = upload_pb2.UploadResponse.UPDATE_UPLOAD_STATE_RESPONSE
+            elif path == '/uploadsj/scottyagent':
+                if chance(config['session_error_rate']):
+                    return self._json({'errorMessage': {'additionalInfo': {
+                        'uploader_service.GoogleRupioAdditionalInfo': {
+                            'completionInfo': {'customerSpecificInfo': {'ResponseCode': 503}}
+                        }
+                    }}})
+                return self._json({'sessionStatus': {'externalFieldTransfers': [{
+                    'putInfo': {'url': 'http://127.0.0.1:%d/upload/%s' % (self.server.server_port, uuid.uuid4())},
+                    'content_type': 'audio/mpeg',
+                }]}})
+            elif path.startswith('/upload/'):
+                if config['bandwidth']:
+                    time.sleep(len(body) / config['bandwidth'])
+                return self._json({'sessionStatus': {'state': 'FINALIZED'}})
+            else:
+                return self._send(404, b'Not Found', 'text/plain')
+            self._send(200, response.SerializeToString())
+
+        do_POST = _handle
+        do_PUT = _handle
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    ports.put(server.server_port)
+    server.serve_forever()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Synthetic music library: tagged files with random audio, so that every file has its own client id.
+MP3 frames hold random bytes, so mutagen and the uploader handle them like real tracks but they are not playable.
+FLAC files hold random samples and can be decoded, so that they are transcoded like real tracks.
+MP4, ASF and Ogg files of the library are encoded from noise with ffmpeg when it is installed; otherwise, and for
+the parse fixtures, they are written by hand with random payloads that only mutagen reads.
+"""
+
+import os
+import uuid
+import base64
+import random
+import struct
+import shutil
+import subprocess
+
+import mutagen.id3
+import mutagen.asf
+import mutagen.mp4
+import mutagen.ogg
+import mutagen.flac
+import mutagen.oggvorbis
+
+# all but MP3 are transcoded by ffmpeg for the upload
+FORMATS = ('mp3', 'flac', 'm4a', 'wma', 'ogg')
+_BITRATE = 128000
+
+# MPEG-1 Layer III, 128kbps, 44.1kHz, no padding nor CRC: 417 bytes and 1152 samples per frame
+_MP3_HEADER = b'\xff\xfb\x90\x00'
+_MP3_FRAME_SIZE = 417
+_MP3_FRAMES_PER_SECOND = 44100 / 1152
+
+
+def _write_mp3(path: str, duration: float, rng: random.Random, tags: dict) -> None:
+    payload = _MP3_FRAME_SIZE - len(_MP3_HEADER)
+    with open(path, 'wb') as f:
+        for _ in range(max(1, int(duration * _MP3_FRAMES_PER_SECOND))):
+            f.write(_MP3_HEADER)
+            f.write(bytes(rng.getrandbits(8) for _ in range(8)) * (payload // 8) + b'\x00' * (payload % 8))
+    id3 = mutagen.id3.ID3()
+    id3.add(mutagen.id3.TIT2(encoding=3, text=tags['title']))
+    id3.add(mutagen.id3.TPE1(encoding=3, text=tags['artist']))
+    id3.add(mutagen.id3.TALB(encoding=3, text=tags['album']))
+    id3.add(mutagen.id3.TRCK(encoding=3, text=tags['tracknumber']))
+    id3.save(path)
+
+
+def _crc_table(width: int, polynomial: int) -> list:
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial if crc & top else crc << 1) & mask
+        table.append(crc)
+    return table
+
+
+# CRC-8 of the FLAC frame headers and CRC-16 of the whole frames
+_CRC8 = _crc_table(8, 0x07)
+_CRC16 = _crc_table(16, 0x8005)
+_crc16_shifts = {}
+
+
+def _crc16(data: bytes, crc: int = 0) -> int:
+    for byte in data:
+        crc = ((crc << 8) & 0xffff) ^ _CRC16[(crc >> 8) ^ byte]
+    return crc
+
+
+def _crc16_shift(crc: int, length: int) -> int:
+    """
+    :return: the CRC-16 after length zero bytes, a linear map computed once per length on each bit
+    """
+    if length not in _crc16_shifts:
+        _crc16_shifts[length] = [_crc16(bytes(length), 1 << bit) for bit in range(16)]
+    result = 0
+    for bit, shifted in enumerate(_crc16_shifts[length]):
+        if crc >> bit & 1:
+            result ^= shifted
+    return result
+
+
+def _write_flac(path: str, duration: float, rng: random.Random, tags: dict) -> None:
+    sample_rate = 44100
+    block_size = 4096
+    frames = max(1, int(duration * sample_rate / block_size))
+    # STREAMINFO: block sizes, frame sizes, then rate (20 bits), channels - 1 (3), bits - 1 (5), samples (36)
+    packed = (sample_rate << 44) | (1 << 41) | (15 << 36) | (frames * block_size)
+    streaminfo = struct.pack('>HH', block_size, block_size) + b'\x00' * 6 + packed.to_bytes(8, 'big') + b'\x00' * 16
+    # a block of random 16 bits stereo samples, stored as is in VERBATIM subframes and repeated in every frame
+    body = b''.join(b'\x02' + bytes(rng.getrandbits(8) for _ in range(block_size * 2)) for _ in range(2))
+    body_crc = _crc16(body)
+    with open(path, 'wb') as f:
+        f.write(b'fLaC')
+        f.write(bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+        for number in range(frames):
+            # fixed blocks of 4096 samples at 44.1kHz, independent stereo channels, 16 bits, UTF-8 coded frame number
+            header = b'\xff\xf8\xc9\x18' + chr(number).encode('utf-8', 'surrogatepass')
+            crc = 0
+            for byte in header:
+                crc = _CRC8[crc ^ byte]
+            header += bytes([crc])
+            # CRC-16 of the header followed by the body, from the CRC of each since the CRC is linear
+            f.write(header + body + struct.pack('>H', _crc16_shift(_crc16(header), len(body)) ^ body_crc))
+    flac = mutagen.flac.FLAC(path)
+    for key, value in tags.items():
+        flac[key] = value
+    flac.save()
+
+
+def _payload(duration: float, rng: random.Random) -> bytes:
+    # random block repeated up to roughly the size of a 128kbps stream
+    return bytes(rng.getrandbits(8) for _ in range(4096)) * max(1, int(duration * _BITRATE / 8 / 4096))
+
+
+def _atom(name: bytes, payload: bytes, version: int = None) -> bytes:
+    if version is not None:
+        payload = struct.pack('>I', version << 24) + payload
+    return struct.pack('>I4s', 8 + len(payload), name) + payload
+
+
+def _descriptor(tag: int, payload: bytes) -> bytes:
+    return bytes([tag, len(payload)]) + payload
+
+
+def _write_m4a(path: str, duration: float, rng: random.Random, tags: dict) -> None:
+    sample_rate = 44100
+    # AAC LC, 44.1kHz, stereo
+    decoder = _descriptor(4, b'\x40\x15\x00\x00\x00' + struct.pack('>II', _BITRATE, _BITRATE)
+                          + _descriptor(5, b'\x12\x10'))
+    esds = _atom(b'esds', _descriptor(3, b'\x00\x01\x00' + decoder + _descriptor(6, b'\x02')), version=0)
+    mp4a = _atom(b'mp4a', struct.pack('>6xH8xHHHHI', 1, 2, 16, 0, 0, sample_rate << 16) + esds)
+    stbl = _atom(b'stbl', _atom(b'stsd', struct.pack('>I', 1) + mp4a, version=0))
+    mdhd = _atom(b'mdhd', struct.pack('>IIIIHH', 0, 0, sample_rate, int(duration * sample_rate), 0x55c4, 0), version=0)
+    hdlr = _atom(b'hdlr', b'\x00' * 4 + b'soun' + b'\x00' * 12 + b'SoundHandler\x00', version=0)
+    trak = _atom(b'trak', _atom(b'mdia', mdhd + hdlr + _atom(b'minf', stbl)))
+    # rate 1.0, volume 1.0, identity matrix left blank, next track id
+    mvhd = _atom(b'mvhd', struct.pack('>IIIIIH70xI', 0, 0, 1000, int(duration * 1000), 0x10000, 0x100, 2), version=0)
+    with open(path, 'wb') as f:
+        f.write(_atom(b'ftyp', b'M4A \x00\x00\x00\x00M4A mp42isom'))
+        f.write(_atom(b'moov', mvhd + trak))
+        f.write(_atom(b'mdat', _payload(duration, rng)))
+    _tag_m4a(path, tags)
+
+
+def _tag_m4a(path: str, tags: dict) -> None:
+    mp4 = mutagen.mp4.MP4(path)
+    mp4['\xa9nam'] = tags['title']
+    mp4['\xa9ART'] = tags['artist']
+    mp4['\xa9alb'] = tags['album']
+    mp4['trkn'] = [(int(tags['tracknumber']), 0)]
+    mp4.save()
+
+
+def _asf_object(guid: str, payload: bytes) -> bytes:
+    return uuid.UUID(guid).bytes_le + struct.pack('<Q', 24 + len(payload)) + payload
+
+
+def _write_wma(path: str, duration: float, rng: random.Random, tags: dict) -> None:
+    # play duration and send duration in 100ns units, no preroll
+    properties = struct.pack('<40xQQQ16x', int(duration * 10000000), int(duration * 10000000), 0)
+    # WAVEFORMATEX of a WMA v2 stereo stream
+    wave = struct.pack('<HHIIHH', 0x161, 2, 44100, _BITRATE // 8, 0, 16)
+    stream = (
+        uuid.UUID('F8699E40-5B4D-11CF-A8FD-00805F5C442B').bytes_le
+        + uuid.UUID('20FB5700-5B55-11CF-A8FD-00805F5C442B').bytes_le
+        + struct.pack('<QIIHI', 0, len(wave), 0, 1, 0) + wave
+    )
+    objects = (
+        _asf_object('8CABDCA1-A947-11CF-8EE4-00C00C205365', properties)
+        + _asf_object('B7DC0791-A9B7-11CF-8EE6-00C00C205365', stream)
+    )
+    with open(path, 'wb') as f:
+        f.write(uuid.UUID('75B22630-668E-11CF-A6D9-00AA0062CE6C').bytes_le)
+        f.write(struct.pack('<QIBB', 30 + len(objects), 2, 1, 2) + objects)
+        f.write(_asf_object('75B22636-668E-11CF-A6D9-00AA0062CE6C', _payload(duration, rng)))
+    _tag_wma(path, tags)
+
+
+def _tag_wma(path: str, tags: dict) -> None:
+    asf = mutagen.asf.ASF(path)
+    asf['Title'] = tags['title']
+    asf['Author'] = tags['artist']
+    asf['WM/AlbumTitle'] = tags['album']
+    asf['WM/TrackNumber'] = tags['tracknumber']
+    asf.save()
+
+
+def _write_ogg(path: str, duration: float, rng: random.Random, tags: dict) -> None:
+    sample_rate = 44100
+    vendor = b'benchmarks'
+    packets = [
+        b'\x01vorbis' + struct.pack('<IBIiiiBB', 0, 2, sample_rate, 0, _BITRATE, 0, 0xb8, 1),
+        b'\x03vorbis' + struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', 0) + b'\x01',
+        b'\x05vorbis' + b'\x00' * 32,
+    ]
+    block = _payload(0, rng)
+    blocks = max(1, int(duration * _BITRATE / 8 / len(block)))
+    # identification page, comment and setup page, then audio pages ending at their granule position
+    contents = [([packets[0]], 0), (packets[1:], 0)]
+    contents += [([block], int(sample_rate * duration * (number + 1) / blocks)) for number in range(blocks)]
+    with open(path, 'wb') as f:
+        for sequence, (page_packets, position) in enumerate(contents):
+            page = mutagen.ogg.OggPage()
+            page.serial = 1
+            page.sequence = sequence
+            page.position = position
+            page.packets = page_packets
+            page.first = sequence == 0
+            page.last = sequence == len(contents) - 1
+            f.write(page.write())
+    _tag_ogg(path, tags)
+
+
+def _tag_ogg(path: str, tags: dict) -> None:
+    ogg = mutagen.oggvorbis.OggVorbis(path)
+    for key, value in tags.items():
+        ogg[key] = value
+    ogg.save()
+
+
+# ffmpeg encoder, hand written fixture and tagging of the formats encoded from noise
+_ENCODED = {
+    'm4a': ('aac', _write_m4a, _tag_m4a),
+    'wma': ('wmav2', _write_wma, _tag_wma),
+    'ogg': ('libvorbis', _write_ogg, _tag_ogg),
+}
+
+
+def _write_encoded(path: str, duration: float, rng: random.Random, tags: dict) -> None:
+    encoder, write, tag = _ENCODED[os.path.splitext(path)[1][1:].lower()]
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        write(path, duration, rng, tags)
+        return
+    noise = 'anoisesrc=duration=%.3f:seed=%d:amplitude=0.3' % (duration, rng.getrandbits(31))
+    subprocess.run(
+        [ffmpeg, '-nostdin', '-v', 'error', '-y', '-f', 'lavfi', '-i', noise, '-ac', '2', '-ar', '44100',
+         '-c:a', encoder, '-b:a', '%dk' % (_BITRATE // 1000), path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+    )
+    tag(path, tags)
+
+
+def _embed_cover(path: str, cover: bytes) -> None:
+    audio = mutagen.File(path)
+    if isinstance(audio, mutagen.mp4.MP4):
+        audio['covr'] = [mutagen.mp4.MP4Cover(cover, mutagen.mp4.MP4Cover.FORMAT_JPEG)]
+    elif isinstance(audio, mutagen.asf.ASF):
+        # WM/Picture: type, size, mime type and description as null-terminated UTF-16, data
+        description = 'image/jpeg\x00\x00'.encode('utf-16-le')
+        picture = struct.pack('<BI', 3, len(cover)) + description + cover
+        audio['WM/Picture'] = [mutagen.asf.ASFByteArrayAttribute(picture)]
+    else:
+        picture = mutagen.flac.Picture()
+        picture.type = 3
+        picture.mime = 'image/jpeg'
+        picture.data = cover
+        if isinstance(audio, mutagen.flac.FLAC):
+            audio.add_picture(picture)
+        elif isinstance(audio, mutagen.oggvorbis.OggVorbis):
+            audio['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+        else:
+            audio.tags.add(mutagen.id3.APIC(encoding=3, mime='image/jpeg', type=3, desc='', data=cover))
+    audio.save()
+
+
+def tagged_track(path: str, duration: float = 30.0, cover: bytes = None, seed: int = 0) -> None:
+    """
+    Writes a tagged track in the format of its extension, among FORMATS, without ffmpeg
+    :param path: Path to the track
+    :param duration: Float. duration in seconds. 30 by default
+    :param cover: Bytes. front cover to embed, None for no cover. None by default
+    :param seed: Integer. seed of the payload. 0 by default
+    """
+    writers = {'mp3': _write_mp3, 'flac': _write_flac, 'm4a': _write_m4a, 'wma': _write_wma, 'ogg': _write_ogg}
+    tags = {'title': 'Track', 'artist': 'Artist', 'album': 'Album', 'tracknumber': '1'}
+    writers[os.path.splitext(path)[1][1:].lower()](path, duration, random.Random(seed), tags)
+    if cover:
+        _embed_cover(path, cover)
+
+
+def sized_mp3s(directory: str, count: int, size: int, seed: int = 0) -> list:
+    """
+    Writes tagged MP3 tracks of a given size in a single album, e.g. long DJ mixes
+    :param directory: Directory of the album, created when missing
+    :param count: Integer. number of tracks
+    :param size: Integer. approximate size of each track in bytes
+    :param seed: Integer. seed of the payloads. 0 by default
+    :return: list of the written paths
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for number in range(count):
+        tags = {'title': 'Mix %d' % number, 'artist': 'DJ', 'album': 'Mixes', 'tracknumber': str(number + 1)}
+        path = os.path.join(directory, '%02d %s.mp3' % (number + 1, tags['title']))
+        _write_mp3(path, size / _MP3_FRAME_SIZE / _MP3_FRAMES_PER_SECOND, rng, tags)
+        paths.append(path)
+    return paths
+
+
+def empty_tree(
+    directory: str,
+    entries: int,
+    per_directory: int = 100,
+    audio_ratio: float = 0.8,
+    seed: int = 0,
+) -> int:
+    """
+    Writes a tree of empty files laid out as <artist>/<album>/<file>, for the scanners which never read the files.
+    Albums also hold non-audio files (covers, cue sheets, logs), as real libraries do
+    :param directory: Root of the tree, created when missing
+    :param entries: Integer. number of files and directories to create
+    :param per_directory: Integer. files per album directory. 100 by default
+    :param audio_ratio: Float. share of audio files among the files. 0.8 by default
+    :param seed: Integer. seed of the file types. 0 by default
+    :return: number of audio files written
+    """
+    rng = random.Random(seed)
+    audio_extensions = ('.mp3', '.flac', '.m4a', '.ogg')
+    other_extensions = ('.jpg', '.cue', '.log', '.txt')
+    created = 0
+    audio = 0
+    artist = 0
+    while created < entries:
+        artist_directory = os.path.join(directory, 'Artist %d' % artist)
+        os.makedirs(artist_directory, exist_ok=True)
+        created += 1
+        for album in range(10):
+            if created >= entries:
+                break
+            album_directory = os.path.join(artist_directory, 'Album %d' % album)
+            os.mkdir(album_directory)
+            created += 1
+            for number in range(min(per_directory, entries - created)):
+                if rng.random() < audio_ratio:
+                    extension = rng.choice(audio_extensions)
+                    audio += 1
+                else:
+                    extension = rng.choice(other_extensions)
+                open(os.path.join(album_directory, '%03d%s' % (number, extension)), 'wb').close()
+                created += 1
+        artist += 1
+    return audio
+
+
+def generate(
+    directory: str,
+    count: int,
+    formats: tuple = FORMATS,
+    duration: float = 30.0,
+    seed: int = 0,
+) -> list:
+    """
+    Writes a library laid out as <artist>/<album>/<track>.<ext>
+    :param directory: Root of the library, created when missing
+    :param count: Integer. number of tracks
+    :param formats: tuple of extensions among FORMATS, used in turn. FORMATS by default.
+        MP4, ASF and Ogg tracks are encoded with ffmpeg when it is installed
+    :param duration: Float. mean track duration in seconds, each track lasting between half and 1.5 times it.
+        30 by default
+    :param seed: Integer. seed of the payloads and durations. 0 by default
+    :return: list of the written paths
+    """
+    writers = {'mp3': _write_mp3, 'flac': _write_flac, 'm4a': _write_encoded, 'wma': _write_encoded,
+               'ogg': _write_encoded}
+    rng = random.Random(seed)
+    paths = []
+    for number in range(count):
+        extension = formats[number % len(formats)]
+        tags = {
+            'title': 'Track %d' % number,
+            'artist': 'Artist %d' % (number // 100),
+            'album': 'Album %d' % (number // 10),
+            'tracknumber': str(number % 10 + 1),
+        }
+        album_directory = os.path.join(directory, tags['artist'], tags['album'])
+        os.makedirs(album_directory, exist_ok=True)
+        path = os.path.join(album_directory, '%02d %s.%s' % (number % 10 + 1, tags['title'], extension))
+        writers[extension](path, duration * rng.uniform(0.5, 1.5), rng, tags)
+        paths.append(path)
+    return paths
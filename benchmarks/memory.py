@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Measures the memory of Manager.upload against the size of the uploaded files: MP3 tracks of growing size are
+uploaded to a local FakeMusicManager, one per worker, and the peak of Python allocations and the growth of the
+peak RSS are reported for each size.
+Run from the repository root: python -m benchmarks.memory --help
+"""
+
+import os
+import json
+import logging
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+from google_music_manager_uploader.manager import Manager
+from benchmarks.fake_server import FakeMusicManager, redirect, write_credentials
+from benchmarks.library import sized_mp3s
+from benchmarks.upload import UPLOADER_ID
+
+MIB = 1024 * 1024
+
+
+def measure(api: Manager, paths: list, workers: int) -> dict:
+    """
+    :return: files uploaded, peak traced memory and peak RSS growth in MiB while uploading paths
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    uploaded, matched, not_uploaded = api.upload(paths, workers=workers)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'file_mib': sum(os.path.getsize(path) for path in paths) / len(paths) / MIB,
+        'uploaded': len(uploaded),
+        'not_uploaded': len(not_uploaded),
+        'peak_mib': peak / MIB,
+        # ru_maxrss is in KiB on Linux; only rises past the peak of the previous, smaller, sizes
+        'rss_growth_mib': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the upload memory against the file size")
+    parser.add_argument("--sizes", default='8,32,128',
+                        help="Comma separated sizes of the tracks in MiB, in increasing order (default: 8,32,128)")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="Tracks uploaded concurrently, one track per worker (default: 2)")
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds added to every answer (default: 0.01)")
+    parser.add_argument("--json", action='store_true', help="Print the results as JSON (default: False)")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir, FakeMusicManager(latency=args.latency, match_ratio=0) as server, \
+            redirect(server.url):
+        oauth_path = os.path.join(tmp_dir, 'oauth')
+        write_credentials(oauth_path, server.url)
+        api = Manager()
+        if not api.login(oauth_path, UPLOADER_ID):
+            raise ValueError("Could not log in to the fake server")
+        for size in (int(size) for size in args.sizes.split(',')):
+            directory = os.path.join(tmp_dir, '%d MiB' % size)
+            paths = sized_mp3s(directory, args.workers, size * MIB, seed=size)
+            results[size] = measure(api, paths, args.workers)
+            for path in paths:
+                os.remove(path)
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+        return
+    print("%10s %10s %12s %12s" % ('file', 'uploaded', 'peak', 'rss growth'))
+    for result in results.values():
+        print("%7.1fMiB %10d %9.1fMiB %9.1fMiB" % (
+            result['file_mib'], result['uploaded'], result['peak_mib'], result['rss_growth_mib'],
+        ))
+
+
+if __name__ == "__main__":
+    main()
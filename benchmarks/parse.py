@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Measures the parsing of the tags of a track before its upload, for each format of the fixtures: time and bytes
+read per track when the file is parsed once for the Track and the album art, against the former two parses.
+The client id, which hashes a stripped copy of the whole file either way, is timed on its own.
+Run from the repository root: python -m benchmarks.parse --help
+"""
+
+import os
+import json
+import time
+import random
+import builtins
+import argparse
+import tempfile
+import contextlib
+
+import mutagen
+
+from google_music_manager_uploader.artwork import extract_album_art
+from google_music_manager_uploader.manager import MyUploadMetadata
+from benchmarks.library import FORMATS, tagged_track
+
+
+class _Metadata(MyUploadMetadata):
+    # the client id is measured apart
+    get_track_clientid = staticmethod(lambda filepath: '')
+
+
+class _CountingFile:
+    """
+    File object counting the bytes read from it
+    """
+
+    def __init__(self, file, counter: list) -> None:
+        self._file = file
+        self._counter = counter
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        self._counter[0] += len(data)
+        return data
+
+    def readinto(self, buffer):
+        size = self._file.readinto(buffer)
+        self._counter[0] += size or 0
+        return size
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+
+
+@contextlib.contextmanager
+def count_reads(paths: list):
+    """
+    Counts the bytes read from paths through open() while the context is active
+    :return: a list holding the count
+    """
+    counter = [0]
+    watched = {os.path.abspath(path) for path in paths}
+    original = builtins.open
+
+    def counting_open(file, *args, **kwargs):
+        opened = original(file, *args, **kwargs)
+        if isinstance(file, (str, bytes, os.PathLike)) and os.path.abspath(os.fsdecode(file)) in watched:
+            return _CountingFile(opened, counter)
+        return opened
+
+    builtins.open = counting_open
+    try:
+        yield counter
+    finally:
+        builtins.open = original
+
+
+def parse_twice(path: str) -> None:
+    """
+    Former parsing: the Track parses the file, then the album art parses it again
+    """
+    _Metadata.fill_track_info(path)
+    extract_album_art(mutagen.File(path, easy=True))
+
+
+def parse_once(path: str) -> None:
+    """
+    Current parsing: one mutagen object for the Track and the album art
+    """
+    audio = mutagen.File(path, easy=True)
+    _Metadata.fill_track_info(path, audio)
+    extract_album_art(audio)
+
+
+def measure(function, paths: list, repeat: int) -> dict:
+    """
+    :return: mean seconds and bytes read per track of function over paths, the best of repeat runs
+    """
+    best = None
+    for _ in range(repeat):
+        with count_reads(paths) as counter:
+            start = time.perf_counter()
+            for path in paths:
+                function(path)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'ms': best / len(paths) * 1000, 'bytes': counter[0] // len(paths)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the tag parsing per track and per format")
+    parser.add_argument("--formats", default=','.join(FORMATS),
+                        help="Comma separated formats of the fixtures (default: %s)" % ','.join(FORMATS))
+    parser.add_argument("--files", type=int, default=20, help="Tracks per format (default: 20)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Track duration in seconds (default: 30)")
+    parser.add_argument("--cover", type=int, default=512,
+                        help="Size of the embedded front cover in KiB, 0 for none (default: 512)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each measure, the best is kept (default: 3)")
+    parser.add_argument("--json", action='store_true', help="Print the results as JSON (default: False)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    # a JPEG start of image marker then noise, enough for the uploader which never decodes covers
+    cover = b'\xff\xd8\xff\xe0' + bytes(rng.getrandbits(8) for _ in range(args.cover * 1024)) if args.cover else None
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for extension in args.formats.split(','):
+            paths = [os.path.join(tmp_dir, '%02d.%s' % (number, extension)) for number in range(args.files)]
+            for seed, path in enumerate(paths):
+                tagged_track(path, args.duration, cover, seed)
+            start = time.perf_counter()
+            for path in paths:
+                MyUploadMetadata.get_track_clientid(path)
+            results[extension] = {
+                'file_bytes': sum(os.path.getsize(path) for path in paths) // len(paths),
+                'client_id_ms': (time.perf_counter() - start) / len(paths) * 1000,
+                'twice': measure(parse_twice, paths, args.repeat),
+                'once': measure(parse_once, paths, args.repeat),
+            }
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+        return
+    print("%-6s %10s %10s %10s %12s %10s %12s" % (
+        'format', 'file', 'client id', 'twice', 'read twice', 'once', 'read once',
+    ))
+    for extension, result in results.items():
+        print("%-6s %10d %8.2fms %8.2fms %12d %8.2fms %12d" % (
+            extension, result['file_bytes'], result['client_id_ms'], result['twice']['ms'],
+            result['twice']['bytes'], result['once']['ms'], result['once']['bytes'],
+        ))
+
+
+if __name__ == "__main__":
+    main()
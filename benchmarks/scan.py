@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Measures the library scanner on a synthetic tree of empty files: time until the first audio file is found,
+total time, entries per second and peak memory, against the glob listing it replaced.
+Run from the repository root: python -m benchmarks.scan --help
+"""
+
+import os
+import glob
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from google_music_manager_uploader.scanner import scan, is_audio
+from benchmarks.library import empty_tree
+
+
+def glob_scan(directory: str):
+    """
+    Former listing: every entry of the tree in a list, then filtered by extension and file type
+    """
+    for path in glob.glob(os.path.join(directory, '**', '*'), recursive=True):
+        if is_audio(path) and os.path.isfile(path):
+            yield path
+
+
+def measure(function, directory: str) -> dict:
+    """
+    :param function: callable yielding the audio files of a directory
+    :return: seconds until the first file, total seconds, number of files, peak traced memory in MiB
+    """
+    start = time.perf_counter()
+    first = None
+    files = 0
+    for _ in function(directory):
+        if first is None:
+            first = time.perf_counter() - start
+        files += 1
+    elapsed = time.perf_counter() - start
+    # traced in a second run, tracing slows the walk down
+    tracemalloc.start()
+    for _ in function(directory):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'first_file_seconds': first,
+        'seconds': elapsed,
+        'files': files,
+        'files_per_second': files / elapsed if elapsed else 0,
+        'peak_mib': peak / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the library scanner")
+    parser.add_argument("--entries", type=int, default=1000000,
+                        help="Files and directories of the synthetic tree (default: 1000000)")
+    parser.add_argument("--per_directory", type=int, default=100, help="Files per album directory (default: 100)")
+    parser.add_argument("--audio_ratio", type=float, default=0.8, help="Share of audio files (default: 0.8)")
+    parser.add_argument("--directory", default=None,
+                        help="Tree to scan, generated when missing or empty and kept afterwards "
+                             "(default: a temporary directory)")
+    parser.add_argument("--no_glob", action='store_true', help="Do not measure the former glob listing "
+                                                               "(default: False)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the tree (default: 0)")
+    parser.add_argument("--json", action='store_true', help="Print the results as JSON (default: False)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        directory = args.directory or os.path.join(tmp_dir, 'library')
+        if not os.path.isdir(directory) or not os.listdir(directory):
+            start = time.perf_counter()
+            empty_tree(directory, args.entries, args.per_directory, args.audio_ratio, args.seed)
+            if not args.json:
+                print("Tree of %d entries written in %.1fs" % (args.entries, time.perf_counter() - start))
+        results = {'scandir': measure(scan, directory)}
+        if not args.no_glob:
+            results['glob'] = measure(glob_scan, directory)
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+        return
+    print("%-8s %12s %12s %10s %14s %10s" % ('scanner', 'first file', 'total', 'files', 'files/s', 'peak'))
+    for name, result in results.items():
+        print("%-8s %11.4fs %11.2fs %10d %14.0f %7.1fMiB" % (
+            name,
+            result['first_file_seconds'] or 0,
+            result['seconds'],
+            result['files'],
+            result['files_per_second'],
+            result['peak_mib'],
+        ))
+
+
+if __name__ == "__main__":
+    main()
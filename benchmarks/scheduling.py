@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Simulates the upload of a synthetic library under every scheduling policy, on a virtual clock, and compares
+the time until the first album is completely playable, the album completion latencies and the makespan.
+Run from the repository root: python -m benchmarks.scheduling --help
+"""
+
+import json
+import random
+import argparse
+from types import SimpleNamespace
+
+from google_music_manager_uploader.scheduler import PendingFiles, POLICIES
+
+ROOT = '/library'
+
+
+def synthetic_library(
+    folders: int,
+    albums: int,
+    tracks: int,
+    mixes: int,
+    mix_size: float,
+    new_albums: int,
+    arrival_window: float,
+    seed: int,
+) -> list:
+    """
+    :return: list of (arrival time, path, size, album) sorted by arrival, album being None for mixes.
+        The library present at startup arrives at time 0 in scan order, with large mixes first in their folder,
+        then new albums arrive during the window
+    """
+    rng = random.Random(seed)
+    files = []
+    for number in range(albums + new_albums):
+        # a few folders hold most albums, as artist folders of a real library do
+        folder = 'Folder %d' % min(folders - 1, int(rng.paretovariate(1.5)) - 1)
+        album = '%s/%s/Album %d' % (ROOT, folder, number)
+        arrival = 0.0 if number < albums else rng.uniform(0, arrival_window)
+        for track in range(tracks):
+            size = max(1, rng.lognormvariate(15.9, 0.4))  # about 8MB
+            files.append((arrival, '%s/%02d Track.mp3' % (album, track + 1), size, album))
+    for number in range(mixes):
+        files.append((0.0, '%s/Folder 0/A Mixes/mix %d.mp3' % (ROOT, number), mix_size, None))
+    return sorted(files, key=lambda item: (item[0], item[1]))
+
+
+def simulate(files: list, policy: str, aging: float, batch_size: int, bandwidth: float, overhead: float) -> dict:
+    """
+    Uploads the files one batch at a time: each file costs its size over the bandwidth plus a fixed overhead
+    :return: time to the first complete album, mean and 95th percentile of the time from the arrival of an album
+        to its completion, mean of this time for the albums added while uploading, makespan
+    """
+    now = [0.0]
+    sizes = {path: size for _, path, size, _ in files}
+    pending = PendingFiles(
+        policy,
+        aging,
+        root=ROOT,
+        stat=lambda path: SimpleNamespace(st_size=sizes[path], st_mtime=arrivals[path]),
+        clock=lambda: now[0],
+    )
+    arrivals = {path: arrival for arrival, path, _, _ in files}
+    albums = {}  # {album: [arrival, files left]}
+    for arrival, _, _, album in files:
+        if album:
+            albums.setdefault(album, [arrival, 0])[1] += 1
+    album_of = {path: album for _, path, _, album in files}
+    completed = {}  # {album: latency}
+    first_album = None
+    index = 0
+    while index < len(files) or len(pending):
+        while index < len(files) and files[index][0] <= now[0]:
+            pending.add(files[index][1])
+            index += 1
+        if not len(pending):
+            now[0] = files[index][0]
+            continue
+        for path in pending.pop(batch_size):
+            now[0] += sizes[path] / bandwidth + overhead
+            album = album_of[path]
+            if album is None:
+                continue
+            albums[album][1] -= 1
+            if not albums[album][1]:
+                completed[album] = now[0] - albums[album][0]
+                if first_album is None:
+                    first_album = now[0]
+    latencies = sorted(completed.values())
+    new_latencies = [latency for album, latency in completed.items() if albums[album][0] > 0] or [0]
+    return {
+        'first_album_seconds': first_album,
+        'mean_album_latency_seconds': sum(latencies) / len(latencies),
+        'new_album_latency_seconds': sum(new_latencies) / len(new_latencies),
+        'p95_album_latency_seconds': latencies[int(len(latencies) * 0.95) - 1],
+        'makespan_seconds': now[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulation of the upload scheduling policies")
+    parser.add_argument("--folders", type=int, default=8, help="Top-level folders of the library (default: 8)")
+    parser.add_argument("--albums", type=int, default=200, help="Albums present at startup (default: 200)")
+    parser.add_argument("--tracks", type=int, default=10, help="Tracks per album (default: 10)")
+    parser.add_argument("--mixes", type=int, default=3, help="Large mixes in the first folder (default: 3)")
+    parser.add_argument("--mix_size", type=float, default=2e9, help="Bytes of each mix (default: 2e9)")
+    parser.add_argument("--new_albums", type=int, default=50,
+                        help="Albums added while the library uploads (default: 50)")
+    parser.add_argument("--arrival_window", type=float, default=7200,
+                        help="Seconds during which new albums arrive (default: 7200)")
+    parser.add_argument("--batch_size", type=int, default=25, help="Files per upload call (default: 25)")
+    parser.add_argument("--bandwidth", type=float, default=2e6, help="Upload bytes per second (default: 2e6)")
+    parser.add_argument("--overhead", type=float, default=1.0,
+                        help="Seconds of Google calls per file besides the transfer (default: 1)")
+    parser.add_argument("--aging", type=float, default=3600,
+                        help="Aging of the policies, 0 to disable (default: 3600)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the library (default: 0)")
+    parser.add_argument("--json", action='store_true', help="Print the results as JSON (default: False)")
+    args = parser.parse_args()
+
+    files = synthetic_library(
+        args.folders, args.albums, args.tracks, args.mixes, args.mix_size, args.new_albums, args.arrival_window,
+        args.seed,
+    )
+    results = {
+        policy: simulate(files, policy, args.aging, args.batch_size, args.bandwidth, args.overhead)
+        for policy in POLICIES
+    }
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+        return
+    print("%-10s %14s %14s %14s %14s %14s" % (
+        'policy', 'first album', 'mean latency', 'p95 latency', 'new albums', 'makespan'
+    ))
+    for policy, result in results.items():
+        print("%-10s %13.0fs %13.0fs %13.0fs %13.0fs %13.0fs" % (
+            policy,
+            result['first_album_seconds'],
+            result['mean_album_latency_seconds'],
+            result['p95_album_latency_seconds'],
+            result['new_album_latency_seconds'],
+            result['makespan_seconds'],
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Measures the startup of the command line entry points: the import time of their modules, read from
+python -X importtime, and the wall time of running them with --help.
+Run from the repository root: python -m benchmarks.startup --help
+"""
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ENTRY_POINTS = {
+    'google-music-upload': 'google_music_manager_uploader.uploader_daemon',
+    'google-music-upload-deduplicate': 'google_music_manager_uploader.deduplicate',
+}
+
+
+def import_times(module: str) -> dict:
+    """
+    Imports a module in a fresh interpreter
+    :param module: dotted name of the module
+    :return: {imported module: cumulative import time in seconds}
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        times[name] = max(times.get(name, 0), int(cumulative) / 1000000)
+    return times
+
+
+def help_time(module: str, repeat: int) -> float:
+    """
+    :return: best wall time in seconds of running the module with --help
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', module, '--help'], stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark of the command line entry points")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each command, the best is kept (default: 5)")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest imports listed per command (default: 10)")
+    parser.add_argument("--json", action='store_true', help="Print the results as JSON (default: False)")
+    args = parser.parse_args()
+
+    results = {}
+    for command, module in sorted(ENTRY_POINTS.items()):
+        times = import_times(module)
+        heaviest = sorted(
+            ((name, seconds) for name, seconds in times.items() if name != module and '.' not in name),
+            key=lambda item: item[1], reverse=True,
+        )
+        results[command] = {
+            'import_seconds': times.get(module, 0),
+            'help_seconds': help_time(module, max(1, args.repeat)),
+            'modules': len(times),
+            'heaviest': heaviest[:args.top],
+        }
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+        return
+    for command, result in sorted(results.items()):
+        print("%s: import %.3fs, --help %.3fs, %d modules" % (
+            command, result['import_seconds'], result['help_seconds'], result['modules']
+        ))
+        for name, seconds in result['heaviest']:
+            print("    %-30s %.3fs" % (name, seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Measures Manager.upload or the oneshot daemon against a local FakeMusicManager and a synthetic library.
+Run from the repository root: python -m benchmarks.upload --help
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import resource
+import tempfile
+
+from google_music_manager_uploader import metrics
+from google_music_manager_uploader.manager import Manager
+from google_music_manager_uploader import uploader_daemon
+from google_music_manager_uploader.scheduler import POLICIES
+from google_music_manager_uploader.remote_library import file_key
+from google_music_manager_uploader.bandwidth import BandwidthLimiter, parse_rate
+from benchmarks.fake_server import FakeMusicManager, redirect, write_credentials
+from benchmarks.library import generate, FORMATS
+
+UPLOADER_ID = '00:11:22:33:AA:BB'
+
+
+def run_manager(paths: list, oauth_path: str, batch_size: int, workers: int, upload_rate: float) -> dict:
+    api = Manager()
+    if not api.login(oauth_path, UPLOADER_ID):
+        raise ValueError("Could not log in to the fake server")
+    api.bandwidth = BandwidthLimiter(upload_rate) if upload_rate else None
+    results = {'uploaded': 0, 'matched': 0, 'not_uploaded': 0}
+    for start in range(0, len(paths), batch_size):
+        uploaded, matched, not_uploaded = api.upload(paths[start:start + batch_size], True, workers=workers)
+        results['uploaded'] += len(uploaded)
+        results['matched'] += len(matched)
+        results['not_uploaded'] += len(not_uploaded)
+    return results
+
+
+def account_tracks(paths: list, ratio: float, seed: int) -> list:
+    """
+    :return: tags of a share of the library, as listed by the fake server for tracks already in the account
+    """
+    rng = random.Random(seed)
+    tracks = []
+    for path in paths:
+        if rng.random() >= ratio:
+            continue
+        # the tags as read by the uploader, which takes the file name for the title of ASF files
+        title, artist, album, _, track_number, _ = file_key(path)
+        tracks.append({'title': title, 'artist': artist, 'album': album, 'track_number': track_number})
+    return tracks
+
+
+def run_daemon(
+    directory: str,
+    oauth_path: str,
+    batch_size: int,
+    workers: int,
+    engine: str,
+    index: str,
+    presync: bool,
+    policy: str,
+    upload_rate: float,
+) -> dict:
+    try:
+        uploader_daemon.upload(
+            directory, oauth_path, uploader_id=UPLOADER_ID, oneshot=True, batch_size=batch_size, batch_wait=0.5,
+            workers=workers, index=index, metrics_interval=0, engine=engine, presync=presync, policy=policy,
+            upload_rate=upload_rate,
+        )
+    except SystemExit:
+        pass
+    return {labels['result']: int(value) for _, labels, value in metrics.files.samples()}
+
+
+def measure(function) -> dict:
+    """
+    :param function: callable returning a dict of results
+    :return: the results with the wall time, CPU time and bytes sent while it ran
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    bytes_sent = metrics.bytes_sent.total()
+    start = time.perf_counter()
+    results = function()
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss = after.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    results.update({
+        'seconds': elapsed,
+        'cpu_seconds': (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime),
+        'bytes_sent': metrics.bytes_sent.total() - bytes_sent,
+        'peak_rss_mib': peak_rss / 1024 / 1024,
+    })
+    results['handled'] = sum(results.get(key, 0) for key in ('uploaded', 'matched', 'not_uploaded', 'skipped'))
+    results['files_per_second'] = results['handled'] / elapsed if elapsed else 0
+    results['bytes_per_second'] = results['bytes_sent'] / elapsed if elapsed else 0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload benchmark against a local fake Music Manager server")
+    parser.add_argument("--mode", choices=['manager', 'daemon'], default='manager',
+                        help="Measure Manager.upload or the oneshot daemon (default: manager)")
+    parser.add_argument("--files", type=int, default=100, help="Number of synthetic tracks (default: 100)")
+    parser.add_argument("--formats", default=','.join(FORMATS),
+                        help="Comma separated formats of the tracks, non-MP3 ones need ffmpeg (default: %s)"
+                        % ','.join(FORMATS))
+    parser.add_argument("--duration", type=float, default=30.0, help="Mean track duration in seconds (default: 30)")
+    parser.add_argument("--library", default=None,
+                        help="Directory of the synthetic library, kept between runs (default: temporary directory)")
+    parser.add_argument("--batch_size", type=int, default=25, help="Files per upload call (default: 25)")
+    parser.add_argument("--workers", type=int, default=1, help="Tracks uploaded concurrently (default: 1)")
+    parser.add_argument("--engine", choices=['threads', 'asyncio'], default='threads',
+                        help="Daemon upload engine (default: threads)")
+    parser.add_argument("--index", action='store_true', help="Keep a local index in daemon mode (default: False)")
+    parser.add_argument("--policy", choices=POLICIES, default='fifo',
+                        help="Order of the uploads in daemon mode (default: fifo)")
+    parser.add_argument("--presync", action='store_true',
+                        help="List the account tracks first in daemon mode (default: False)")
+    parser.add_argument("--uploaded_ratio", type=float, default=0.0,
+                        help="Share of the library already in the account (default: 0)")
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds added to every answer (default: 0.01)")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Share of calls failing with 503 (default: 0)")
+    parser.add_argument("--session_error_rate", type=float, default=0.0,
+                        help="Share of upload sessions refused as still syncing (default: 0)")
+    parser.add_argument("--match_ratio", type=float, default=0.2, help="Share of matched tracks (default: 0.2)")
+    parser.add_argument("--sample_ratio", type=float, default=0.0,
+                        help="Share of tracks asked for a scan and match sample, needs ffmpeg (default: 0)")
+    parser.add_argument("--bandwidth", type=float, default=0,
+                        help="Upload bytes per second accepted by the server, 0 for unlimited (default: 0)")
+    parser.add_argument("--upload_rate", type=parse_rate, default=0,
+                        help="Upload bytes per second allowed by the uploader, 0 for unlimited (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the library and of the answers (default: 0)")
+    parser.add_argument("--json", action='store_true', help="Print the results as JSON (default: False)")
+    parser.add_argument("--verbose", action='store_true', help="Keep the uploader logs (default: False)")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        library = args.library or os.path.join(tmp_dir, 'library')
+        formats = tuple(args.formats.split(','))
+        if os.path.isdir(library) and os.listdir(library):
+            paths = sorted(
+                os.path.join(root, name) for root, _, names in os.walk(library) for name in names
+            )
+        else:
+            paths = generate(library, args.files, formats, args.duration, args.seed)
+        server = FakeMusicManager(
+            latency=args.latency,
+            error_rate=args.error_rate,
+            session_error_rate=args.session_error_rate,
+            match_ratio=args.match_ratio,
+            sample_ratio=args.sample_ratio,
+            bandwidth=args.bandwidth,
+            seed=args.seed,
+            tracks=account_tracks(paths, args.uploaded_ratio, args.seed),
+        )
+        with server, redirect(server.url):
+            oauth_path = os.path.join(tmp_dir, 'oauth')
+            write_credentials(oauth_path, server.url)
+            if args.mode == 'manager':
+                results = measure(
+                    lambda: run_manager(paths, oauth_path, args.batch_size, args.workers, args.upload_rate)
+                )
+            else:
+                index = os.path.join(tmp_dir, 'index.sqlite') if args.index else None
+                results = measure(
+                    lambda: run_daemon(
+                        library, oauth_path, args.batch_size, args.workers, args.engine, index, args.presync,
+                        args.policy, args.upload_rate,
+                    )
+                )
+    results['files'] = len(paths)
+    # files of batches given up after their last retry
+    results['failed'] = len(paths) - results['handled']
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+        return
+    for key in sorted(results):
+        value = results[key]
+        print("%-18s %s" % (key, '%.2f' % value if isinstance(value, float) else value))
+
+
+if __name__ == "__main__":
+    main()
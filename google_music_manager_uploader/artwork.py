@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import io
+import os
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+import mutagen
+import mutagen.asf
+import mutagen.easyid3
+import mutagen.easymp4
+import mutagen.flac
+import mutagen.mp3
+import mutagen.mp4
+import mutagen.oggvorbis
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, only needed to downscale covers
+    Image = None
+
+FOLDER_IMAGES = (
+    'cover.jpg', 'cover.jpeg', 'cover.png',
+    'folder.jpg', 'folder.jpeg', 'folder.png',
+    'front.jpg', 'front.jpeg', 'front.png',
+    'album.jpg', 'albumart.jpg',
+)
+
+
+def _id3_album_art(id3, key):
+    # Search through all the APIC frames to find the cover (type 3).
+    covers = [pic.data for pic in id3.getall('APIC') if pic.type == 3]
+    if not covers:
+        raise KeyError(key)
+    return covers
+
+
+def _mp4_album_art(tags, key):
+    if 'covr' not in tags:
+        raise KeyError(key)
+    return [bytes(cover) for cover in tags['covr']]
+
+
+# Easy tags hide the raw frames; expose the cover so files are never parsed twice.
+mutagen.easyid3.EasyID3.RegisterKey('albumart', _id3_album_art)
+mutagen.easymp4.EasyMP4Tags.RegisterKey('albumart', _mp4_album_art)
+
+
+def extract_album_art(audio):
+    """Return the embedded front cover of a file parsed with ``mutagen.File(path, easy=True)``,
+    or ``None`` if it has none."""
+
+    if audio is None or audio.tags is None:
+        return None
+
+    if isinstance(audio, (mutagen.mp3.MP3, mutagen.mp4.MP4)):
+        if 'albumart' in audio.tags:
+            return audio.tags['albumart'][0]
+    elif isinstance(audio, mutagen.flac.FLAC):
+        # Search through all the picture frames to find the cover (type 3).
+        for pic in audio.pictures:
+            if pic.type == 3:
+                return pic.data
+    elif isinstance(audio, mutagen.asf.ASF):
+        if 'WM/Picture' in audio.tags:
+            # Search through all the WM/Picture frames to find the cover (type 3).
+            for pic in audio.tags['WM/Picture']:
+                data = bytes(getattr(pic, 'value', pic))
+                if data[0] == 3:
+                    # Parse out the image data according to the WM_PICTURE spec:
+                    # 1 byte type + 4 bytes data length + null-terminated mime +
+                    # null-terminated description + data
+                    pos = 5
+                    while data[pos:pos + 2] != b"\x00\x00":
+                        pos += 2
+                    pos += 2
+                    while data[pos:pos + 2] != b"\x00\x00":
+                        pos += 2
+
+                    return data[pos + 2:]
+    elif isinstance(audio, mutagen.oggvorbis.OggVorbis):
+        if 'metadata_block_picture' in audio:
+            # Search through all the picture frames to find the cover (type 3).
+            for pic in audio['metadata_block_picture']:
+                # Mutagen does not parse out the picture fields to attributes
+                # like with FLAC, so we use the FLAC Picture class to do so.
+                # Picture blocks are base64 encoded in Ogg Vorbis.
+                picture = mutagen.flac.Picture(base64.b64decode(pic))
+
+                if picture.type == 3:
+                    return picture.data
+
+    return None
+
+
+class AlbumArtCache:
+    """
+    Content addressed cache of album covers.
+    Identical covers are stored once whatever the number of tracks carrying them,
+    the cover of an album is extracted from its first track only,
+    folder images (cover.jpg and similar) are read once per directory,
+    and oversized covers can be downscaled before being sent (requires Pillow).
+    """
+
+    def __init__(self, max_size: int = 0, capacity: int = 256) -> None:
+        """
+        :param max_size: Integer. covers wider or taller than this many pixels are downscaled, 0 to disable
+        :param capacity: Integer. maximum number of covers kept in memory. 256 by default
+        """
+        self.max_size = max_size
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()  # {sha1: image}
+        self._albums = {}  # {(directory, album): sha1}
+        self._folders = {}  # {directory: sha1 or None}
+        self._lock = threading.Lock()
+
+    def get(self, file_path: str, audio):
+        """
+        :param file_path: Path to the track
+        :param audio: the track parsed with mutagen.File(path, easy=True)
+        :return: the album cover to send for this track, None if it has none
+        """
+        directory = os.path.dirname(file_path)
+        album = None
+        if audio is not None and audio.tags is not None and 'album' in audio.tags:
+            album = (directory, str(audio.tags['album'][0]))
+            image = self._lookup(self._albums.get(album))
+            if image is not None:
+                self.hits += 1
+                return image
+
+        image = extract_album_art(audio)
+        if image is None:
+            return self.for_directory(directory)
+
+        digest = self._store(image)
+        if album is not None:
+            self._albums[album] = digest
+        return self._lookup(digest)
+
+    def for_directory(self, directory: str):
+        """
+        :param directory: Directory of a track
+        :return: the folder image of this directory, None if it has none
+        """
+        if directory in self._folders:
+            self.hits += 1
+            return self._lookup(self._folders[directory])
+
+        digest = None
+        for name in FOLDER_IMAGES:
+            image_path = os.path.join(directory, name)
+            try:
+                with open(image_path, 'rb') as f:
+                    digest = self._store(f.read())
+                break
+            except OSError:
+                continue
+        self._folders[directory] = digest
+        return self._lookup(digest)
+
+    def _lookup(self, digest: str):
+        with self._lock:
+            image = self._images.get(digest)
+            if image is not None:
+                self._images.move_to_end(digest)
+            return image
+
+    def _store(self, image: bytes) -> str:
+        digest = hashlib.sha1(image).hexdigest()
+        with self._lock:
+            if digest in self._images:
+                self._images.move_to_end(digest)
+                self.hits += 1
+                return digest
+            self.misses += 1
+        image = self.downscale(image)
+        with self._lock:
+            self._images[digest] = image
+            while len(self._images) > self.capacity:
+                self._images.popitem(last=False)
+        return digest
+
+    def downscale(self, image: bytes) -> bytes:
+        """
+        Shrinks a cover larger than max_size and recompresses it as JPEG, returns it untouched otherwise
+        :param image: cover content
+        """
+        if not self.max_size or Image is None:
+            return image
+        try:
+            picture = Image.open(io.BytesIO(image))
+            if max(picture.size) <= self.max_size:
+                return image
+            picture.thumbnail((self.max_size, self.max_size))
+            output = io.BytesIO()
+            picture.convert('RGB').save(output, format='JPEG', quality=90)
+        except (OSError, ValueError):
+            return image
+        return output.getvalue()
+
+    def stats(self) -> str:
+        return "%d hits, %d misses, %d cached" % (self.hits, self.misses, len(self._images))
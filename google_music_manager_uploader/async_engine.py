@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from gmusicapi.exceptions import CallFailure
+import requests
+
+from .retry import RetryPolicy, FailedFiles
+from .scheduler import PendingFiles
+
+
+class AsyncUploadEngine:
+    """
+    asyncio alternative to UploadBatcher, with the same interface.
+    Pending files are fed from any thread (watchdog, startup scan) and batched by a single event loop thread
+    once a slot is free, so the latest files can still be picked by the policy; the loop waits out retries
+    without holding a slot,
+    while the blocking Google and deduplicate calls run on a small executor.
+    """
+
+    def __init__(
+        self,
+        callback,
+        logger: logging.Logger,
+        batch_size: int = 25,
+        max_wait: float = 5.0,
+        max_batches: int = 2,
+        retry_policy: RetryPolicy = None,
+        pending: PendingFiles = None,
+    ) -> None:
+        """
+        :param callback: callable receiving a list of file paths to upload, run on the executor. May raise CallFailure,
+            requests errors, or FailedFiles for the files to upload again
+        :param logger: logging.Logger object for logs
+        :param batch_size: Integer. maximum number of files per batch. 25 by default
+        :param max_wait: Float. maximum seconds a pending file waits for its batch to fill. 5 by default
+        :param max_batches: Integer. batches in flight at once, so a batch waiting to retry does not stall the others.
+            2 by default
+        :param retry_policy: RetryPolicy. tells which failed batches to retry and when. RetryPolicy() by default
+        :param pending: PendingFiles. order in which pending files are batched. PendingFiles() (fifo) by default
+        """
+        self.callback = callback
+        self.logger = logger
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.max_batches = max(1, max_batches)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_batches)
+        self.loop = None
+        self._pending = pending or PendingFiles()
+        self._changed = None
+        self._interrupted = None
+        self._oldest = None
+        self._stopping = False
+        self._flushing = True
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='async-engine', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        self._ready.wait()
+
+    def add(self, file_path: str) -> None:
+        """
+        Queues a file for upload, from any thread. A file already pending is not queued twice
+        :param file_path: Path to file to upload
+        """
+        self.loop.call_soon_threadsafe(self._put, file_path)
+
+    def stop(self, flush: bool = True) -> None:
+        """
+        Stops the event loop once the batches being uploaded are done
+        :param flush: Boolean. upload every pending file first, waiting for the batches being retried.
+            True by default; otherwise pending files are left to the work queue
+        """
+        self.loop.call_soon_threadsafe(self._stop, flush)
+        self._thread.join()
+        self.executor.shutdown(wait=True)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _put(self, file_path: str) -> None:
+        if not self._pending:
+            self._oldest = self.loop.time()
+        if self._pending.add(file_path):
+            self._changed.set()
+
+    def _stop(self, flush: bool) -> None:
+        self._stopping = True
+        self._flushing = flush
+        if not flush:
+            self._interrupted.set()
+        self._changed.set()
+
+    async def _wait(self, timeout: float = None) -> bool:
+        """
+        :return: False if nothing was added nor stopped before the timeout
+        """
+        self._changed.clear()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _next_batch(self):
+        """
+        :return: (batch, stopping)
+        """
+        while not self._pending and not self._stopping:
+            await self._wait()
+        while len(self._pending) < self.batch_size and not self._stopping:
+            timeout = self._oldest + self.max_wait - self.loop.time()
+            if timeout <= 0 or not await self._wait(timeout):
+                break
+        if self._stopping and not self._flushing:
+            return [], True
+        batch = self._pending.pop(self.batch_size)
+        self._oldest = self.loop.time()
+        return batch, self._stopping and not self._pending
+
+    async def _retry_after(self, delay: float) -> bool:
+        """
+        :return: False if the engine was stopped without flushing meanwhile
+        """
+        try:
+            await asyncio.wait_for(self._interrupted.wait(), delay)
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+    async def _upload(self, batch: list, slots: asyncio.Semaphore) -> None:
+        holding = True
+        try:
+            attempt = 0
+            while True:
+                try:
+                    await self.loop.run_in_executor(self.executor, self.callback, batch)
+                    return
+                except Exception as e:
+                    delay = self.retry_policy.delay(e, attempt)
+                    if delay is None:
+                        raise
+                    if isinstance(e, FailedFiles):
+                        # the other files went through
+                        batch = e.file_paths
+                    attempt += 1
+                    self.logger.info("Batch of %d file(s) failed, retrying in %.1fs" % (len(batch), delay))
+                    # let other batches run meanwhile
+                    slots.release()
+                    holding = False
+                    if not await self._retry_after(delay):
+                        self.logger.info("Batch of %d file(s) left for the next start" % len(batch))
+                        return
+                    await slots.acquire()
+                    holding = True
+        except (CallFailure, requests.RequestException, FailedFiles) as e:
+            self.logger.error("Batch of %d file(s) failed: %s" % (len(batch), e))
+        except Exception:
+            self.logger.exception("Batch of %d file(s) failed" % len(batch))
+        finally:
+            if holding:
+                slots.release()
+
+    async def _main(self) -> None:
+        self._changed = asyncio.Event()
+        self._interrupted = asyncio.Event()
+        self._ready.set()
+        slots = asyncio.Semaphore(self.max_batches)
+        tasks = set()
+        stopping = False
+        while not stopping:
+            # the batch is picked once a slot is free
+            await slots.acquire()
+            batch, stopping = await self._next_batch()
+            if not batch:
+                slots.release()
+                continue
+            task = self.loop.create_task(self._upload(batch, slots))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def _run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.close()
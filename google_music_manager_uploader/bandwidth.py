@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque, namedtuple
+
+# seconds of traffic the bucket lets through at once after an idle period
+_BURST_SECONDS = 1.0
+_MIN_BURST = 64 * 1024
+# seconds between two checks of the modification time of a schedule file
+_RELOAD_INTERVAL = 5.0
+# seconds of traffic averaged by throughput()
+_THROUGHPUT_WINDOW = 10
+_RATE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)b?\s*$', re.IGNORECASE)
+_TIME = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*$')
+_UNITS = {'': 1, 'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3}
+
+Window = namedtuple('Window', ['start', 'end', 'rate', 'workers'])
+Window.__doc__ = """
+Time of day window of a schedule: start and end in minutes after midnight, end excluded. Windows ending before
+their start span midnight, windows ending at their start last all day.
+rate is the cap in bytes per second, 0 for unlimited, workers None to keep the default of the account
+"""
+
+
+def parse_rate(text: str) -> float:
+    """
+    :param text: bytes per second, with an optional K, M or G suffix in powers of 1000, e.g. 2M or 500KB
+    :return: bytes per second, 0 for unlimited
+    :raises ValueError: on malformed rates
+    """
+    if text.strip().lower() in ('unlimited', 'none'):
+        return 0.0
+    match = _RATE.match(text)
+    if not match:
+        raise ValueError('Invalid rate %r' % text)
+    return float(match.group(1)) * _UNITS[match.group(2).lower()]
+
+
+def _minutes(text: str) -> int:
+    match = _TIME.match(text)
+    if not match or int(match.group(1)) > 24 or int(match.group(2)) > 59:
+        raise ValueError('Invalid time %r' % text)
+    return (int(match.group(1)) * 60 + int(match.group(2))) % (24 * 60)
+
+
+def parse_schedule(text: str) -> list:
+    """
+    Reads a schedule of comma or newline separated HH:MM-HH:MM=RATE[/WORKERS] windows, in local time.
+    Lines starting with # are ignored. The first window containing the time of day applies,
+    e.g. "08:00-19:00=2M, 19:00-08:00=0/8" caps uploads at 2MB/s by day, and lifts the cap with 8 workers by night
+    :return: list of Window
+    :raises ValueError: on malformed windows
+    """
+    windows = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0]
+        for entry in line.split(','):
+            if not entry.strip():
+                continue
+            try:
+                hours, value = entry.split('=')
+                start, end = hours.split('-')
+                rate, _, workers = value.partition('/')
+                workers = int(workers) if workers.strip() else None
+            except ValueError:
+                raise ValueError('Invalid schedule window %r, expected HH:MM-HH:MM=RATE[/WORKERS]' % entry.strip())
+            if workers is not None and workers < 1:
+                raise ValueError('Invalid workers in schedule window %r' % entry.strip())
+            windows.append(Window(_minutes(start), _minutes(end), parse_rate(rate), workers))
+    return windows
+
+
+def format_rate(rate: float) -> str:
+    """
+    :return: human readable bytes per second
+    """
+    for unit, size in (('GB', 1000 ** 3), ('MB', 1000 ** 2), ('KB', 1000)):
+        if rate >= size:
+            return '%.1f %s/s' % (rate / size, unit)
+    return '%.0f B/s' % rate
+
+
+class BandwidthLimiter:
+    """
+    Token bucket on upload bytes, shared by every upload in flight across workers and accounts.
+    Its cap follows a daily schedule read at each block sent, so that a new window applies to the uploads
+    in progress, and a schedule given as a file is read again when the file changes, without any restart.
+    """
+
+    def __init__(
+        self,
+        rate: float = 0,
+        schedule: str = None,
+        logger: logging.Logger = None,
+        clock=time.monotonic,
+        localtime=time.localtime,
+        sleep=time.sleep,
+    ) -> None:
+        """
+        :param rate: Float. bytes per second outside of the schedule windows, 0 for unlimited. 0 by default
+        :param schedule: String. schedule, see parse_schedule, or path to a file holding it. None by default
+        :param logger: logging.Logger object for logs. None by default
+        :raises ValueError: on malformed schedules
+        """
+        self.default_rate = rate
+        self.logger = logger or logging.getLogger(__name__)
+        self.schedule_path = schedule if schedule and os.path.isfile(schedule) else None
+        self.windows = [] if self.schedule_path or not schedule else parse_schedule(schedule)
+        self._clock = clock
+        self._localtime = localtime
+        self._sleep = sleep
+        self._mtime = None
+        self._checked = None
+        self._window = None
+        self._tokens = 0.0
+        self._last = clock()
+        self._sent = deque()  # [second, bytes, time of the first block] of the last _THROUGHPUT_WINDOW seconds
+        self._lock = threading.Lock()
+        if self.schedule_path:
+            self._reload(self._last, strict=True)
+
+    def _reload(self, now: float, strict: bool = False) -> None:
+        """
+        Reads the schedule file again when its modification time changed, keeping the last valid schedule on errors
+        :param strict: Boolean. raise errors instead, when the schedule is first read. False by default
+        :raises ValueError: on errors in strict mode
+        """
+        self._checked = now
+        try:
+            mtime = os.stat(self.schedule_path).st_mtime_ns
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            with open(self.schedule_path) as f:
+                self.windows = parse_schedule(f.read())
+        except (OSError, ValueError) as e:
+            if strict:
+                raise ValueError('Unable to read schedule %s: %s' % (self.schedule_path, e))
+            self.logger.warning("Bandwidth schedule %s not reloaded: %s" % (self.schedule_path, e))
+            return
+        self.logger.info("Bandwidth schedule %s loaded: %d window(s)" % (self.schedule_path, len(self.windows)))
+
+    def window(self) -> Window:
+        """
+        :return: Window of the schedule applying now, None outside of every window
+        """
+        now = self._clock()
+        if self.schedule_path and now - self._checked >= _RELOAD_INTERVAL:
+            self._reload(now)
+        local = self._localtime()
+        minute = local.tm_hour * 60 + local.tm_min
+        for window in self.windows:
+            if window.start < window.end:
+                inside = window.start <= minute < window.end
+            elif window.start > window.end:
+                inside = minute >= window.start or minute < window.end
+            else:
+                inside = True
+            if inside:
+                return window
+        return None
+
+    def _current(self) -> Window:
+        window = self.window()
+        if window != self._window:
+            self._window = window
+            self.logger.info("Upload bandwidth cap: %s%s" % (
+                format_rate(self._rate(window)) if self._rate(window) else 'unlimited',
+                ', %d worker(s)' % window.workers if window and window.workers else '',
+            ))
+        return window
+
+    def _rate(self, window: Window) -> float:
+        return window.rate if window else self.default_rate
+
+    @property
+    def rate(self) -> float:
+        """
+        :return: cap applying now in bytes per second, 0 for unlimited
+        """
+        with self._lock:
+            return self._rate(self._current())
+
+    def workers(self, default: int) -> int:
+        """
+        :param default: Integer. concurrent uploads configured for the account
+        :return: concurrent uploads of the schedule window applying now, default when it does not set them
+        """
+        with self._lock:
+            window = self._current()
+        return window.workers if window and window.workers else default
+
+    def reserve(self, size: int) -> float:
+        """
+        Takes size bytes from the bucket, possibly ahead of time
+        :return: seconds to wait before sending them
+        """
+        with self._lock:
+            now = self._clock()
+            rate = self._rate(self._current())
+            elapsed, self._last = now - self._last, now
+            if rate <= 0:
+                return 0.0
+            burst = max(_MIN_BURST, rate * _BURST_SECONDS)
+            self._tokens = min(burst, self._tokens + elapsed * rate) - size
+            return max(0.0, -self._tokens / rate)
+
+    def acquire(self, size: int) -> None:
+        self._sleep(self.reserve(size))
+        with self._lock:
+            self._record(self._clock(), size)
+
+    def _record(self, now: float, size: int) -> None:
+        second = int(now)
+        if self._sent and self._sent[-1][0] == second:
+            self._sent[-1][1] += size
+        else:
+            self._sent.append([second, size, now])
+        while self._sent[0][0] <= second - _THROUGHPUT_WINDOW:
+            self._sent.popleft()
+
+    def throughput(self) -> float:
+        """
+        :return: bytes per second let through over the last ten seconds
+        """
+        with self._lock:
+            now = self._clock()
+            sent = [entry for entry in self._sent if entry[0] > now - _THROUGHPUT_WINDOW]
+            if not sent:
+                return 0.0
+            # averaged since the first block of the window, so that a transfer just started is not underrated
+            return sum(size for _, size, _ in sent) / max(1.0, now - sent[0][2])
+
+    def reader(self, contents):
+        """
+        :param contents: file object opened in binary mode
+        :return: file object whose reads wait for the bucket
+        """
+        return ThrottledReader(contents, self)
+
+    def stats(self) -> str:
+        rate = self.rate
+        throughput = self.throughput()
+        if not rate:
+            return "%s, no cap" % format_rate(throughput)
+        return "%s of %s cap (%.0f%%)" % (format_rate(throughput), format_rate(rate), 100.0 * throughput / rate)
+
+
+class ThrottledReader:
+    """
+    File object handed to requests in place of the file to upload: each block read waits for the bucket.
+    Other attributes are the ones of the file, so that requests still finds its length and position.
+    """
+
+    def __init__(self, contents, limiter: BandwidthLimiter) -> None:
+        self._contents = contents
+        self._limiter = limiter
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._contents.read(size)
+        if data:
+            self._limiter.acquire(len(data))
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(64 * 1024), b'')
+
+    def __getattr__(self, name: str):
+        return getattr(self._contents, name)
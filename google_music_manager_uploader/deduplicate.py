@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import glob
 import argparse
-from .uploader_daemon import DeduplicateApi
+import itertools
+from .deduplicate_api import DeduplicateApi
+from .scanner import scan
+from .fingerprint import audio_hash
 
 
 def main():
@@ -32,21 +34,30 @@ def main():
         action='store_true',
         help="Unmark specified file/folder (default: False)"
     )
+    parser.add_argument(
+        "--fingerprint",
+        action='store_true',
+        help="Send the fingerprint of the audio of each file along with its path (default: False)"
+    )
     args = parser.parse_args()
     directory = args.directory
     file = args.file
-    deduplicate_api = DeduplicateApi(args.deduplicate_api)
+    deduplicate_api = DeduplicateApi(args.deduplicate_api, fingerprint=audio_hash if args.fingerprint else None)
     if directory:
-        files = [file for file in glob.glob(glob.escape(directory) + '/**/*', recursive=True)]
+        files = scan(directory)
     elif file:
-        files = [file]
+        files = iter([file])
     else:
         raise FileNotFoundError('Unable to load directory or file')
-    for file_path in files:
+    # Send the paths chunk by chunk as they are found
+    while True:
+        chunk = list(itertools.islice(files, deduplicate_api.batch_size))
+        if not chunk:
+            break
         if args.remove:
-            deduplicate_api.remove(file_path)
+            deduplicate_api.remove_many(chunk)
         else:
-            deduplicate_api.save(file_path)
+            deduplicate_api.save_many(chunk)
 
 
 if __name__ == "__main__":
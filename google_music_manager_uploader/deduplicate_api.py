@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import threading
+from collections import OrderedDict
+
+import requests
+
+
+class DeduplicateApi:
+    """
+    Client of the deduplicate API (see README). Connections are kept alive and reused between calls.
+    Batch calls use the optional /batch endpoint and fall back to one call per path when the server lacks it,
+    which is assumed from any answer but a valid one, since servers only implementing the manifest answer anything.
+    With a fingerprint function, the audio fingerprint of each file is sent along with its path.
+    """
+
+    def __init__(self, uri: str, timeout: float = 10.0, batch_size: int = 500, fingerprint=None) -> None:
+        """
+        :param uri: Base URI of the deduplicate API
+        :param timeout: Float. seconds before giving up on a connection or a response. 10 by default
+        :param batch_size: Integer. maximum number of paths sent in a single batch call. 500 by default
+        :param fingerprint: callable returning the audio fingerprint of a path. None by default
+        """
+        self.uri = uri
+        self.timeout = timeout
+        self.batch_size = max(1, batch_size)
+        self.fingerprint = fingerprint
+        self.batch_supported = True
+        self.session = requests.Session()
+
+    def _request(self, method: str, path: str = '/', **kwargs) -> requests.Response:
+        return self.session.request(method, self.uri + path, timeout=self.timeout, **kwargs)
+
+    def _hash(self, file_path: str):
+        """
+        :return: audio fingerprint of the file, None without fingerprint function or once the file is gone
+        """
+        if self.fingerprint is None:
+            return None
+        try:
+            return self.fingerprint(file_path)
+        except OSError:
+            return None
+
+    def _data(self, file_path: str) -> dict:
+        data = {"path": file_path}
+        content_hash = self._hash(file_path)
+        if content_hash:
+            data["hash"] = content_hash
+        return data
+
+    def _batch(self, method: str, file_paths: list):
+        """
+        Sends paths to the batch endpoint, chunk by chunk. A single path is left to the endpoint every server has
+        :return: set of the paths listed in the answers to a GET, empty for other methods.
+            None if the batch endpoint is not used: a single path, or a server answering anything but a 2xx,
+            or a GET answer without a JSON list of paths
+        """
+        if not self.batch_supported or len(file_paths) == 1:
+            return None
+        paths = set()
+        for start in range(0, len(file_paths), self.batch_size):
+            body = {"paths": file_paths[start:start + self.batch_size]}
+            if self.fingerprint is not None:
+                body["hashes"] = [self._hash(file_path) for file_path in body["paths"]]
+            result = self._request(method, '/batch', json=body)
+            try:
+                if not 200 <= result.status_code < 300:
+                    raise ValueError("status %d" % result.status_code)
+                if method == 'GET':
+                    paths.update(result.json()["paths"])
+            except (ValueError, KeyError, TypeError):
+                self.batch_supported = False
+                return None
+        return paths
+
+    def exists(self, file_path: str) -> bool:
+        result = self._request('GET', data=self._data(file_path))
+        return result.status_code == 200 or result.status_code == 204
+
+    def exists_many(self, file_paths: list) -> set:
+        """
+        :param file_paths: List of paths to check
+        :return: set of the paths already uploaded
+        """
+        existing = self._batch('GET', file_paths)
+        if existing is None:
+            # uncached lookups, a cache in front of this client already missed these paths
+            return {file_path for file_path in file_paths if DeduplicateApi.exists(self, file_path)}
+        return existing
+
+    def save(self, file_path: str) -> None:
+        self._request('POST', data=self._data(file_path))
+
+    def save_many(self, file_paths: list) -> None:
+        if self._batch('POST', file_paths) is None:
+            for file_path in file_paths:
+                self.save(file_path)
+
+    def remove(self, file_path: str) -> None:
+        self._request('DELETE', data=self._data(file_path))
+
+    def remove_many(self, file_paths: list) -> None:
+        if self._batch('DELETE', file_paths) is None:
+            for file_path in file_paths:
+                self.remove(file_path)
+
+
+class CachedDeduplicateApi(DeduplicateApi):
+    """
+    DeduplicateApi with a bounded in-process cache of exists answers.
+    Least recently used entries are evicted first and entries expire after a TTL.
+    Saving writes through to the cache, removing invalidates it.
+    """
+
+    def __init__(self, uri: str, cache_size: int = 10000, cache_ttl: float = 300.0, **kwargs) -> None:
+        """
+        :param uri: Base URI of the deduplicate API
+        :param cache_size: Integer. maximum number of cached paths. 10000 by default
+        :param cache_ttl: Float. seconds a cached answer stays valid. 300 by default
+        """
+        super().__init__(uri, **kwargs)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _get(self, file_path: str):
+        with self._cache_lock:
+            entry = self._cache.get(file_path)
+            if entry is None or entry[1] < time.monotonic():
+                self._cache.pop(file_path, None)
+                self.misses += 1
+                return None
+            self._cache.move_to_end(file_path)
+            self.hits += 1
+            return entry[0]
+
+    def _set(self, file_path: str, exists: bool) -> None:
+        with self._cache_lock:
+            self._cache[file_path] = (exists, time.monotonic() + self.cache_ttl)
+            self._cache.move_to_end(file_path)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def stats(self) -> str:
+        return "%d hits, %d misses, %d cached" % (self.hits, self.misses, len(self._cache))
+
+    def exists(self, file_path: str) -> bool:
+        exists = self._get(file_path)
+        if exists is None:
+            exists = super().exists(file_path)
+            self._set(file_path, exists)
+        return exists
+
+    def exists_many(self, file_paths: list) -> set:
+        existing = set()
+        unknown = []
+        for file_path in file_paths:
+            exists = self._get(file_path)
+            if exists is None:
+                unknown.append(file_path)
+            elif exists:
+                existing.add(file_path)
+        if unknown:
+            found = super().exists_many(unknown)
+            for file_path in unknown:
+                self._set(file_path, file_path in found)
+            existing.update(found)
+        return existing
+
+    def save(self, file_path: str) -> None:
+        super().save(file_path)
+        self._set(file_path, True)
+
+    def save_many(self, file_paths: list) -> None:
+        super().save_many(file_paths)
+        for file_path in file_paths:
+            self._set(file_path, True)
+
+    def remove(self, file_path: str) -> None:
+        super().remove(file_path)
+        with self._cache_lock:
+            self._cache.pop(file_path, None)
+
+    def remove_many(self, file_paths: list) -> None:
+        super().remove_many(file_paths)
+        with self._cache_lock:
+            for file_path in file_paths:
+                self._cache.pop(file_path, None)
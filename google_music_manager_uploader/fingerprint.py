@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import struct
+import hashlib
+
+_ID3V1_SIZE = 128
+_APE_FOOTER_SIZE = 32
+_ASF_HEADER_GUID = bytes.fromhex('3026b2758e66cf11a6d900aa0062ce6c')
+_ASF_DATA_GUID = bytes.fromhex('3626b2758e66cf11a6d900aa0062ce6c')
+_OGG_PAGE_HEADER_SIZE = 27
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _skip_id3v2(f, start: int, end: int) -> int:
+    """
+    :return: offset of the first byte after the ID3v2 tags found at start
+    """
+    while start + 10 <= end:
+        f.seek(start)
+        header = f.read(10)
+        if header[:3] != b'ID3':
+            break
+        start += 10 + _syncsafe(header[6:10]) + (10 if header[5] & 0x10 else 0)
+    return min(start, end)
+
+
+def _strip_trailing_tags(f, start: int, end: int) -> int:
+    """
+    :return: offset of the end of the audio once ID3v1 and APEv2 tags are removed from the end of the file
+    """
+    while True:
+        if end - start >= _ID3V1_SIZE:
+            f.seek(end - _ID3V1_SIZE)
+            if f.read(3) == b'TAG':
+                end -= _ID3V1_SIZE
+                continue
+        if end - start >= _APE_FOOTER_SIZE:
+            f.seek(end - _APE_FOOTER_SIZE)
+            footer = f.read(_APE_FOOTER_SIZE)
+            if footer[:8] == b'APETAGEX':
+                size, _, flags = struct.unpack('<III', footer[12:24])
+                end -= size + (_APE_FOOTER_SIZE if flags & 0x80000000 else 0)
+                end = max(end, start)
+                continue
+        return end
+
+
+def _flac_ranges(f, start: int, end: int) -> list:
+    f.seek(start + 4)
+    offset = start + 4
+    while offset + 4 <= end:
+        header = f.read(4)
+        if len(header) < 4:
+            break
+        offset += 4 + int.from_bytes(header[1:4], 'big')
+        if header[0] & 0x80:  # last metadata block
+            break
+        f.seek(offset)
+    return [(min(offset, end), end)]
+
+
+def _mp4_ranges(f, start: int, end: int) -> list:
+    ranges = []
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            break
+        if kind == b'mdat':
+            ranges.append((offset + header_size, min(offset + size, end)))
+        offset += size
+    return ranges
+
+
+def _asf_ranges(f, start: int, end: int) -> list:
+    """
+    :return: the Data Object, as every tag is in the Header Object
+    """
+    offset = start
+    while offset + 24 <= end:
+        f.seek(offset)
+        header = f.read(24)
+        size = struct.unpack('<Q', header[16:24])[0]
+        if size < 24:
+            break
+        if header[:16] == _ASF_DATA_GUID:
+            return [(offset, min(offset + size, end))]
+        offset += size
+    return []
+
+
+def _ogg_header_packets(packet: bytes):
+    """
+    :param packet: first packet of the stream
+    :return: number of header packets of the codec, the audio starting on the next page. None for unknown codecs
+    """
+    if packet.startswith(b'\x01vorbis'):
+        return 3  # identification, comment and setup
+    if packet.startswith((b'OpusHead', b'Speex   ')):
+        return 2  # identification and comment
+    if packet.startswith(b'\x7fFLAC') and len(packet) >= 9 and packet[7:9] != b'\x00\x00':
+        return 1 + int.from_bytes(packet[7:9], 'big')
+    return None
+
+
+def _ogg_ranges(f, start: int, end: int) -> list:
+    """
+    :return: the payloads of the audio pages. Page headers are left out too, since a comment spanning
+        another page renumbers every page after it
+    """
+    ranges = []
+    serial = None
+    headers = None
+    packets = 0
+    packet = b''
+    offset = start
+    while offset + _OGG_PAGE_HEADER_SIZE <= end:
+        f.seek(offset)
+        header = f.read(_OGG_PAGE_HEADER_SIZE)
+        if header[:4] != b'OggS':
+            break
+        lacing = f.read(header[26])
+        payload_start = offset + _OGG_PAGE_HEADER_SIZE + len(lacing)
+        offset = payload_start + sum(lacing)
+        if headers is not None and packets >= headers:
+            ranges.append((payload_start, min(offset, end)))
+            continue
+        serial = header[14:18] if serial is None else serial
+        if header[14:18] != serial:
+            continue
+        # counts the packets of the first stream ending in this page, the first one being read to know the codec
+        for size in lacing:
+            if headers is None:
+                packet += f.read(size)
+            if size < 255:
+                packets += 1
+                if headers is None:
+                    headers = _ogg_header_packets(packet)
+                    if headers is None:
+                        return []
+    return ranges
+
+
+def _ranges(f, end: int) -> list:
+    start = _skip_id3v2(f, 0, end)
+    f.seek(start)
+    magic = f.read(8)
+    if magic[:4] == b'fLaC':
+        return _flac_ranges(f, start, _strip_trailing_tags(f, start, end))
+    if magic[4:8] == b'ftyp':
+        return _mp4_ranges(f, start, end) or [(0, end)]
+    if magic[:4] == b'OggS':
+        return _ogg_ranges(f, start, end) or [(0, end)]
+    if magic[:4] == _ASF_HEADER_GUID[:4]:
+        return _asf_ranges(f, start, end) or [(0, end)]
+    return [(start, _strip_trailing_tags(f, start, end))]
+
+
+def audio_ranges(file_path: str) -> list:
+    """
+    Locates the audio payload of a file, leaving its tags out
+    :param file_path: Path to the audio file
+    :return: list of (start, end) byte offsets. MP3, AAC, FLAC, MP4, ASF and Ogg (Vorbis, Opus, Speex and FLAC)
+        tags are skipped, other formats are covered whole
+    """
+    with open(file_path, 'rb') as f:
+        return _ranges(f, os.fstat(f.fileno()).st_size)
+
+
+def audio_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Fingerprints the audio payload of a file by chunks, so that retagging a file does not change it
+    :param file_path: Path to the file to hash
+    :param chunk_size: Integer. bytes read at once. 1MiB by default
+    :return: hex digest of the audio payload
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for start, end in _ranges(f, os.fstat(f.fileno()).st_size):
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import time
+import sqlite3
+import threading
+
+from .fingerprint import audio_hash
+
+HANDLED_RESULTS = ('uploaded', 'matched')
+SCHEMA_VERSION = 1  # 1: hashes cover the audio payload only
+
+
+class UploadIndex:
+    """
+    Local on-disk record of every file handled by the daemon, keyed on path, size, mtime and audio fingerprint.
+    Unchanged files are skipped with a single stat call; renamed, moved, copied or retagged files are found
+    by the fingerprint of their audio payload.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """
+        :param db_path: Path to the SQLite database, created when missing
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT,"
+                " result TEXT, server_id TEXT, updated REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS files_hash ON files (hash)")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                # whole file hashes of older indexes are computed again when needed
+                self._db.execute("UPDATE files SET hash = NULL")
+                self._db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+    def fingerprint(self, file_path: str) -> str:
+        """
+        :param file_path: Path to the file
+        :return: fingerprint of the audio payload of the file, computed again only when its size or mtime changed
+        """
+        stat = os.stat(file_path)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, hash FROM files WHERE path = ?", (file_path,)
+            ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns and row[2]:
+            return row[2]
+        content_hash = audio_hash(file_path)
+        with self._lock, self._db:
+            if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                self._db.execute("UPDATE files SET hash = ? WHERE path = ?", (content_hash, file_path))
+            else:
+                self._db.execute(
+                    "REPLACE INTO files (path, size, mtime_ns, hash, result, server_id, updated)"
+                    " VALUES (?, ?, ?, ?, NULL, NULL, ?)",
+                    (file_path, stat.st_size, stat.st_mtime_ns, content_hash, time.time())
+                )
+        return content_hash
+
+    def is_handled(self, file_path: str) -> bool:
+        """
+        Tells if a file was already uploaded or matched, either at this path or at another path with the same audio
+        :param file_path: Path to the file to check
+        :return: True if the file does not need to be uploaded again
+        """
+        stat = os.stat(file_path)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, result FROM files WHERE path = ?", (file_path,)
+            ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns and row[2] in HANDLED_RESULTS:
+            return True
+
+        content_hash = self.fingerprint(file_path)
+        with self._lock, self._db:
+            known = self._db.execute(
+                "SELECT result, server_id FROM files WHERE hash = ? AND result IN (?, ?) LIMIT 1",
+                (content_hash,) + HANDLED_RESULTS
+            ).fetchone()
+            if known:
+                self._db.execute(
+                    "UPDATE files SET result = ?, server_id = ?, updated = ? WHERE path = ?",
+                    known + (time.time(), file_path)
+                )
+        return known is not None
+
+    def record(self, file_path: str, result: str, server_id: str = None) -> None:
+        """
+        Stores the upload result of a file
+        :param file_path: Path to the uploaded file
+        :param result: 'uploaded', 'matched' or the reason why the file was not uploaded
+        :param server_id: Google Music id of the track. None by default
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            stat = None
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, hash FROM files WHERE path = ?", (file_path,)
+            ).fetchone()
+            if stat is None:
+                # file already removed, keep what was known about its content
+                if row:
+                    self._db.execute(
+                        "UPDATE files SET result = ?, server_id = ?, updated = ? WHERE path = ?",
+                        (result, server_id, time.time(), file_path)
+                    )
+                return
+            content_hash = row[2] if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns else None
+        if content_hash is None:
+            content_hash = audio_hash(file_path)
+        with self._lock, self._db:
+            self._db.execute(
+                "REPLACE INTO files (path, size, mtime_ns, hash, result, server_id, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_path, stat.st_size, stat.st_mtime_ns, content_hash, result, server_id, time.time())
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
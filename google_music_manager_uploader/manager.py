@@ -7,14 +7,94 @@ This is complete madness and should not replace GMusicApi behaviour but I have n
 
 from gmusicapi import Musicmanager
 from gmusicapi.utils import utils
-from gmusicapi.exceptions import NotLoggedIn
+from gmusicapi.exceptions import NotLoggedIn, CallFailure
 from gmusicapi.protocol import musicmanager, upload_pb2, locker_pb2
 import mutagen
-import base64
+import mutagen.asf
+import mutagen.mp4
+import dateutil.parser
+import httplib2
+import oauth2client.client
+import requests
+import itertools
+import os
 import time
+import base64
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .transcoder import Transcoder
+from .artwork import AlbumArtCache
+from .retry import RetryPolicy, classify, PERMANENT
+from .work_queue import INTERRUPTED
+from . import metrics
 
 
 class Manager(Musicmanager):
+    transcoder = None
+    album_art_cache = None
+    upload_listener = None  # called with the path of each track right before its upload starts
+    retry_policy = None
+    track_cache = None  # TrackCache of the Track of each file, so that unchanged files are not hashed again
+    bandwidth = None  # BandwidthLimiter shared by every upload in flight, None for unlimited
+
+    def _make_call(self, protocol, *args, **kwargs):
+        """Sends a call through the retry policy rate limiter and circuit breaker, when one is set.
+        Every outcome is recorded, so that a call probing the circuit never leaves it half-open."""
+        policy = self.retry_policy
+        if policy is None:
+            return super()._make_call(protocol, *args, **kwargs)
+        policy.before_call()
+        try:
+            response = super()._make_call(protocol, *args, **kwargs)
+        except BaseException as e:
+            policy.record(e)
+            raise
+        policy.record()
+        return response
+
+    def reauthenticate(self):
+        """Refreshes the OAuth access token then authenticates the uploader again,
+        without resetting the session in use by other workers.
+
+        Returns ``True`` on success.
+        """
+        try:
+            self.session._oauth_creds.refresh(httplib2.Http())
+            self._make_call(musicmanager.AuthenticateUploader, self.uploader_id, self.uploader_name)
+        except (oauth2client.client.Error, CallFailure, httplib2.HttpLib2Error, OSError, requests.RequestException):
+            self.logger.exception("could not authenticate again")
+            return False
+        return True
+
+    def _track_info(self, path):
+        """Returns ``(audio, Track)`` for a file, ``audio`` being its ``mutagen.File(path, easy=True)``,
+        or ``None`` when the Track comes from ``self.track_cache``."""
+        stat = os.stat(path)
+        if self.track_cache is not None:
+            cached = self.track_cache.get(path, stat)
+            if cached is not None:
+                metrics.track_cache.inc(result='hit')
+                return None, locker_pb2.Track.FromString(cached)
+            metrics.track_cache.inc(result='miss')
+        audio = mutagen.File(path, easy=True)
+        track = MyUploadMetadata.fill_track_info(path, audio)
+        if self.track_cache is not None:
+            self.track_cache.put(path, track.SerializeToString(), stat)
+        return audio, track
+
+    def _album_art(self, path, audio=None):
+        """Returns the embedded album art of a track, parsing it when ``audio`` is ``None``."""
+        try:
+            if audio is None:
+                audio = mutagen.File(path, easy=True)
+            return self.album_art_cache.get(path, audio)
+        except Exception as e:
+            self.logger.warning("couldn't read album art of '%r': %s", path, e)
+            return None
+
     @utils.accept_singleton(str)
     @utils.empty_arg_shortcircuit(return_code='{}')
     def upload(self,
@@ -23,6 +103,8 @@ class Manager(Musicmanager):
        enable_transcoding=True,
        transcode_quality='320k',
        include_album_art=True,
+       workers=1,
+       max_sessions=None,
    ):
         """Uploads the given filepaths.
 
@@ -71,6 +153,19 @@ class Manager(Musicmanager):
           If string, upload external album art at given filepath.
           Google Music supports GIF, JPEG, and PNG image formats.
 
+        :param workers: number of tracks uploaded concurrently. Session acquisition,
+          transcoding and the upload itself of different tracks overlap; a track waiting
+          for an upload session does not block the others.
+
+        :param max_sessions: maximum number of upload sessions held at once.
+          Defaults to ``workers``.
+
+        Samples and transcodes are prefetched on ``self.transcoder``
+        (a :py:class:`Transcoder` sized to the CPU count unless set beforehand).
+        Embedded album art goes through ``self.album_art_cache``
+        (an :py:class:`AlbumArtCache` unless set beforehand), which falls back to
+        folder images such as ``cover.jpg``.
+
         All Google-supported filetypes are supported; see `Google's documentation
         <http://support.google.com/googleplay/bin/answer.py?hl=en&answer=1100462>`__.
 
@@ -92,11 +187,20 @@ class Manager(Musicmanager):
         matched = {}
         not_uploaded = {}
 
+        if self.album_art_cache is None:
+            self.album_art_cache = AlbumArtCache()
+        if self.retry_policy is None:
+            self.retry_policy = RetryPolicy()
+
         # Gather local information on the files.
+        # Each file is parsed at most once; the same mutagen object gives the Track and the album art.
+        # Files whose Track is cached are not read at all until a sample with album art is requested.
         local_info = {}  # {clientid: (path, Track)}
+        audios = {}  # {clientid: mutagen.File, None if the Track was cached}
         for path in filepaths:
             try:
-                track = musicmanager.UploadMetadata.fill_track_info(path)
+                with metrics.stage_seconds.time(stage='read_metadata'):
+                    audio, track = self._track_info(path)
             except BaseException as e:
                 self.logger.warning("problem gathering local info of '%r'", path)
 
@@ -112,6 +216,7 @@ class Manager(Musicmanager):
                 not_uploaded[path] = user_err_msg
             else:
                 local_info[track.client_id] = (path, track)
+                audios[track.client_id] = audio
 
         if not local_info:
             return uploaded, matched, not_uploaded
@@ -119,9 +224,10 @@ class Manager(Musicmanager):
         # TODO allow metadata faking
 
         # Upload metadata; the server tells us what to do next.
-        res = self._make_call(musicmanager.UploadMetadata,
-                              [t for (path, t) in local_info.values()],
-                              self.uploader_id)
+        with metrics.stage_seconds.time(stage='upload_metadata'):
+            res = self._make_call(musicmanager.UploadMetadata,
+                                  [t for (path, t) in local_info.values()],
+                                  self.uploader_id)
 
         # TODO checking for proper contents should be handled in verification
         md_res = res.metadata_response
@@ -129,83 +235,54 @@ class Manager(Musicmanager):
         responses = [r for r in md_res.track_sample_response]
         sample_requests = [req for req in md_res.signed_challenge_info]
 
+        if self.transcoder is None:
+            self.transcoder = Transcoder()
+
+        # Prefetch scan and match samples so they are cut in parallel.
+        samples = {}  # {clientid: Future}
+        if enable_matching:
+            for sample_request in sample_requests:
+                client_id = sample_request.challenge_info.client_track_id
+                samples[client_id] = self.transcoder.sample(local_info[client_id][0], sample_request)
+
+        # Load external album art.
+        external_album_art = None
+        if sample_requests and include_album_art and include_album_art is not True:
+            try:
+                with open(include_album_art, 'rb') as f:
+                    external_album_art = f.read()
+            except OSError:
+                self.logger.warning(
+                    "Image file: %r cannot be read. Uploading without album art.",
+                    include_album_art
+                )
+
         # Send scan and match samples if requested.
         for sample_request in sample_requests:
             path, track = local_info[sample_request.challenge_info.client_track_id]
 
-            bogus_sample = None
-            if not enable_matching:
-                bogus_sample = b''  # just send empty bytes
-
             album_art_image = None
-            if include_album_art:
-                if include_album_art is True:  # Load embedded album art.
-                    song = mutagen.File(path)
-
-                    if isinstance(song, (mutagen.mp3.MP3)) and song.tags is not None:
-                        # Search through all the APIC frames to find the cover (type 3).
-                        for pic in song.tags.getall('APIC'):
-                            if pic.type == 3:
-                                album_art_image = pic.data
-                elif isinstance(song, mutagen.flac.FLAC):
-                    # Search through all the picture frames to find the cover (type 3).
-                    for pic in song.pictures:
-                        if pic.type == 3:
-                            album_art_image = pic.data
-                            break
-                elif isinstance(song, mutagen.mp4.MP4):
-                    if 'covr' in song:
-                        album_art_image = song['covr'][0]
-                elif isinstance(song, mutagen.asf.ASF):
-                    if 'WM/Picture' in song:
-                        # Search through all the WM/Picture frames to find the cover (type 3).
-                        for pic in song['WM/Picture']:
-                            data = bytes(pic)
-                            if data[0] == 3:
-                                # Parse out the image data according to the WM_PICTURE spec:
-                                # 1 byte type + 4 bytes data length + null-terminated mime +
-                                # null-terminated description + data
-                                pos = 5
-                                while data[pos:pos + 2] != b"\x00\x00":
-                                    pos += 2
-                                pos += 2
-                                while data[pos:pos + 2] != b"\x00\x00":
-                                    pos += 2
-
-                                album_art_image = data[pos + 2:]
-                                break
-                elif isinstance(song, mutagen.oggvorbis.OggVorbis):
-                    if 'metadata_block_picture' in song:
-                        # Search through all the picture frames to find the cover (type 3).
-                        for pic in song['metadata_block_picture']:
-                            # Mutagen does not parse out the picture fields to attributes
-                            # like with FLAC, so we use the FLAC Picture class to do so.
-                            # Picture blocks are base64 encoded in Ogg Vorbis.
-                            picture = mutagen.flac.Picture(base64.b64decode(pic))
-
-                            if picture.type == 3:
-                                album_art_image = picture.data
-                                break
-                else:  # Load external album art.
-                    try:
-                        with open(include_album_art, 'rb') as f:
-                            album_art_image = f.read()
-                    except OSError:
-                        self.logger.warning(
-                            "Image file: %r cannot be read. Uploading %r without album art.",
-                            include_album_art, path
-                        )
+            if include_album_art is True:  # Embedded album art, from the metadata already parsed if any.
+                album_art_image = self._album_art(path, audios.get(sample_request.challenge_info.client_track_id))
+            elif include_album_art:
+                album_art_image = external_album_art
 
             try:
-                res = self._make_call(
-                    MyProvideSample,
-                    path,
-                    sample_request,
-                    track,
-                    self.uploader_id,
-                    bogus_sample,
-                    album_art_image
-                )
+                sample = b''  # just send empty bytes
+                if enable_matching:
+                    with metrics.stage_seconds.time(stage='sample_wait'):
+                        sample = samples[sample_request.challenge_info.client_track_id].result()
+
+                with metrics.stage_seconds.time(stage='provide_sample'):
+                    res = self._make_call(
+                        MyProvideSample,
+                        path,
+                        sample_request,
+                        track,
+                        self.uploader_id,
+                        sample,
+                        album_art_image
+                    )
 
             except (IOError, ValueError) as e:
                 self.logger.warning("couldn't create scan and match sample for '%r': %s", path, str(e))
@@ -255,7 +332,117 @@ class Manager(Musicmanager):
             # TODO reordering requests could avoid wasting time waiting for reup sync
             self._make_call(musicmanager.UpdateUploadState, 'start', self.uploader_id)
 
-            for server_id, (path, track, do_not_rematch) in to_upload.items():
+            # Start every transcode now; the pool works ahead of the uploads.
+            transcodes = {}  # {serverid: Future}
+            if enable_transcoding:
+                for server_id, (path, track, do_not_rematch) in to_upload.items():
+                    if track.original_content_type != locker_pb2.Track.MP3:
+                        self.logger.info("transcoding '%r' to mp3", path)
+                        transcodes[server_id] = self.transcoder.submit(path, quality=transcode_quality)
+
+            sessions = threading.BoundedSemaphore(max_sessions or workers)
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                    futures = [
+                        executor.submit(
+                            self._upload_track,
+                            server_id, path, track, do_not_rematch,
+                            transcodes.get(server_id), sessions, uploaded
+                        )
+                        for server_id, (path, track, do_not_rematch) in to_upload.items()
+                    ]
+                    for future in as_completed(futures):
+                        path, server_id, err_msg = future.result()
+                        if err_msg is None:
+                            uploaded[path] = server_id
+                        else:
+                            not_uploaded[path] = err_msg
+            finally:
+                # the results of the batch are kept even if the server does not hear about its end
+                try:
+                    self._make_call(musicmanager.UpdateUploadState, 'stopped', self.uploader_id)
+                except (CallFailure, requests.RequestException) as e:
+                    self.logger.warning("could not stop the upload state: %s", e)
+
+        return uploaded, matched, not_uploaded
+
+    def _upload_track(self, server_id, path, track, do_not_rematch, transcode, sessions, uploaded):
+        """Uploads a single track requested by the server.
+
+        :param transcode: Future of the mp3 transcode for non-MP3 tracks,
+          ``None`` when transcoding is disabled.
+
+        A failed Google call is retried for this track alone, following ``self.retry_policy``;
+        the other tracks of the batch go on meanwhile. A file error, e.g. the file deleted since the batch
+        started, is reported for this track alone too.
+
+        Returns a 3-tuple ``(path, server_id, error)``; ``error`` is ``None`` on success.
+        """
+
+        if self.upload_listener is not None:
+            self.upload_listener(path)
+
+        if track.original_content_type != locker_pb2.Track.MP3:
+            if transcode is not None:
+                try:
+                    with metrics.stage_seconds.time(stage='transcode_wait'):
+                        source = transcode.result()
+                except (IOError, ValueError) as e:
+                    self.logger.warning("error transcoding %r: %s", path, e)
+                    return path, server_id, "transcoding error: %s" % e
+            else:
+                return path, server_id, "transcoding disabled"
+        else:
+            source = path
+
+        try:
+            attempt = 0
+            while True:
+                try:
+                    upload_response = self._upload_session(server_id, path, track, do_not_rematch,
+                                                           source, sessions, uploaded)
+                    break
+                except (CallFailure, requests.RequestException) as e:
+                    delay = self.retry_policy.delay(e, attempt)
+                    if delay is None:
+                        self.logger.warning("giving up on upload of '%r': %s", path, e)
+                        if classify(e) == PERMANENT:
+                            return path, server_id, "upload error: %s" % e
+                        return path, server_id, "%s: %s" % (INTERRUPTED, e)
+                    attempt += 1
+                    self.logger.info("upload of '%r' failed, retrying in %.1fs: %s", path, delay, e)
+                    time.sleep(delay)
+                except OSError as e:
+                    # after the clause above, as requests errors are OSError too
+                    self.logger.warning("could not read '%r': %s", path, e)
+                    return path, server_id, "file error: %s" % e
+        finally:
+            if source != path:
+                try:
+                    os.remove(source)
+                except OSError as e:
+                    self.logger.warning("could not remove the transcode of '%r': %s", path, e)
+
+        if isinstance(upload_response, str):
+            return path, server_id, upload_response
+
+        success = upload_response.get('sessionStatus', {}).get('state')
+        if not success:
+            # 404 == already uploaded? serverside check on clientid?
+            self.logger.debug("could not finalize upload of '%r'. response: %s",
+                              path, upload_response)
+            return path, server_id, 'could not finalize upload; details in log'
+
+        return path, server_id, None
+
+    def _upload_session(self, server_id, path, track, do_not_rematch, source, sessions, uploaded):
+        """Gets an upload session for a track then streams ``source`` to it.
+
+        Returns the UploadFile response, or an error message if no session could be obtained.
+        """
+
+        with sessions:
+            with metrics.stage_seconds.time(stage='session'):
                 # It can take a few tries to get an session.
                 should_retry = True
                 attempts = 0
@@ -282,54 +469,186 @@ class Manager(Musicmanager):
                         # 200 == already uploaded, so force a retry in this case
                         should_retry = True
 
-                    time.sleep(6)  # wait before retrying
+                    # wait before retrying, backing off further on each attempt
+                    time.sleep(self.retry_policy.session_backoff.delay(attempts - 1))
                 else:
                     err_msg = "GetUploadSession error %s: %s" % (error_code, reason)
 
                     self.logger.warning("giving up on upload session for '%r': %s", path, err_msg)
-                    not_uploaded[path] = err_msg
+                    return err_msg
 
-                    continue  # to next upload
-
-                # got a session, do the upload
-                # this terribly inconsistent naming isn't my fault: Google--
-                session = session['sessionStatus']
-                external = session['externalFieldTransfers'][0]
-
-                session_url = external['putInfo']['url']
-                content_type = external.get('content_type', 'audio/mpeg')
-
-                if track.original_content_type != locker_pb2.Track.MP3:
-                    if enable_transcoding:
-                        try:
-                            self.logger.info("transcoding '%r' to mp3", path)
-                            contents = utils.transcode_to_mp3(path, quality=transcode_quality)
-                        except (IOError, ValueError) as e:
-                            self.logger.warning("error transcoding %r: %s", path, e)
-                            not_uploaded[path] = "transcoding error: %s" % e
-                            continue
-                    else:
-                        not_uploaded[path] = "transcoding disabled"
-                        continue
-                else:
-                    with open(path, 'rb') as f:
-                        contents = f.read()
+            # got a session, do the upload
+            # this terribly inconsistent naming isn't my fault: Google--
+            session = session['sessionStatus']
+            external = session['externalFieldTransfers'][0]
+
+            session_url = external['putInfo']['url']
+            content_type = external.get('content_type', 'audio/mpeg')
 
+            # The file object is streamed by requests in small blocks instead of being loaded in memory,
+            # each block waiting for the bandwidth limiter when one is set.
+            with open(source, 'rb') as contents, metrics.stage_seconds.time(stage='upload'):
+                body = contents if self.bandwidth is None else self.bandwidth.reader(contents)
                 upload_response = self._make_call(musicmanager.UploadFile,
-                                                  session_url, content_type, contents)
+                                                  session_url, content_type, body)
+                metrics.bytes_sent.inc(contents.tell())
+            return upload_response
 
-                success = upload_response.get('sessionStatus', {}).get('state')
-                if success:
-                    uploaded[path] = server_id
-                else:
-                    # 404 == already uploaded? serverside check on clientid?
-                    self.logger.debug("could not finalize upload of '%r'. response: %s",
-                                      path, upload_response)
-                    not_uploaded[path] = 'could not finalize upload; details in log'
 
-            self._make_call(musicmanager.UpdateUploadState, 'stopped', self.uploader_id)
+class MyUploadMetadata(musicmanager.UploadMetadata):
+    @staticmethod
+    def get_track_clientid(filepath, chunk_size=1024 * 1024):
+        """Same id as gmusicapi and the Music Manager: the md5 of the file once mutagen stripped its tags,
+        base64 encoded without padding. Tags are stripped from a temporary copy, then the copy is hashed by chunks.
+        """
+        digest = hashlib.md5()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = os.path.join(temp_dir, 'track' + os.path.splitext(filepath)[1])
+            shutil.copyfile(filepath, temp_path)
+            audio = mutagen.File(temp_path, easy=True)
+            audio.delete()
+            audio.save()
+            with open(temp_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    digest.update(chunk)
+        return base64.encodebytes(digest.digest())[:-3]
+
+    @classmethod
+    def fill_track_info(cls, filepath, audio=None):
+        """Given the path of a track and its already parsed ``mutagen.File(path, easy=True)``,
+        return a filled locker_pb2.Track.
+        On problems, raise ValueError."""
+        track = locker_pb2.Track()
+
+        # The track protobuf message supports an additional metadata list field.
+        # ALBUM_ART_HASH has been observed being sent in this field so far.
+        # Append locker_pb2.AdditionalMetadata objects to additional_metadata.
+        # AdditionalMetadata objects consist of two fields, 'tag_name' and 'value'.
+        additional_metadata = []
+
+        track.client_id = cls.get_track_clientid(filepath)
+
+        if audio is None:
+            audio = mutagen.File(filepath, easy=True)
+
+        if audio is None:
+            raise ValueError("could not open to read metadata")
+        elif isinstance(audio, mutagen.asf.ASF):
+            # WMA entries store more info than just the value.
+            # Monkeypatch in a dict {key: value} to keep interface the same for all filetypes.
+            asf_dict = dict((k, [ve.value for ve in v]) for (k, v) in audio.tags.as_dict().items())
+            audio.tags = asf_dict
+
+        extension = os.path.splitext(filepath)[1].upper()
+
+        if isinstance(extension, bytes):
+            extension = extension.decode('utf8')
+
+        if extension:
+            # Trim leading period if it exists (ie extension not empty).
+            extension = extension[1:]
+
+        if isinstance(audio, mutagen.mp4.MP4) and (
+                audio.info.codec == 'alac' or audio.info.codec_description == 'ALAC'):
+            extension = 'ALAC'
+        elif isinstance(audio, mutagen.mp4.MP4) and audio.info.codec_description.startswith('AAC'):
+            extension = 'AAC'
+
+        if extension.upper() == 'M4B':
+            # M4B are supported by the music manager, and transcoded like normal.
+            extension = 'M4A'
+
+        if not hasattr(locker_pb2.Track, extension):
+            raise ValueError("unsupported filetype: {0} for file {1}".format(extension, filepath))
+
+        track.original_content_type = getattr(locker_pb2.Track, extension)
+
+        track.estimated_size = os.path.getsize(filepath)
+        track.last_modified_timestamp = int(os.path.getmtime(filepath))
+
+        # These are typically zeroed in my examples.
+        track.play_count = 0
+        track.client_date_added = 0
+        track.recent_timestamp = 0
+        track.rating = locker_pb2.Track.NOT_RATED  # star rating
+
+        track.duration_millis = int(audio.info.length * 1000)
+
+        try:
+            bitrate = audio.info.bitrate // 1000
+        except AttributeError:
+            # mutagen doesn't provide bitrate for some lossless formats (eg FLAC), so
+            # provide an estimation instead. This shouldn't matter too much;
+            # the bitrate will always be > 320, which is the highest scan and match quality.
+            bitrate = (track.estimated_size * 8) // track.duration_millis
+
+        track.original_bit_rate = bitrate
+
+        # Populate metadata.
+
+        def track_set(field_name, val, msg=track):
+            """Returns result of utils.pb_set and logs on failures.
+            Should be used when setting directly from metadata."""
+            success = utils.pb_set(msg, field_name, val)
+
+            if not success:
+                musicmanager.log.info("could not pb_set track.%s = %r for '%r'", field_name, val, filepath)
+
+            return success
+
+        # Title is required.
+        # If it's not in the metadata, the filename will be used.
+        if "title" in audio:
+            title = audio['title'][0]
+            if isinstance(title, mutagen.asf.ASFUnicodeAttribute):
+                title = title.value
+
+            track_set('title', title)
+        else:
+            # Assume ascii or unicode.
+            track.title = os.path.basename(filepath)
 
-        return uploaded, matched, not_uploaded
+        if "date" in audio:
+            date_val = str(audio['date'][0])
+            try:
+                datetime = dateutil.parser.parse(date_val, fuzzy=True)
+            except (ValueError, TypeError) as e:
+                # TypeError provides compatibility with:
+                #  https://bugs.launchpad.net/dateutil/+bug/1247643
+                musicmanager.log.warning("could not parse date md for '%r': (%s)", filepath, e)
+            else:
+                track_set('year', datetime.year)
+
+        for null_field in ['artist', 'album']:
+            # If these fields aren't provided, they'll render as "undefined" in the web interface;
+            # see https://github.com/simon-weber/gmusicapi/issues/236.
+            # Defaulting them to an empty string fixes this.
+            if null_field not in audio:
+                track_set(null_field, '')
+
+        # Mass-populate the rest of the simple fields.
+        # Merge shared and unshared fields into {mutagen: Track}.
+        fields = dict(
+            itertools.chain(
+                ((shared, shared) for shared in cls.shared_fields),
+                cls.field_map.items()))
+
+        for mutagen_f, track_f in fields.items():
+            if mutagen_f in audio:
+                track_set(track_f, audio[mutagen_f][0])
+
+        for mutagen_f, (track_f, track_total_f) in cls.count_fields.items():
+            if mutagen_f in audio:
+                numstrs = str(audio[mutagen_f][0]).split("/")
+                track_set(track_f, numstrs[0])
+
+                if len(numstrs) == 2 and numstrs[1]:
+                    track_set(track_total_f, numstrs[1])
+
+        if additional_metadata:
+            track.track_extras.additional_metadata.extend(additional_metadata)
+
+        return track
 
 
 class MyProvideSample(musicmanager.MmCall):
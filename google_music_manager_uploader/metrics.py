@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import threading
+from contextlib import contextmanager
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in sorted(labels.items()))
+
+
+class Counter:
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self.type = 'counter'
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            for key, value in self._values.items():
+                yield self.name, dict(key), value
+
+
+class Gauge:
+    def __init__(self, name: str, description: str, function) -> None:
+        """
+        :param function: callable returning the current value
+        """
+        self.name = name
+        self.description = description
+        self.type = 'gauge'
+        self.function = function
+
+    def total(self) -> float:
+        return self.function()
+
+    def samples(self):
+        yield self.name, {}, self.function()
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.type = 'histogram'
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}  # {labels: [bucket counts, sum, count]}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the with block
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def totals(self) -> dict:
+        """
+        :return: {labels: (sum, count)}
+        """
+        with self._lock:
+            return {key: (total, count) for key, (counts, total, count) in self._values.items()}
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, (counts, total, count) in values:
+            labels = dict(key)
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield self.name + '_bucket', dict(labels, le='+Inf' if bound == float('inf') else bound), bucket_count
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+
+class Registry:
+    """
+    Set of metrics rendered in the Prometheus text format
+    """
+
+    def __init__(self) -> None:
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._register(Counter(name, description))
+
+    def gauge(self, name: str, description: str, function) -> Gauge:
+        with self._lock:
+            self.metrics[name] = Gauge(name, description, function)
+            return self.metrics[name]
+
+    def histogram(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append('# HELP %s %s' % (metric.name, metric.description))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """
+        :return: one line with every counter and gauge total and the mean time of each histogram series
+        """
+        parts = []
+        for metric in list(self.metrics.values()):
+            if isinstance(metric, Histogram):
+                for key, (total, count) in sorted(metric.totals().items()):
+                    if count:
+                        parts.append('%s%s=%.3fs/%d' % (metric.name, _labels(dict(key)), total / count, count))
+            else:
+                parts.append('%s=%g' % (metric.name, metric.total()))
+        return ' '.join(parts)
+
+
+REGISTRY = Registry()
+
+files = REGISTRY.counter('gmm_files_total', 'Files handled, by result (uploaded, matched, not_uploaded, skipped)')
+not_uploaded = REGISTRY.counter('gmm_not_uploaded_total', 'Files not uploaded, by reason')
+stage_seconds = REGISTRY.histogram('gmm_stage_seconds', 'Time spent in each upload stage')
+bytes_sent = REGISTRY.counter('gmm_upload_bytes_total', 'Audio bytes sent to Google')
+track_cache = REGISTRY.counter('gmm_track_cache_total', 'Track info lookups in the persistent cache, by result')
+transcode_cache = REGISTRY.counter('gmm_transcode_cache_total', 'Transcode and sample cache lookups, by result')
+
+
+def reason(message: str) -> str:
+    """
+    Turns a not_uploaded message into a short label without paths nor ids
+    :param message: reason returned by Manager.upload
+    """
+    message = message.split('(')[0]
+    if message.startswith('TrackSampleResponse') and ':' in message:
+        return message.split(':')[1].strip()[:60]  # symbolic name of the response code
+    return message.split(':')[0].strip()[:60]
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer only exists from Python 3.7
+    daemon_threads = True
+
+
+class MetricsServer:
+    """
+    Serves the registry on http://<host>:<port>/metrics in a background thread
+    """
+
+    def __init__(self, port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = _ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SummaryLogger:
+    """
+    Logs the registry summary every interval seconds in a background thread
+    """
+
+    def __init__(self, logger, interval: float = 60.0, registry: Registry = REGISTRY) -> None:
+        self.logger = logger
+        self.interval = interval
+        self.registry = registry
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-summary', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._thread.join()
+        self.logger.info("Metrics: %s" % self.registry.summary())
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            self.logger.info("Metrics: %s" % self.registry.summary())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import logging
+import threading
+
+import mutagen
+
+
+def _text(value) -> str:
+    return str(getattr(value, 'value', value) or '').strip().casefold()
+
+
+def _number(value) -> int:
+    try:
+        return int(str(getattr(value, 'value', value)).split('/')[0])
+    except ValueError:
+        return 0
+
+
+def track_key(title, artist, album, album_artist, track_number, disc_number) -> tuple:
+    """
+    :return: key identifying a track by the fields Music Manager sends from its tags, case and spacing insensitive
+    """
+    return (
+        _text(title), _text(artist), _text(album), _text(album_artist), _number(track_number), _number(disc_number)
+    )
+
+
+def file_key(file_path: str) -> tuple:
+    """
+    Reads the tags of a file the way MyUploadMetadata.fill_track_info does, without hashing the file
+    :param file_path: Path to the audio file
+    :return: track_key of the file, None if its tags cannot be read
+    """
+    try:
+        audio = mutagen.File(file_path, easy=True)
+    except Exception:
+        return None
+    if audio is None:
+        return None
+    tags = audio.tags or {}
+
+    def tag(name: str):
+        values = tags.get(name)
+        return values[0] if values else None
+    # the file name stands for a missing title, as in fill_track_info
+    title = tag('title') if 'title' in tags else os.path.basename(file_path)
+    return track_key(
+        title, tag('artist'), tag('album'), tag('albumartist'), tag('tracknumber') or 0, tag('discnumber') or 0
+    )
+
+
+class RemoteLibrary:
+    """
+    Local lookup of the tracks already uploaded or matched to a Google Music account, keyed on their tags.
+    It is filled once from the paged listing of the account, then kept up to date with the uploads of the daemon,
+    so that files already in the account are skipped without any metadata call.
+    """
+
+    def __init__(self, logger: logging.Logger = None) -> None:
+        """
+        :param logger: logging.Logger object for logs. None by default
+        """
+        self.logger = logger or logging.getLogger(__name__)
+        self.synced = False
+        self._tracks = {}  # {track_key: server id}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def sync(self, api) -> int:
+        """
+        Lists every uploaded song of the account, chunk by chunk
+        :param api: Musicmanager. logged in client of the account
+        :raises CallFailure:
+        :return: number of tracks listed
+        """
+        listed = 0
+        for chunk in api.get_uploaded_songs(incremental=True):
+            with self._lock:
+                for song in chunk:
+                    key = track_key(
+                        song['title'], song['artist'], song['album'], song['album_artist'],
+                        song['track_number'], song['disc_number'],
+                    )
+                    self._tracks[key] = song['id']
+            listed += len(chunk)
+            self.logger.info("Account library: %d track(s) listed" % listed)
+        self.synced = True
+        return listed
+
+    def add(self, file_path: str, server_id: str) -> None:
+        """
+        Records a file uploaded or matched by the daemon
+        :param file_path: Path to the file
+        :param server_id: Google Music id of the track
+        """
+        key = file_key(file_path)
+        if key is not None:
+            with self._lock:
+                self._tracks[key] = server_id
+
+    def find(self, file_path: str) -> str:
+        """
+        :param file_path: Path to a local file
+        :return: Google Music id of the track with the same tags, None if the account does not have it
+        """
+        if not self._tracks:
+            return None
+        key = file_key(file_path)
+        with self._lock:
+            return self._tracks.get(key)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import re
+import time
+import random
+import threading
+
+import requests
+
+AUTH = 'auth'
+THROTTLED = 'throttled'
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+_STATUS = re.compile(r'\b([45]\d\d) (?:Client|Server) Error')
+
+
+class FailedFiles(Exception):
+    """
+    Raised once a batch went through when some of its files failed on transient errors,
+    so that only these files are uploaded again
+    """
+
+    def __init__(self, file_paths: list) -> None:
+        """
+        :param file_paths: List of paths to upload again
+        """
+        super().__init__("%d file(s) interrupted" % len(file_paths))
+        self.file_paths = file_paths
+
+
+def _response(error: Exception):
+    """
+    :return: requests.Response attached to the error or to one of its causes, None if there is none
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        response = getattr(error, 'response', None)
+        if response is not None:
+            return response
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def http_status(error: Exception):
+    """
+    :param error: CallFailure or requests exception raised by a Google call
+    :return: HTTP status code of the failed call, None if the failure did not come from an HTTP error
+    """
+    response = _response(error)
+    if response is not None:
+        return response.status_code
+    match = _STATUS.search(str(error))
+    return int(match.group(1)) if match else None
+
+
+def retry_after(error: Exception):
+    """
+    :param error: CallFailure or requests exception raised by a Google call
+    :return: seconds asked by the server in its Retry-After header, None if it did not ask
+    """
+    response = _response(error)
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def classify(error: Exception) -> str:
+    """
+    Tells why a Google call failed from its HTTP status
+    :param error: CallFailure or requests exception raised by the call
+    :return: AUTH (token expired), THROTTLED (server asks to slow down), TRANSIENT (server or network error)
+        or PERMANENT (retrying the same call cannot succeed)
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, FailedFiles)):
+        return TRANSIENT
+    status = http_status(error)
+    if status == 401:
+        return AUTH
+    if status in (429, 503):
+        return THROTTLED
+    if status is not None and status >= 500:
+        return TRANSIENT
+    return PERMANENT
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter, so that workers failing together do not retry in lockstep
+    """
+
+    def __init__(self, base: float = 1.0, cap: float = 120.0) -> None:
+        """
+        :param base: Float. upper bound of the first delay in seconds. 1 by default
+        :param cap: Float. maximum delay in seconds. 120 by default
+        """
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt: int) -> float:
+        """
+        :param attempt: Integer. number of failed attempts so far, starting at 0
+        :return: seconds to wait, drawn between 0 and min(cap, base * 2 ** attempt)
+        """
+        return random.uniform(0, min(self.cap, self.base * 2 ** min(attempt, 32)))
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every worker, limiting the rate of Google calls
+    """
+
+    def __init__(self, rate: float = 0, burst: int = 5) -> None:
+        """
+        :param rate: Float. calls per second, 0 for unlimited. 0 by default
+        :param burst: Integer. calls allowed at once after an idle period. 5 by default
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token, possibly ahead of time
+        :return: seconds to wait before the call may be sent
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self) -> None:
+        time.sleep(self.reserve())
+
+
+class CircuitBreaker:
+    """
+    Stops every worker from calling Google after repeated throttling or server errors,
+    then lets a single probe through once reset_timeout elapsed
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 60.0) -> None:
+        """
+        :param threshold: Integer. consecutive failures opening the circuit. 5 by default
+        :param reset_timeout: Float. seconds the circuit stays open before a probe. 60 by default
+        """
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened is None:
+                return 'closed'
+            return 'half-open' if self._probing else 'open'
+
+    def remaining(self) -> float:
+        """
+        :return: seconds before the circuit lets a probe through, 0 if closed. Unlike wait_time, claims no probe
+        """
+        with self._lock:
+            if self._opened is None:
+                return 0.0
+            return max(0.0, self._opened + self.reset_timeout - time.monotonic())
+
+    def wait_time(self) -> float:
+        """
+        Claims the probe once reset_timeout elapsed: its outcome must then be given to success, failure or release
+        :return: seconds to wait before calling, 0 if the call may be sent now
+        """
+        with self._lock:
+            if self._opened is None:
+                return 0.0
+            remaining = self._opened + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self._probing:
+                return 1.0  # the probe has not answered yet
+            self._probing = True
+            return 0.0
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._probing = False
+
+    def release(self) -> None:
+        """
+        Ends a probe which did not tell whether Google recovered, so that the next call probes again
+        """
+        with self._lock:
+            self._probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                self._opened = time.monotonic()
+                self._probing = False
+
+
+class RetryPolicy:
+    """
+    Retry decisions shared by every worker: classifies failed Google calls, spaces retries out
+    with jittered exponential backoff, limits the call rate and trips a circuit breaker under throttling.
+    Expired authentication is renewed once through the relogin callable instead of being retried blindly.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        backoff: Backoff = None,
+        session_backoff: Backoff = None,
+        rate_limiter: RateLimiter = None,
+        breaker: CircuitBreaker = None,
+        relogin=None,
+        logger=None,
+    ) -> None:
+        """
+        :param max_attempts: Integer. attempts of a batch before giving up. 5 by default
+        :param backoff: Backoff. delays between attempts of a batch. Backoff() by default
+        :param session_backoff: Backoff. delays between GetUploadSession attempts. Backoff(2, 60) by default
+        :param rate_limiter: RateLimiter. limit of the Google call rate. unlimited by default
+        :param breaker: CircuitBreaker. CircuitBreaker() by default
+        :param relogin: callable renewing the authentication, returning False on failure. None by default
+        :param logger: logging.Logger object for logs. None by default
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff or Backoff()
+        self.session_backoff = session_backoff or Backoff(2.0, 60.0)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.relogin = relogin
+        self.logger = logger
+        self._relogin_lock = threading.Lock()
+        self._relogged = 0.0
+
+    def before_call(self) -> None:
+        """
+        Blocks until the circuit breaker and the rate limiter let a call through
+        """
+        wait = self.breaker.wait_time()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.breaker.wait_time()
+        self.rate_limiter.acquire()
+
+    def record(self, error: Exception = None) -> None:
+        """
+        Feeds the circuit breaker with the outcome of a call
+        :param error: exception raised by the call, None on success
+        """
+        if error is None:
+            self.breaker.success()
+        elif classify(error) in (THROTTLED, TRANSIENT):
+            self.breaker.failure()
+        else:
+            self.breaker.release()
+
+    def delay(self, error: Exception, attempt: int):
+        """
+        Tells how to handle a failed attempt
+        :param error: exception raised by the attempt
+        :param attempt: Integer. number of failed attempts before this one, starting at 0
+        :return: seconds to wait before retrying, None if it should not be retried
+        """
+        kind = classify(error)
+        if kind == PERMANENT or attempt + 1 >= self.max_attempts:
+            return None
+        if kind == AUTH:
+            return 0.0 if self.reauthenticate() else None
+        delay = self.backoff.delay(attempt)
+        if kind == THROTTLED:
+            delay = max(delay, retry_after(error) or 0.0, self.breaker.remaining())
+        return delay
+
+    def reauthenticate(self, min_interval: float = 30.0) -> bool:
+        """
+        Renews the authentication once for all the workers failing at the same time
+        :param min_interval: Float. seconds during which a renewal is reused. 30 by default
+        :return: False if the authentication could not be renewed
+        """
+        if self.relogin is None:
+            return True
+        with self._relogin_lock:
+            if time.monotonic() - self._relogged < min_interval:
+                return True
+            if self.logger:
+                self.logger.info("Authentication expired, logging in again")
+            if not self.relogin():
+                return False
+            self._relogged = time.monotonic()
+            return True
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+
+# Extensions MyUploadMetadata.fill_track_info accepts: the locker content types, M4B uploaded as M4A,
+# and MP4 holding AAC or ALAC audio
+AUDIO_EXTENSIONS = frozenset(
+    ('.mp3', '.m4a', '.aac', '.flac', '.ogg', '.wma', '.m4p', '.alac', '.m4b', '.mp4')
+)
+
+
+def is_audio(file_path: str, extensions: frozenset = AUDIO_EXTENSIONS) -> bool:
+    """
+    :param file_path: Path to a file
+    :param extensions: accepted lowercase extensions. AUDIO_EXTENSIONS by default
+    :return: True if the file extension is one of an uploadable format
+    """
+    return os.path.splitext(file_path)[1].lower() in extensions
+
+
+def is_hidden(path: str, root: str = None) -> bool:
+    """
+    Hidden files and directories are skipped, as glob('**/*') did: trash folders such as .Trash-1000,
+    AppleDouble resource forks such as ._01.mp3, temporary files of copy tools
+    :param path: Path to a file or directory
+    :param root: Directory above the path whose own name does not count, None to check the name of the path only
+    :return: True if the name of the path, or of one of its directories below root, starts with a dot
+    """
+    relative = os.path.relpath(path, root) if root else os.path.basename(path)
+    return any(part.startswith('.') and part not in (os.curdir, os.pardir) for part in relative.split(os.sep))
+
+
+def scan_entries(directory: str, extensions: frozenset = AUDIO_EXTENSIONS):
+    """
+    Lazily walks a directory tree and yields its audio files as os.DirEntry objects,
+    whose type and stat results are cached so callers do not need to stat them again.
+    Directory symlinks are followed once; unreadable and hidden directories and hidden files are skipped.
+    :param directory: Root of the tree
+    :param extensions: accepted lowercase extensions. AUDIO_EXTENSIONS by default
+    """
+    stack = [directory]
+    visited = set()
+    while stack:
+        current = stack.pop()
+        try:
+            stat = os.stat(current)
+            if (stat.st_dev, stat.st_ino) in visited:
+                continue
+            visited.add((stat.st_dev, stat.st_ino))
+            entries = os.scandir(current)
+            try:
+                subdirectories = []
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            subdirectories.append(entry.path)
+                        elif is_audio(entry.name, extensions) and entry.is_file():
+                            yield entry
+                    except OSError:
+                        continue
+            finally:
+                # the iterator is only a context manager with close() from Python 3.6
+                if hasattr(entries, 'close'):
+                    entries.close()
+        except OSError:
+            continue
+        # keep a depth-first, name-ordered walk
+        stack.extend(sorted(subdirectories, reverse=True))
+
+
+def scan(directory: str, extensions: frozenset = AUDIO_EXTENSIONS):
+    """
+    Lazily yields the paths of the audio files found under a directory
+    :param directory: Root of the tree
+    :param extensions: accepted lowercase extensions. AUDIO_EXTENSIONS by default
+    """
+    for entry in scan_entries(directory, extensions):
+        yield entry.path
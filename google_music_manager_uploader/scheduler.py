@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+POLICIES = ('fifo', 'newest', 'smallest', 'album', 'fair')
+
+
+class PendingFiles:
+    """
+    Files waiting for an upload batch, handed out following a policy:
+
+    - fifo: in discovery order
+    - newest: most recently modified first
+    - smallest: smallest first, so a large mix does not hold back many tracks
+    - album: album by album (the files of a directory together), albums in discovery order, tracks by name
+    - fair: top-level folders of the library take turns, files of a folder in discovery order
+
+    With aging, a file pending for that many seconds goes first whatever the policy, so no file is starved.
+    Not thread safe, callers hold their own lock.
+    """
+
+    def __init__(
+        self,
+        policy: str = 'fifo',
+        aging: float = 0,
+        root: str = None,
+        stat=os.stat,
+        clock=time.monotonic,
+    ) -> None:
+        """
+        :param policy: one of POLICIES. fifo by default
+        :param aging: Float. seconds after which a pending file goes first, 0 to disable. 0 by default
+        :param root: Path to the library, whose top-level folders take turns with the fair policy. None by default
+        :param stat: callable returning the os.stat_result of a path. os.stat by default
+        :param clock: callable returning the current time in seconds. time.monotonic by default
+        """
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy %s, expected one of %s" % (policy, ', '.join(POLICIES)))
+        self.policy = policy
+        self.aging = aging
+        self.root = root
+        self._stat = stat
+        self._clock = clock
+        self._sequence = itertools.count()
+        self._files = {}  # {path: (sequence, group, album)}
+        self._heaps = {}  # {group: [(key, sequence, path)]}, a single group but with the fair policy
+        self._served = {}  # {group: files handed out}
+        self._albums = {}  # {album: [sequence of its first file, pending files]}
+        self._arrivals = deque()  # [(time, sequence, path)] oldest first, for aging
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._files
+
+    def _group(self, path: str) -> str:
+        if self.policy != 'fair':
+            return ''
+        parts = (os.path.relpath(path, self.root) if self.root else path).split(os.sep)
+        return parts[0] if len(parts) > 1 else ''
+
+    def _key(self, path: str, sequence: int, album: str) -> tuple:
+        if self.policy in ('newest', 'smallest'):
+            try:
+                stat = self._stat(path)
+            except OSError:
+                return 0, sequence
+            return (-stat.st_mtime if self.policy == 'newest' else stat.st_size), sequence
+        if self.policy == 'album':
+            return self._albums[album][0], path
+        return sequence,
+
+    def _valid(self, sequence: int, path: str) -> bool:
+        entry = self._files.get(path)
+        return entry is not None and entry[0] == sequence
+
+    def _clean(self, group: str) -> None:
+        """
+        Drops the files already handed out from the top of a group, and the group once empty
+        """
+        heap = self._heaps[group]
+        while heap and not self._valid(heap[0][1], heap[0][2]):
+            heapq.heappop(heap)
+        if not heap:
+            del self._heaps[group]
+            self._served.pop(group, None)
+
+    def add(self, path: str) -> bool:
+        """
+        :param path: Path to a file to upload
+        :return: False if the file is already pending
+        """
+        if path in self._files:
+            return False
+        sequence = next(self._sequence)
+        album = os.path.dirname(path)
+        if self.policy == 'album':
+            self._albums.setdefault(album, [sequence, 0])[1] += 1
+        group = self._group(path)
+        if group not in self._heaps:
+            # a new folder starts level with the others rather than being served many files in a row
+            self._served[group] = min(self._served.values(), default=0)
+            self._heaps[group] = []
+        self._files[path] = (sequence, group, album)
+        heapq.heappush(self._heaps[group], (self._key(path, sequence, album), sequence, path))
+        if self.aging > 0:
+            self._arrivals.append((self._clock(), sequence, path))
+        return True
+
+    def _take(self, path: str) -> str:
+        _, group, album = self._files.pop(path)
+        if self.policy == 'album':
+            entry = self._albums[album]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._albums[album]
+        self._served[group] += 1
+        self._clean(group)
+        return path
+
+    def _next(self) -> str:
+        arrivals = self._arrivals
+        while arrivals and not self._valid(arrivals[0][1], arrivals[0][2]):
+            arrivals.popleft()
+        if arrivals and self._clock() - arrivals[0][0] >= self.aging:
+            return self._take(arrivals.popleft()[2])
+        group = min(self._heaps, key=lambda name: (self._served[name], self._heaps[name][0][1]))
+        return self._take(heapq.heappop(self._heaps[group])[2])
+
+    def pop(self, count: int) -> list:
+        """
+        :param count: Integer. maximum number of files
+        :return: the next files to upload, removed from the pending ones
+        """
+        batch = []
+        while self._files and len(batch) < count:
+            batch.append(self._next())
+        return batch
+
+
+class FairScheduler:
+    """
+    Shares a bounded number of concurrent upload batches between the accounts of a daemon.
+    A free slot goes to the waiting account holding the fewest slots, the longest waiting first,
+    so that a large library cannot starve the others.
+    """
+
+    def __init__(self, max_batches: int = 2) -> None:
+        """
+        :param max_batches: Integer. batches uploaded at once over every account. 2 by default
+        """
+        self.max_batches = max(1, max_batches)
+        self._active = {}  # {account: batches in progress}
+        self._waiting = []  # [(sequence, account)]
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _next(self):
+        """
+        :return: (sequence, account) that should get the next free slot
+        """
+        return min(self._waiting, key=lambda waiting: (self._active.get(waiting[1], 0), waiting[0]))
+
+    @contextmanager
+    def slot(self, account: str):
+        """
+        Blocks until the account may upload a batch, for the duration of the with block
+        :param account: name of the account
+        """
+        with self._condition:
+            ticket = (next(self._sequence), account)
+            self._waiting.append(ticket)
+            while sum(self._active.values()) >= self.max_batches or self._next() != ticket:
+                self._condition.wait()
+            self._waiting.remove(ticket)
+            self._active[account] = self._active.get(account, 0) + 1
+            self._condition.notify_all()  # the next waiting account may fit in a remaining slot
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active[account] -= 1
+                self._condition.notify_all()
+
+    def active(self) -> dict:
+        """
+        :return: {account: batches in progress}
+        """
+        with self._condition:
+            return {account: count for account, count in self._active.items() if count}
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import time
+import sqlite3
+import threading
+
+
+def _key(stat: os.stat_result) -> tuple:
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+class TrackCache:
+    """
+    Persistent cache of the Track messages built by MyUploadMetadata.fill_track_info, client id included,
+    keyed on path, size, mtime and inode. Unchanged files are neither hashed nor parsed again
+    by retries, rescans and restarts; a changed file misses and is read once more.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """
+        :param db_path: Path to the SQLite database, created when missing. May be shared with UploadIndex
+        """
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, track BLOB, updated REAL)"
+            )
+
+    def get(self, file_path: str, stat: os.stat_result = None) -> bytes:
+        """
+        :param file_path: Path to the file
+        :param stat: os.stat of the file, taken when missing
+        :return: serialized Track of the file, None if unknown or changed since it was stored
+        """
+        stat = stat or os.stat(file_path)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, inode, track FROM tracks WHERE path = ?", (file_path,)
+            ).fetchone()
+            if row and tuple(row[:3]) == _key(stat):
+                self.hits += 1
+                return row[3]
+            self.misses += 1
+        return None
+
+    def put(self, file_path: str, track: bytes, stat: os.stat_result) -> None:
+        """
+        Stores the Track of a file
+        :param file_path: Path to the file
+        :param track: serialized Track
+        :param stat: os.stat of the file taken before the Track was built, so that a file changed meanwhile misses
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "REPLACE INTO tracks (path, size, mtime_ns, inode, track, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (file_path,) + _key(stat) + (sqlite3.Binary(track), time.time())
+            )
+
+    def stats(self) -> str:
+        return "%d hits, %d misses" % (self.hits, self.misses)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .fingerprint import audio_hash
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_SUFFIX = '.mp3'
+_TEMP_SUFFIX = '.tmp'
+_KEY_LENGTH = 40  # sha1 hex digest
+# other files older than this are leftovers of a crashed process
+_STALE_SECONDS = 3600
+
+
+def _link_or_copy(source: str, destination: str) -> None:
+    """
+    Hard links source to the placeholder destination, copying it on file systems without hard links
+    :raises FileNotFoundError: source is missing
+    """
+    os.remove(destination)
+    try:
+        os.link(source, destination)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class TranscodeCache:
+    """
+    Size bounded on-disk cache of transcoded mp3 files and scan and match samples.
+    Entries are addressed by the fingerprint of the source audio, tags excluded, and the transcode parameters,
+    so a retagged, moved or copied file still hits. Entries are written to a temporary file then renamed,
+    so concurrent workers and processes never read a partial entry, and the least recently used entries
+    are evicted first.
+    """
+
+    def __init__(self, directory: str, max_size: int = 2 * 1024 ** 3, fingerprint=audio_hash) -> None:
+        """
+        :param directory: Directory of the cache, created when missing
+        :param max_size: Integer. maximum bytes of cached entries. 2GiB by default
+        :param fingerprint: callable returning the audio fingerprint of a path. audio_hash by default
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()  # {path: size}, least recently used first
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        entries = []
+        now = time.time()
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(_SUFFIX) and len(name) == _KEY_LENGTH + len(_SUFFIX):
+                    entries.append((stat.st_mtime, path, stat.st_size))
+                elif stat.st_mtime < now - _STALE_SECONDS:
+                    self._remove(path)
+        for _, path, size in sorted(entries):
+            self._entries[path] = size
+            self.size += size
+        self._evict()
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + _SUFFIX)
+
+    def _temp_path(self, key: str) -> str:
+        handle, path = tempfile.mkstemp(suffix=_TEMP_SUFFIX, dir=os.path.dirname(self._path(key)))
+        os.close(handle)
+        return path
+
+    def _evict(self) -> None:
+        while self.size > self.max_size and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self.size -= size
+            self._remove(path)
+
+    def _hit(self, path: str) -> None:
+        with self._lock:
+            self.hits += 1
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        metrics.transcode_cache.inc(result='hit')
+        try:
+            # the order of use survives restarts
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _store(self, temp_path: str, path: str) -> None:
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.size += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            self._evict()
+
+    def key(self, file_path: str, *params) -> str:
+        """
+        :param file_path: Path to the source file
+        :param params: transcode parameters, e.g. quality or slice window
+        :return: address of the entry
+        """
+        content = self.fingerprint(file_path)
+        return hashlib.sha1(':'.join([content] + [str(param) for param in params]).encode()).hexdigest()
+
+    def file(self, key: str, produce) -> str:
+        """
+        Gives a private copy of an entry, produced on a miss
+        :param key: address of the entry, see key()
+        :param produce: callable receiving a directory and returning the path of a new file written in it
+        :return: Path to a file the caller must remove, hard linked to the entry when possible
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        private_path = self._temp_path(key)
+        try:
+            # the caller removes its copy while the entry stays cached
+            _link_or_copy(path, private_path)
+        except FileNotFoundError:
+            pass
+        else:
+            self._hit(path)
+            return private_path
+        with self._lock:
+            self.misses += 1
+        metrics.transcode_cache.inc(result='miss')
+        # produced next to the entry, so that it is linked rather than copied
+        produced = produce(os.path.dirname(path))
+        try:
+            temp_path = self._temp_path(key)
+            _link_or_copy(produced, temp_path)
+            self._store(temp_path, path)
+        except OSError as e:
+            logger.warning("could not cache %s: %s", produced, e)
+        return produced
+
+    def bytes(self, key: str, produce) -> bytes:
+        """
+        Gives the content of an entry, produced on a miss
+        :param key: address of the entry, see key()
+        :param produce: callable returning the bytes of the entry
+        :return: content of the entry
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            pass
+        else:
+            self._hit(path)
+            return data
+        with self._lock:
+            self.misses += 1
+        metrics.transcode_cache.inc(result='miss')
+        data = produce()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = self._temp_path(key)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            self._store(temp_path, path)
+        except OSError as e:
+            logger.warning("could not cache a sample: %s", e)
+        return data
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        return "%d hits, %d misses (%.0f%% hit rate), %d entries, %.1f MiB" % (
+            self.hits,
+            self.misses,
+            100.0 * self.hits / lookups if lookups else 0,
+            len(self._entries),
+            self.size / 1024 / 1024,
+        )
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import logging
+import subprocess
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from gmusicapi.utils import utils
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _timed(stage: str, function, *args, **kwargs):
+    with metrics.stage_seconds.time(stage=stage):
+        return function(*args, **kwargs)
+
+
+def transcode_to_file(file_path: str, quality='320k', tmp_dir: str = None) -> str:
+    """
+    Same as utils.transcode_to_mp3 but writes the result to a temporary file instead of memory,
+    so that the upload can stream it. The caller is responsible for removing the file
+    :param file_path: Path to the file to transcode
+    :param quality: if int, pass to -q:a. if string, pass to -b:a
+    :param tmp_dir: Directory for the temporary file. System default by default
+    :raises IOError: problems during transcoding
+    :raises ValueError: invalid params, transcoder not found
+    :return: Path to the transcoded mp3 file (without ID3 header)
+    """
+    cmd = [utils.locate_mp3_transcoder(), '-y', '-i', file_path]
+    if isinstance(quality, int):
+        cmd.extend(['-q:a', str(quality)])
+    elif isinstance(quality, str):
+        cmd.extend(['-b:a', quality])
+    else:
+        raise ValueError("quality must be int or string, but received %r" % quality)
+
+    handle, output_path = tempfile.mkstemp(suffix='.mp3', dir=tmp_dir)
+    os.close(handle)
+    # s16le keeps ffmpeg from writing id3 headers, as utils.transcode_to_mp3 does
+    cmd.extend(['-f', 's16le', '-c', 'libmp3lame', output_path])
+
+    logger.debug('running transcode command %r', cmd)
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError as e:
+        os.remove(output_path)
+        raise IOError("transcoding command (%r) failed: %s. "
+                      "ffmpeg or avconv must be installed and in the system path." % (' '.join(cmd), e))
+    if proc.returncode != 0:
+        os.remove(output_path)
+        raise IOError("transcoding command (%r) failed (return code: %r)\nstderr: '%s'" % (
+            ' '.join(cmd), proc.returncode, proc.stderr.decode('ascii', 'replace')
+        ))
+    return output_path
+
+
+class Transcoder:
+    """
+    Transcoding stage shared by uploads: ffmpeg/avconv jobs run on a pool sized to the CPU count,
+    so transcodes and samples for the next tracks are prepared while the current one uploads.
+    Each job is an external transcoder process, so pool threads only wait on their child process.
+    With a TranscodeCache, transcodes and samples of an unchanged audio are only computed once.
+    """
+
+    def __init__(self, workers: int = None, cache=None) -> None:
+        """
+        :param workers: Integer. number of concurrent transcoder processes. CPU count by default
+        :param cache: TranscodeCache. on-disk cache of the outputs. None by default
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def _transcode(self, file_path: str, quality) -> str:
+        if self.cache is None:
+            return transcode_to_file(file_path, quality=quality)
+        return self.cache.file(
+            self.cache.key(file_path, 'transcode', quality),
+            lambda directory: transcode_to_file(file_path, quality=quality, tmp_dir=directory),
+        )
+
+    def _sample(self, file_path: str, slice_start: int, slice_duration: int) -> bytes:
+        def sample() -> bytes:
+            return utils.transcode_to_mp3(
+                file_path, quality='128k', slice_start=slice_start, slice_duration=slice_duration
+            )
+        if self.cache is None:
+            return sample()
+        return self.cache.bytes(self.cache.key(file_path, 'sample', slice_start, slice_duration), sample)
+
+    def submit(self, file_path: str, quality='320k') -> Future:
+        """
+        Schedules a full transcode to mp3
+        :param file_path: Path to the file to transcode
+        :param quality: passed to transcode_to_file
+        :return: Future resolving to the path of a temporary mp3 file, raising IOError or ValueError on failure
+        """
+        return self.executor.submit(_timed, 'transcode', self._transcode, file_path, quality)
+
+    def sample(self, file_path: str, sample_request) -> Future:
+        """
+        Schedules the 128k scan and match sample requested by the server
+        :param file_path: Path to the file to sample
+        :param sample_request: upload_pb2.SignedChallengeInfo sent by the server
+        :return: Future resolving to the sample bytes
+        """
+        sample_spec = sample_request.challenge_info
+        return self.executor.submit(
+            _timed,
+            'sample',
+            self._sample,
+            file_path,
+            sample_spec.start_millis // 1000,
+            sample_spec.duration_millis // 1000,
+        )
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
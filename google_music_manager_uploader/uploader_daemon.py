@@ -5,60 +5,299 @@ import sys
 import time
 import logging
 import os
-import glob
-import netifaces
 import argparse
-import requests
+import threading
+import configparser
 
-from watchdog.observers import Observer
+import requests
 from watchdog.events import FileSystemEventHandler
-from .manager import Manager as Musicmanager
-from gmusicapi.exceptions import CallFailure
-
-__DEFAULT_IFACE__ = netifaces.gateways()['default'][netifaces.AF_INET][1]
-__DEFAULT_MAC__ = netifaces.ifaddresses(__DEFAULT_IFACE__)[netifaces.AF_LINK][0]['addr'].upper()
+from . import metrics
+from .metrics import MetricsServer, SummaryLogger
+from .index import UploadIndex
+from .track_cache import TrackCache
+from .fingerprint import audio_hash
+from .work_queue import WorkQueue, SAMPLING, UPLOADING, DONE, PENDING, INTERRUPTED
+from .scanner import scan, is_audio, is_hidden
+from .retry import RetryPolicy, RateLimiter, FailedFiles
+from .scheduler import FairScheduler, PendingFiles, POLICIES
+from .deduplicate_api import DeduplicateApi, CachedDeduplicateApi
+from .bandwidth import BandwidthLimiter, parse_rate
 
+# gmusicapi, mutagen and the watchdog observers are only imported once an upload starts, so that the command line
+# answers quickly and modules only needing the deduplicate client do not pay for them
+try:
+    from typing import TYPE_CHECKING
+except ImportError:  # Python 3.4
+    TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from watchdog.observers import Observer
+    from .manager import Manager as Musicmanager
+    from .transcoder import Transcoder
+    from .artwork import AlbumArtCache
+    from .remote_library import RemoteLibrary
 
-class DeduplicateApi:
-    def __init__(self, uri: str) -> None:
-        self.uri = uri
+_default_mac = []
 
-    def exists(self, file_path: str) -> bool:
-        result = requests.request('GET', self.uri + "/", data={"path": file_path})
-        return result.status_code == 200 or result.status_code == 204
 
-    def save(self, file_path: str) -> None:
-        requests.request('POST', self.uri + "/", data={"path": file_path})
-
-    def remove(self, file_path: str) -> None:
-        requests.request('DELETE', self.uri + "/", data={"path": file_path})
+def default_mac() -> str:
+    """
+    Looks up the MAC address of the interface of the default route, once, on first use
+    :return: uppercase MAC address, None without default route (gmusicapi then uses the host MAC address)
+    """
+    if not _default_mac:
+        import netifaces
+        try:
+            interface = netifaces.gateways()['default'][netifaces.AF_INET][1]
+            _default_mac.append(netifaces.ifaddresses(interface)[netifaces.AF_LINK][0]['addr'].upper())
+        except (KeyError, IndexError, ValueError):
+            _default_mac.append(None)
+    return _default_mac[0]
 
 
 class MusicToUpload(FileSystemEventHandler):
+    def _track(self, path: str, is_directory: bool) -> None:
+        if is_hidden(path, self.path):
+            return
+        if is_directory:
+            # Only the new directory is scanned, never the whole library.
+            # Files also reported by their own events are coalesced by the settle queue.
+            for file_path in scan(path):
+                self.settle_queue.touch(file_path)
+        elif is_audio(path):
+            self.settle_queue.touch(path)
+
     def on_created(self, event) -> None:
         self.logger.info("Detected new files!")
-        if os.path.isdir(self.path):
-            files = [file for file in glob.glob(glob.escape(self.path) + '/**/*', recursive=True)]
-            for file_path in files:
-                upload_file(
-                    api=self.api,
-                    file_path=file_path,
-                    logger=self.logger,
-                    remove=self.remove,
-                    deduplicate_api=self.deduplicate_api,
-                )
-        else:
-            upload_file(
-                api=self.api,
-                file_path=event.src_path,
-                logger=self.logger,
-                remove=self.remove,
-                deduplicate_api=self.deduplicate_api,
-            )
+        self._track(event.src_path, event.is_directory)
+
+    def on_modified(self, event) -> None:
+        if not event.is_directory and is_audio(event.src_path) and not is_hidden(event.src_path, self.path):
+            self.settle_queue.touch(event.src_path)
+
+    def on_moved(self, event) -> None:
+        # A temporary file renamed to its final name (rsync, browsers, torrent clients) becomes a single event
+        self.settle_queue.discard(event.src_path)
+        self._track(event.dest_path, event.is_directory)
+
+
+class SettleQueue:
+    """
+    Holds files reported by watchdog until they are completely written:
+    a file is released once its size and modification time have not changed for settle_time seconds
+    """
+
+    def __init__(self, release, settle_time: float = 5.0, interval: float = 1.0) -> None:
+        """
+        :param release: callable receiving the path of a settled file
+        :param settle_time: Float. seconds a file must stay unchanged before being released. 5 by default
+        :param interval: Float. seconds between two checks of pending files. 1 by default
+        """
+        self.release = release
+        self.settle_time = settle_time
+        self.interval = interval
+        self._pending = {}  # {path: ((size, mtime_ns), stable since)}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='settle-queue', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._thread.join()
+
+    def touch(self, file_path: str) -> None:
+        """
+        Reports a new or modified file; its settle delay starts over
+        :param file_path: Path to the file
+        """
+        if self.settle_time <= 0:
+            self.release(file_path)
+            return
+        with self._lock:
+            self._pending[file_path] = (None, time.monotonic())
+
+    def discard(self, file_path: str) -> None:
+        """
+        Forgets a file that was moved or deleted
+        :param file_path: Path to the file
+        """
+        with self._lock:
+            self._pending.pop(file_path, None)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _check(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            pending = list(self._pending.items())
+        settled = []
+        for file_path, (signature, since) in pending:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                self.discard(file_path)
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            with self._lock:
+                if self._pending.get(file_path) != (signature, since):
+                    continue  # touched meanwhile
+                if current != signature:
+                    self._pending[file_path] = (current, now)
+                elif now - since >= self.settle_time:
+                    del self._pending[file_path]
+                    settled.append(file_path)
+        for file_path in settled:
+            self.release(file_path)
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            self._check()
+
+
+def _unexpected(error: Exception) -> bool:
+    """
+    :return: True if the error did not come from a Google or deduplicate call, so that its traceback is logged
+    """
+    from gmusicapi.exceptions import CallFailure
+    return not isinstance(error, (CallFailure, requests.RequestException, FailedFiles))
+
+
+class UploadBatcher:
+    """
+    Gathers pending files and hands them over in batches, so that many files share one Manager.upload call.
+    The files of a batch failing for a retryable reason are queued again once their backoff elapsed,
+    without holding the others; when only some files failed, only they are queued again.
+    """
+
+    def __init__(
+        self,
+        callback,
+        logger: logging.Logger,
+        batch_size: int = 25,
+        max_wait: float = 5.0,
+        retry_policy: RetryPolicy = None,
+        pending: PendingFiles = None,
+    ) -> None:
+        """
+        :param callback: callable receiving a list of file paths to upload. May raise CallFailure, requests errors,
+            or FailedFiles for the files to upload again
+        :param logger: logging.Logger object for logs
+        :param batch_size: Integer. maximum number of files per batch. 25 by default
+        :param max_wait: Float. maximum seconds a pending file waits for its batch to fill. 5 by default
+        :param retry_policy: RetryPolicy. tells which failed batches to retry and when. RetryPolicy() by default
+        :param pending: PendingFiles. order in which pending files are batched. PendingFiles() (fifo) by default
+        """
+        self.callback = callback
+        self.logger = logger
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._pending = pending or PendingFiles()
+        self._attempts = {}  # {path: failed attempts}
+        self._retrying = 0
+        self._oldest = None
+        self._stopping = False
+        self._flushing = True
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='upload-batcher', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def add(self, file_path: str) -> None:
+        """
+        Queues a file for upload. A file already pending is not queued twice
+        :param file_path: Path to file to upload
+        """
+        with self._condition:
+            if file_path in self._pending:
+                return
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.add(file_path)
+            self._condition.notify()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def stop(self, flush: bool = True) -> None:
+        """
+        Stops the batching thread once the batch being uploaded is done
+        :param flush: Boolean. upload every pending file first, waiting for the batches being retried.
+            True by default; otherwise pending files are left to the work queue
+        """
+        with self._condition:
+            self._stopping = True
+            self._flushing = flush
+            self._condition.notify()
+        self._thread.join()
+
+    def _next_batch(self) -> list:
+        with self._condition:
+            while not self._pending and (not self._stopping or self._flushing and self._retrying):
+                self._condition.wait()
+            while len(self._pending) < self.batch_size and not self._stopping:
+                remaining = self._oldest + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            if self._stopping and not self._flushing:
+                return []
+            batch = self._pending.pop(self.batch_size)
+            self._oldest = time.monotonic()
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                self.callback(batch)
+            except Exception as e:
+                try:
+                    self._retry(batch, e)
+                except Exception:
+                    # the thread must survive, or no file would ever be uploaded again
+                    self.logger.exception("Batch of %d file(s) failed and could not be retried" % len(batch))
+                continue
+            for file_path in batch:
+                self._attempts.pop(file_path, None)
+
+    def _retry(self, batch: list, error: Exception) -> None:
+        """
+        Queues the failed files of a batch again, when the retry policy tells so. Called while handling error
+        """
+        failed = error.file_paths if isinstance(error, FailedFiles) else batch
+        attempt = max(self._attempts.get(file_path, 0) for file_path in failed)
+        for file_path in batch:
+            self._attempts.pop(file_path, None)
+        delay = self.retry_policy.delay(error, attempt)
+        if delay is None:
+            self.logger.error("Batch of %d file(s) failed: %s" % (len(failed), error), exc_info=_unexpected(error))
+            return
+        self.logger.info("Batch of %d file(s) failed, retrying in %.1fs" % (len(failed), delay))
+        for file_path in failed:
+            self._attempts[file_path] = attempt + 1
+        with self._condition:
+            self._retrying += 1
+        timer = threading.Timer(delay, self._requeue, (failed,))
+        timer.daemon = True
+        timer.start()
+
+    def _requeue(self, batch: list) -> None:
+        for file_path in batch:
+            self.add(file_path)
+        with self._condition:
+            self._retrying -= 1
+            self._condition.notify()
 
 
 def upload_file(
-    api: Musicmanager,
+    api: 'Musicmanager',
     file_path: str,
     logger: logging.Logger,
     remove: bool = False,
@@ -74,75 +313,513 @@ def upload_file(
     :raises CallFailure:
     :return:
     """
-    retry = 5
-    while retry > 0:
+    upload_files(api, [file_path], logger, remove=remove, deduplicate_api=deduplicate_api)
+
+
+def upload_files(
+    api: 'Musicmanager',
+    file_paths: list,
+    logger: logging.Logger,
+    remove: bool = False,
+    deduplicate_api: DeduplicateApi = None,
+    workers: int = 1,
+    index: UploadIndex = None,
+    work_queue: WorkQueue = None,
+    remote_library: 'RemoteLibrary' = None,
+) -> None:
+    """
+    Uploads a batch of files through a single Manager.upload call, retrying following the api retry policy
+    :param api: Musicmanager. object to upload files though
+    :param file_paths: List of paths to files to upload
+    :param logger: logging.Logger object for logs
+    :param remove: Boolean. should remove files? False by default
+    :param deduplicate_api: DeduplicateApi. Api for deduplicating uploads. None by default
+    :param workers: Integer. number of tracks uploaded concurrently. 1 by default
+    :param index: UploadIndex. local record of already handled files. None by default
+    :param work_queue: WorkQueue. durable state of every queued file. None by default
+    :param remote_library: RemoteLibrary. tracks already in the account, completed with the uploaded ones.
+        None by default
+    :raises CallFailure:
+    :return:
+    """
+    policy = getattr(api, 'retry_policy', None) or RetryPolicy()
+    attempt = 0
+    while True:
         try:
-            if os.path.isfile(file_path):
-                logger.info("Should upload %s? " % file_path)
-                if deduplicate_api:
-                    exists = deduplicate_api.exists(file_path)
-                    logger.info("Deduplicate API: file exists? %s" % ("yes" if exists else "no"))
-                    if exists:
-                        return
-                logger.info("Uploading %s" % file_path)
-                uploaded, matched, not_uploaded = api.upload(file_path, True)
-                if not_uploaded:
-                    logger.info("Not uploaded %s" % file_path)
-                if (uploaded or matched) and deduplicate_api:
-                    logger.info("Deduplicate API: saving %s" % file_path)
-                    deduplicate_api.save(file_path)
-                if remove and (uploaded or matched):
-                    logger.info("Removing %s" % file_path)
-                    os.remove(file_path)
-            retry = 0
-        except CallFailure as e:
-            error_message = str(e)
-            if "401" in error_message:
-                retry -= 1
-            elif "502" in error_message:
-                retry -= 1
-                time.sleep(30)
-            else:
+            upload_batch(api, file_paths, logger, remove, deduplicate_api, workers, index, work_queue, remote_library)
+            return
+        except Exception as e:
+            delay = policy.delay(e, attempt)
+            if delay is None:
                 raise e
+            if isinstance(e, FailedFiles):
+                file_paths = e.file_paths
+            attempt += 1
+            logger.info("Upload of %d file(s) failed, retrying in %.1fs" % (len(file_paths), delay))
+            time.sleep(delay)
 
 
-def upload(
-    directory: str = '.',
-    oauth: str = os.environ['HOME'] + '/oauth',
+def upload_batch(
+    api: 'Musicmanager',
+    file_paths: list,
+    logger: logging.Logger,
     remove: bool = False,
-    uploader_id: str = __DEFAULT_MAC__,
-    oneshot: bool = False,
-    deduplicate_api: str = None,
+    deduplicate_api: DeduplicateApi = None,
+    workers: int = 1,
+    index: UploadIndex = None,
+    work_queue: WorkQueue = None,
+    remote_library: 'RemoteLibrary' = None,
 ) -> None:
+    """
+    Single attempt of upload_files, see its parameters
+    :raises CallFailure:
+    :raises FailedFiles: once the other files are handled, when some tracks were interrupted by transient errors
+    """
+    to_upload = []
+    skipped = []
+    for file_path in file_paths:
+        if not os.path.isfile(file_path):
+            if work_queue:
+                work_queue.forget([file_path])
+            continue
+        logger.info("Should upload %s? " % file_path)
+        if index:
+            with metrics.stage_seconds.time(stage='index'):
+                handled = index.is_handled(file_path)
+            if handled:
+                logger.info("Local index: %s already uploaded" % file_path)
+                metrics.files.inc(result='skipped')
+                skipped.append(file_path)
+                continue
+        to_upload.append(file_path)
+    if to_upload and deduplicate_api:
+        with metrics.stage_seconds.time(stage='deduplicate'):
+            existing = deduplicate_api.exists_many(to_upload)
+        metrics.files.inc(len(existing), result='skipped')
+        for file_path in to_upload:
+            exists = file_path in existing
+            logger.info("Deduplicate API: %s exists? %s" % (file_path, "yes" if exists else "no"))
+        skipped.extend(existing)
+        to_upload = [file_path for file_path in to_upload if file_path not in existing]
+        if isinstance(deduplicate_api, CachedDeduplicateApi):
+            logger.info("Deduplicate API cache: %s" % deduplicate_api.stats())
+    copies = {}  # {path: path of the file with the same audio uploaded in its stead}
+    if index and len(to_upload) > 1:
+        originals = {}
+        for file_path in to_upload:
+            original = originals.setdefault(index.fingerprint(file_path), file_path)
+            if original != file_path:
+                logger.info("Local index: %s has the same audio as %s" % (file_path, original))
+                copies[file_path] = original
+        to_upload = [file_path for file_path in to_upload if file_path not in copies]
+    if work_queue:
+        work_queue.mark(skipped, DONE)
+        work_queue.mark(to_upload + list(copies), SAMPLING)
+    if to_upload:
+        bandwidth = getattr(api, 'bandwidth', None)
+        if bandwidth:
+            # the schedule window may ask for more parallelism, e.g. at night
+            workers = bandwidth.workers(workers)
+        logger.info("Uploading %d file(s)" % len(to_upload))
+        with metrics.stage_seconds.time(stage='batch'):
+            uploaded, matched, not_uploaded = api.upload(to_upload, True, workers=workers)
+        if getattr(api.transcoder, 'cache', None):
+            logger.info("Transcode cache: %s" % api.transcoder.cache.stats())
+        if bandwidth:
+            logger.info("Upload bandwidth: %s" % bandwidth.stats())
+        # copies share the outcome of their original
+        for file_path, original in copies.items():
+            server_id = uploaded.get(original) or matched.get(original)
+            if server_id:
+                matched[file_path] = server_id
+            elif original in not_uploaded:
+                not_uploaded[file_path] = not_uploaded[original]
+        # interrupted files are neither counted nor recorded, they are uploaded again
+        interrupted = [file_path for file_path, reason in not_uploaded.items() if reason.startswith(INTERRUPTED)]
+        for file_path in interrupted:
+            logger.info("Interrupted %s: %s" % (file_path, not_uploaded.pop(file_path)))
+        if work_queue:
+            work_queue.mark(interrupted, PENDING)
+        metrics.files.inc(len(uploaded), result='uploaded')
+        metrics.files.inc(len(matched) - len(set(copies) & set(matched)), result='matched')
+        metrics.files.inc(len(set(copies) & set(matched)), result='skipped')
+        metrics.files.inc(len(not_uploaded), result='not_uploaded')
+        for file_path, reason in not_uploaded.items():
+            logger.info("Not uploaded %s" % file_path)
+            metrics.not_uploaded.inc(reason=metrics.reason(reason))
+            if index:
+                index.record(file_path, reason)
+            if work_queue:
+                work_queue.fail(file_path, reason)
+        for file_path, server_id in uploaded.items():
+            if index:
+                index.record(file_path, 'uploaded', server_id)
+        for file_path, server_id in matched.items():
+            if index:
+                index.record(file_path, 'matched', server_id)
+        if remote_library is not None:
+            for file_path, server_id in list(uploaded.items()) + list(matched.items()):
+                remote_library.add(file_path, server_id)
+        if deduplicate_api and (uploaded or matched):
+            logger.info("Deduplicate API: saving %d file(s)" % (len(uploaded) + len(matched)))
+            deduplicate_api.save_many(list(uploaded) + list(matched))
+        if work_queue:
+            work_queue.mark(list(uploaded) + list(matched), DONE)
+        for file_path in list(uploaded) + list(matched):
+            if remove:
+                logger.info("Removing %s" % file_path)
+                os.remove(file_path)
+        if interrupted:
+            raise FailedFiles(interrupted)
+
+
+class Library:
+    """
+    A directory uploaded to one Google account, with its own index, work queue and upload engine.
+    Libraries of a daemon may share a transcoder, an album art cache, a deduplicate client, a scheduler
+    and a bandwidth limiter.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        oauth: str,
+        uploader_id: str,
+        logger: logging.Logger,
+        name: str = None,
+        remove: bool = False,
+        deduplicate_api: DeduplicateApi = None,
+        batch_size: int = 25,
+        batch_wait: float = 5.0,
+        workers: int = 1,
+        index: str = None,
+        settle_time: float = 5.0,
+        engine: str = 'threads',
+        rate_limit: float = 0,
+        presync: bool = False,
+        policy: str = 'fifo',
+        aging: float = 3600.0,
+        transcoder: 'Transcoder' = None,
+        album_art_cache: 'AlbumArtCache' = None,
+        scheduler: FairScheduler = None,
+        bandwidth: BandwidthLimiter = None,
+    ) -> None:
+        """
+        :param directory: Music Folder to upload from
+        :param oauth: Path to oauth file
+        :param uploader_id: Uploader identification (uppercase MAC address), None for default_mac()
+        :param logger: logging.Logger object for logs
+        :param name: String. name of the account in a multi account daemon. None by default
+        :param scheduler: FairScheduler. slots shared with the other libraries of the daemon. None by default
+        :param bandwidth: BandwidthLimiter. upload bytes shared with the other libraries of the daemon. None by default
+        See upload() for the other parameters
+        :raises ValueError: when the oauth credentials are refused
+        """
+        self.directory = directory
+        self.name = name or directory
+        self.logger = logger
+        from .manager import Manager as Musicmanager
+        self.api = Musicmanager()
+        if not self.api.login(oauth, uploader_id or default_mac()):
+            raise ValueError("Error with oauth credentials")
+        # shared by every worker, so that they back off together when Google throttles
+        self.api.retry_policy = RetryPolicy(
+            rate_limiter=RateLimiter(rate_limit), relogin=self.api.reauthenticate, logger=logger
+        )
+        self.api.transcoder = transcoder
+        self.api.album_art_cache = album_art_cache
+        self.api.bandwidth = bandwidth
+        self.index = UploadIndex(index) if index else None
+        self.work_queue = WorkQueue(index) if index else None
+        self.api.track_cache = TrackCache(index) if index else None
+        if self.work_queue:
+            self.api.upload_listener = lambda file_path: self.work_queue.mark([file_path], UPLOADING)
+        self.scheduler = scheduler
+        self.remote_library = None
+        if presync:
+            from .remote_library import RemoteLibrary
+            self.remote_library = RemoteLibrary(logger)
+        self.upload_options = {
+            'remove': remove,
+            'deduplicate_api': deduplicate_api,
+            'workers': workers,
+            'index': self.index,
+            'work_queue': self.work_queue,
+            'remote_library': self.remote_library,
+        }
+        engine_class = UploadBatcher
+        if engine == 'asyncio':
+            from .async_engine import AsyncUploadEngine as engine_class
+        # each batch is a single attempt, failed batches are queued again by the engine following the retry policy
+        self.batcher = engine_class(
+            self._upload,
+            logger,
+            batch_size=batch_size,
+            max_wait=batch_wait,
+            retry_policy=self.api.retry_policy,
+            pending=PendingFiles(policy, aging, root=directory),
+        )
+        self.settle_queue = SettleQueue(self.enqueue, settle_time=settle_time)
+        self._watching = False
+
+    def _upload(self, file_paths: list) -> None:
+        if self.scheduler is None:
+            upload_batch(self.api, file_paths, self.logger, **self.upload_options)
+            return
+        with self.scheduler.slot(self.name):
+            upload_batch(self.api, file_paths, self.logger, **self.upload_options)
+
+    def start(self) -> None:
+        self.batcher.start()
+
+    def _in_account(self, file_path: str) -> bool:
+        """
+        Tells if the account already has a track with the same tags, so that the file is not queued at all
+        """
+        if self.remote_library is None:
+            return False
+        server_id = self.remote_library.find(file_path)
+        if server_id is None:
+            return False
+        self.logger.info("Account library: %s already uploaded" % file_path)
+        metrics.files.inc(result='skipped')
+        if self.work_queue:
+            self.work_queue.mark([file_path], DONE)
+        return True
+
+    def enqueue(self, file_path: str) -> None:
+        if self._in_account(file_path):
+            return
+        if self.work_queue is None or self.work_queue.push(file_path):
+            self.batcher.add(file_path)
+
+    def presync(self) -> None:
+        """
+        Lists the tracks already in the account, once, before the directory is scanned
+        """
+        from gmusicapi.exceptions import CallFailure
+        try:
+            with metrics.stage_seconds.time(stage='presync'):
+                listed = self.remote_library.sync(self.api)
+        except CallFailure as e:
+            # files are then checked by Google one batch at a time
+            self.logger.error("Account library: listing failed, %d track(s) known: %s" % (len(self.remote_library), e))
+            return
+        self.logger.info("Account library: %d track(s) in the account" % listed)
+
+    def watch(self, observer: 'Observer') -> None:
+        """
+        Schedules the directory on a watchdog observer, possibly shared with other libraries
+        """
+        self.settle_queue.start()
+        event_handler = MusicToUpload()
+        event_handler.path = self.directory
+        event_handler.logger = self.logger
+        event_handler.settle_queue = self.settle_queue
+        observer.schedule(event_handler, self.directory, recursive=True)
+        self._watching = True
+
+    def scan(self) -> None:
+        """
+        Lists the tracks of the account when presyncing, queues the files left unfinished by a previous run,
+        then every file of the directory
+        """
+        if self.remote_library is not None:
+            self.presync()
+        if self.work_queue:
+            resumed = self.work_queue.resume()
+            if resumed:
+                self.logger.info("Resuming %d unfinished file(s)" % len(resumed))
+            for file_path in resumed:
+                if not self._in_account(file_path):
+                    self.batcher.add(file_path)
+        # Files are queued as they are found, so uploads start before the whole library is walked
+        for file_path in scan(self.directory):
+            self.enqueue(file_path)
+
+    def stop(self, flush: bool = True) -> None:
+        """
+        Stops watching then the upload engine
+        :param flush: Boolean. upload every pending file first. True by default; otherwise only the batches
+            being uploaded are finished, and the other files are resumed from the index on the next start
+        """
+        if self._watching:
+            self.settle_queue.stop()
+        self.batcher.stop(flush)
+
+
+# options of the [daemon] section of a config file, shared by every account
+DAEMON_OPTIONS = {
+    'oneshot': bool,
+    'transcoders': int,
+    'deduplicate_api': str,
+    'deduplicate_cache_size': int,
+    'deduplicate_cache_ttl': float,
+    'deduplicate_fingerprint': bool,
+    'album_art_max_size': int,
+    'transcode_cache': str,
+    'transcode_cache_size': int,
+    'upload_rate': str,
+    'upload_schedule': str,
+    'metrics_port': int,
+    'metrics_interval': float,
+    'max_batches': int,
+}
+# options of an account section of a config file
+ACCOUNT_OPTIONS = {
+    'directory': str,
+    'oauth': str,
+    'uploader_id': str,
+    'remove': bool,
+    'batch_size': int,
+    'batch_wait': float,
+    'workers': int,
+    'index': str,
+    'no_index': bool,
+    'settle_time': float,
+    'engine': str,
+    'rate_limit': float,
+    'presync': bool,
+    'policy': str,
+    'aging': float,
+}
+ENGINES = ('threads', 'asyncio')
+# accepted values of account options, as the command line choices
+ACCOUNT_CHOICES = {
+    'engine': ENGINES,
+    'policy': POLICIES,
+}
+
+
+def read_config(config_path: str):
+    """
+    Reads a multi account config file: a [daemon] section for the shared options,
+    one section per account, and an optional [DEFAULT] section for options common to every account
+    :param config_path: Path to the config file
+    :return: (daemon options, {account name: account options})
+    :raises ValueError: on unknown options or values, or accounts without directory nor oauth
+    """
+    parser = configparser.ConfigParser()
+    if not parser.read(config_path):
+        raise FileNotFoundError('Unable to read config file %s' % config_path)
+
+    def options(section: configparser.SectionProxy, types: dict) -> dict:
+        values = {}
+        for key in section:
+            if key not in types:
+                if key in parser.defaults():
+                    continue
+                raise ValueError('Unknown option %s in [%s]' % (key, section.name))
+            getter = {bool: section.getboolean, int: section.getint, float: section.getfloat}.get(types[key])
+            values[key] = getter(key) if getter else section.get(key)
+        return values
+
+    daemon = options(parser['daemon'], DAEMON_OPTIONS) if parser.has_section('daemon') else {}
+    accounts = {}
+    for name in parser.sections():
+        if name == 'daemon':
+            continue
+        account = options(parser[name], ACCOUNT_OPTIONS)
+        if 'directory' not in account or 'oauth' not in account:
+            raise ValueError('Account [%s] needs a directory and an oauth file' % name)
+        for key, choices in ACCOUNT_CHOICES.items():
+            if key in account and account[key] not in choices:
+                raise ValueError('Invalid %s %r in [%s], expected one of %s' % (
+                    key, account[key], name, ', '.join(choices)
+                ))
+        accounts[name] = account
+    return daemon, accounts
+
+
+def _logger(name: str = __name__) -> logging.Logger:
     handler = logging.StreamHandler()
     handler.setLevel(logging.DEBUG)
     handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-    logger = logging.getLogger(__name__)
+    logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
     logger.addHandler(handler)
-    logger.info("Init Daemon - Press Ctrl+C to quit")
+    return logger
+
+
+def _deduplicate_client(deduplicate_api: str, cache_size: int, cache_ttl: float) -> DeduplicateApi:
+    if deduplicate_api and cache_size > 0:
+        return CachedDeduplicateApi(deduplicate_api, cache_size, cache_ttl)
+    if deduplicate_api:
+        return DeduplicateApi(deduplicate_api)
+    return None
+
 
-    api = Musicmanager()
-    if not api.login(oauth, uploader_id):
-        raise ValueError("Error with oauth credentials")
+def _transcoder(transcoders: int, transcode_cache: str, transcode_cache_size: int) -> 'Transcoder':
+    from .transcoder import Transcoder
+    from .transcode_cache import TranscodeCache
+    cache = TranscodeCache(transcode_cache, transcode_cache_size * 1024 * 1024) if transcode_cache else None
+    return Transcoder(transcoders, cache=cache)
+
+
+def _bandwidth(upload_rate: float, upload_schedule: str, logger: logging.Logger) -> BandwidthLimiter:
+    """
+    :return: BandwidthLimiter reported through the metrics, None when uploads are neither capped nor scheduled
+    """
+    if not upload_rate and not upload_schedule:
+        return None
+    bandwidth = BandwidthLimiter(upload_rate, upload_schedule, logger)
+    metrics.REGISTRY.gauge(
+        'gmm_upload_bandwidth_cap_bytes', 'Upload bytes per second allowed now, 0 for unlimited',
+        lambda: bandwidth.rate
+    )
+    metrics.REGISTRY.gauge(
+        'gmm_upload_throughput_bytes', 'Upload bytes per second sent over the last ten seconds', bandwidth.throughput
+    )
+    return bandwidth
+
+
+def _fingerprint(libraries: list):
+    """
+    :return: function fingerprinting a file through the index of its library, so that known files are not read again
+    """
+    def fingerprint(file_path: str) -> str:
+        for library in libraries:
+            if library.index and file_path.startswith(os.path.join(library.directory, '')):
+                return library.index.fingerprint(file_path)
+        return audio_hash(file_path)
+    return fingerprint
+
+
+def _run(libraries: list, logger: logging.Logger, oneshot: bool, metrics_port: int, metrics_interval: float) -> None:
+    """
+    Runs libraries until interrupted, or until their files are uploaded in oneshot mode
+    """
+    for library in libraries:
+        library.start()
+    metrics.REGISTRY.gauge(
+        'gmm_queue_depth', 'Files waiting for an upload batch',
+        lambda: sum(len(library.batcher) for library in libraries)
+    )
+    metrics_server = MetricsServer(metrics_port) if metrics_port else None
+    if metrics_server:
+        metrics_server.start()
+    summary_logger = SummaryLogger(logger, metrics_interval) if metrics_interval > 0 else None
+    if summary_logger:
+        summary_logger.start()
     observer = None
-    deduplicate = DeduplicateApi(deduplicate_api) if deduplicate_api else None
     if not oneshot:
-        event_handler = MusicToUpload()
-        event_handler.api = api
-        event_handler.oauth = oauth
-        event_handler.uploader_id = uploader_id
-        event_handler.path = directory
-        event_handler.remove = remove
-        event_handler.logger = logger
-        event_handler.deduplicate_api = deduplicate
+        metrics.REGISTRY.gauge(
+            'gmm_settling_files', 'Files waiting to be completely written',
+            lambda: sum(len(library.settle_queue) for library in libraries)
+        )
+        from watchdog.observers import Observer
+        # a single observer watches every directory
         observer = Observer()
-        observer.schedule(event_handler, directory, recursive=True)
+        for library in libraries:
+            library.watch(observer)
         observer.start()
-    files = [file for file in glob.glob(glob.escape(directory) + '/**/*', recursive=True)]
-    for file_path in files:
-        upload_file(api, file_path, logger, remove=remove, deduplicate_api=deduplicate)
+    for library in libraries:
+        library.scan()
     if oneshot:
+        for library in libraries:
+            library.stop()
+        if summary_logger:
+            summary_logger.stop()
         sys.exit(0)
     try:
         while True:
@@ -150,10 +827,153 @@ def upload(
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    # the batches in flight are finished, the other files wait for the next start
+    for library in libraries:
+        library.stop(flush=False)
+    if summary_logger:
+        summary_logger.stop()
+    if metrics_server:
+        metrics_server.stop()
+
+
+def upload(
+    directory: str = '.',
+    oauth: str = os.environ['HOME'] + '/oauth',
+    remove: bool = False,
+    uploader_id: str = None,
+    oneshot: bool = False,
+    deduplicate_api: str = None,
+    batch_size: int = 25,
+    batch_wait: float = 5.0,
+    workers: int = 1,
+    transcoders: int = None,
+    index: str = None,
+    deduplicate_cache_size: int = 10000,
+    deduplicate_cache_ttl: float = 300.0,
+    album_art_max_size: int = 0,
+    settle_time: float = 5.0,
+    metrics_port: int = 0,
+    metrics_interval: float = 60.0,
+    engine: str = 'threads',
+    rate_limit: float = 0,
+    deduplicate_fingerprint: bool = False,
+    presync: bool = False,
+    transcode_cache: str = None,
+    transcode_cache_size: int = 2048,
+    policy: str = 'fifo',
+    aging: float = 3600.0,
+    upload_rate: float = 0,
+    upload_schedule: str = None,
+) -> None:
+    from .artwork import AlbumArtCache
+    logger = _logger()
+    logger.info("Init Daemon - Press Ctrl+C to quit")
+
+    deduplicate = _deduplicate_client(deduplicate_api, deduplicate_cache_size, deduplicate_cache_ttl)
+    transcoder = _transcoder(transcoders, transcode_cache, transcode_cache_size)
+    library = Library(
+        directory,
+        oauth,
+        uploader_id,
+        logger,
+        remove=remove,
+        deduplicate_api=deduplicate,
+        batch_size=batch_size,
+        batch_wait=batch_wait,
+        workers=workers,
+        index=index,
+        settle_time=settle_time,
+        engine=engine,
+        rate_limit=rate_limit,
+        presync=presync,
+        policy=policy,
+        aging=aging,
+        transcoder=transcoder,
+        album_art_cache=AlbumArtCache(max_size=album_art_max_size),
+        bandwidth=_bandwidth(upload_rate, upload_schedule, logger),
+    )
+    if deduplicate and deduplicate_fingerprint:
+        deduplicate.fingerprint = _fingerprint([library])
+    if transcoder.cache:
+        transcoder.cache.fingerprint = _fingerprint([library])
+    _run([library], logger, oneshot, metrics_port, metrics_interval)
+
+
+def upload_libraries(config_path: str) -> None:
+    """
+    Uploads many libraries, each to its own account, from a single process.
+    Accounts share the watchdog observer, the transcoder, the album art cache, the deduplicate client, the upload
+    bandwidth and metrics; their batches take turns through a FairScheduler
+    :param config_path: Path to the config file, see read_config
+    """
+    from .artwork import AlbumArtCache
+    logger = _logger()
+    logger.info("Init Daemon - Press Ctrl+C to quit")
+    daemon, accounts = read_config(config_path)
+    transcoder = _transcoder(
+        daemon.get('transcoders'), daemon.get('transcode_cache'), daemon.get('transcode_cache_size', 2048)
+    )
+    album_art_cache = AlbumArtCache(max_size=daemon.get('album_art_max_size', 0))
+    deduplicate = _deduplicate_client(
+        daemon.get('deduplicate_api'),
+        daemon.get('deduplicate_cache_size', 10000),
+        daemon.get('deduplicate_cache_ttl', 300.0),
+    )
+    scheduler = FairScheduler(daemon.get('max_batches', 4))
+    bandwidth = _bandwidth(parse_rate(daemon.get('upload_rate', '0')), daemon.get('upload_schedule'), logger)
+    libraries = []
+    for name, account in accounts.items():
+        index = None if account.get('no_index') else account.get('index', account['oauth'] + '.index.sqlite')
+        try:
+            libraries.append(Library(
+                account['directory'],
+                account['oauth'],
+                account.get('uploader_id'),
+                logger.getChild(name),
+                name=name,
+                remove=account.get('remove', False),
+                deduplicate_api=deduplicate,
+                batch_size=account.get('batch_size', 25),
+                batch_wait=account.get('batch_wait', 5.0),
+                workers=account.get('workers', 1),
+                index=index,
+                settle_time=account.get('settle_time', 5.0),
+                engine=account.get('engine', 'threads'),
+                rate_limit=account.get('rate_limit', 0),
+                presync=account.get('presync', False),
+                policy=account.get('policy', 'fifo'),
+                aging=account.get('aging', 3600.0),
+                transcoder=transcoder,
+                album_art_cache=album_art_cache,
+                scheduler=scheduler,
+                bandwidth=bandwidth,
+            ))
+        except (ValueError, OSError):
+            logger.exception("Account %s disabled" % name)
+    if not libraries:
+        raise ValueError("No account could log in")
+    if deduplicate and daemon.get('deduplicate_fingerprint'):
+        deduplicate.fingerprint = _fingerprint(libraries)
+    if transcoder.cache:
+        transcoder.cache.fingerprint = _fingerprint(libraries)
+    _run(
+        libraries,
+        logger,
+        daemon.get('oneshot', False),
+        daemon.get('metrics_port', 0),
+        daemon.get('metrics_interval', 60.0),
+    )
 
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--config",
+        '-c',
+        default=None,
+        help="Config file of a daemon uploading many libraries to many accounts (see README), "
+             "other options are then ignored (default: None)"
+    )
     parser.add_argument(
         "--directory",
         '-d',
@@ -175,7 +995,7 @@ def main():
     parser.add_argument(
         "--uploader_id",
         '-u',
-        default=__DEFAULT_MAC__,
+        default=None,
         help="Uploader identification (should be an uppercase MAC address) (default: <current eth0 MAC address>)"
     )
     parser.add_argument(
@@ -190,7 +1010,148 @@ def main():
         default=None,
         help="Deduplicate API (should be HTTP and compatible with the manifest (see README)) (default: None)"
     )
+    parser.add_argument(
+        "--deduplicate_cache_size",
+        type=int,
+        default=10000,
+        help="Number of Deduplicate API answers kept in memory, 0 to disable the cache (default: 10000)"
+    )
+    parser.add_argument(
+        "--deduplicate_cache_ttl",
+        type=float,
+        default=300.0,
+        help="Seconds a cached Deduplicate API answer stays valid (default: 300)"
+    )
+    parser.add_argument(
+        "--batch_size",
+        '-b',
+        type=int,
+        default=25,
+        help="Maximum number of files sent to Google in a single upload call (default: 25)"
+    )
+    parser.add_argument(
+        "--batch_wait",
+        type=float,
+        default=5.0,
+        help="Maximum seconds a new file waits for its batch to fill before being uploaded (default: 5)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of tracks uploaded concurrently, each holding at most one upload session (default: 1)"
+    )
+    parser.add_argument(
+        "--transcoders",
+        type=int,
+        default=None,
+        help="Number of concurrent ffmpeg/avconv processes for transcodes and samples (default: CPU count)"
+    )
+    parser.add_argument(
+        "--index",
+        '-i',
+        default=None,
+        help="Path to the local index of already uploaded files and of the pending work (default: <oauth>.index.sqlite)"
+    )
+    parser.add_argument(
+        "--no_index",
+        action='store_true',
+        help="Do not keep a local index of already uploaded files nor of the pending work (default: False)"
+    )
+    parser.add_argument(
+        "--album_art_max_size",
+        type=int,
+        default=0,
+        help="Downscale album art larger than this many pixels before sending it, requires Pillow (default: 0, never)"
+    )
+    parser.add_argument(
+        "--settle_time",
+        type=float,
+        default=5.0,
+        help="Seconds a new file must stay unchanged before being uploaded, so files still being copied are not sent "
+             "(default: 5)"
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=0,
+        help="Serve Prometheus metrics on http://127.0.0.1:<port>/metrics (default: 0, disabled)"
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        type=float,
+        default=60.0,
+        help="Seconds between two metrics summary log lines, 0 to disable (default: 60)"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default='threads',
+        help="Upload engine: a batching thread, or an asyncio event loop running batches concurrently "
+             "(default: threads)"
+    )
+    parser.add_argument(
+        "--deduplicate_fingerprint",
+        action='store_true',
+        help="Send the fingerprint of the audio of each file to the Deduplicate API along with its path "
+             "(default: False)"
+    )
+    parser.add_argument(
+        "--rate_limit",
+        type=float,
+        default=0,
+        help="Maximum Google calls per second shared by every worker, 0 for unlimited (default: 0)"
+    )
+    parser.add_argument(
+        "--policy",
+        choices=POLICIES,
+        default='fifo',
+        help="Order of the uploads: discovery order, newest or smallest files first, album by album, "
+             "or top-level folders taking turns (default: fifo)"
+    )
+    parser.add_argument(
+        "--aging",
+        type=float,
+        default=3600.0,
+        help="Seconds after which a pending file is uploaded first whatever the policy, 0 to disable (default: 3600)"
+    )
+    parser.add_argument(
+        "--transcode_cache",
+        default=None,
+        help="Directory keeping transcoded files and scan and match samples between attempts and restarts "
+             "(default: None, disabled)"
+    )
+    parser.add_argument(
+        "--transcode_cache_size",
+        type=int,
+        default=2048,
+        help="Maximum size of the transcode cache in MiB, least recently used entries are evicted first "
+             "(default: 2048)"
+    )
+    parser.add_argument(
+        "--upload_rate",
+        type=parse_rate,
+        default=0,
+        help="Maximum upload bytes per second shared by every upload, with an optional K, M or G suffix, "
+             "0 for unlimited (default: 0)"
+    )
+    parser.add_argument(
+        "--upload_schedule",
+        default=None,
+        help="Upload caps by time of day overriding --upload_rate, e.g. \"08:00-19:00=2M, 19:00-08:00=0/8\" "
+             "for 2MB/s by day and unlimited with 8 workers by night, or a file holding them, "
+             "read again when it changes (default: None)"
+    )
+    parser.add_argument(
+        "--presync",
+        action='store_true',
+        help="List the tracks already in the account at startup and skip the files with the same tags "
+             "(default: False)"
+    )
     args = parser.parse_args()
+    if args.config:
+        upload_libraries(args.config)
+        return
     upload(
         directory=args.directory,
         oauth=args.oauth,
@@ -198,6 +1159,27 @@ def main():
         uploader_id=args.uploader_id,
         oneshot=args.oneshot,
         deduplicate_api=args.deduplicate_api,
+        batch_size=args.batch_size,
+        batch_wait=args.batch_wait,
+        workers=args.workers,
+        transcoders=args.transcoders,
+        index=None if args.no_index else (args.index or args.oauth + '.index.sqlite'),
+        deduplicate_cache_size=args.deduplicate_cache_size,
+        deduplicate_cache_ttl=args.deduplicate_cache_ttl,
+        album_art_max_size=args.album_art_max_size,
+        settle_time=args.settle_time,
+        metrics_port=args.metrics_port,
+        metrics_interval=args.metrics_interval,
+        engine=args.engine,
+        rate_limit=args.rate_limit,
+        deduplicate_fingerprint=args.deduplicate_fingerprint,
+        presync=args.presync,
+        transcode_cache=args.transcode_cache,
+        transcode_cache_size=args.transcode_cache_size,
+        policy=args.policy,
+        aging=args.aging,
+        upload_rate=args.upload_rate,
+        upload_schedule=args.upload_schedule,
     )
 
 
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import time
+import sqlite3
+import threading
+
+PENDING = 'pending'
+SAMPLING = 'sampling'
+UPLOADING = 'uploading'
+DONE = 'done'
+FAILED = 'failed'
+
+# not_uploaded reasons that will not change until the file itself changes
+PERMANENT_REASONS = (
+    'PERMANENT_ERROR',
+    'transcoding disabled',
+    'unsupported filetype',
+    'could not open to read metadata',
+)
+
+# not_uploaded reason of a track whose upload kept failing on throttling, server or network errors
+INTERRUPTED = 'upload interrupted'
+
+
+def is_permanent(reason: str) -> bool:
+    """
+    :param reason: not_uploaded reason returned by Manager.upload
+    :return: True if retrying the upload of an unchanged file cannot succeed
+    """
+    return any(permanent in reason for permanent in PERMANENT_REASONS)
+
+
+class WorkQueue:
+    """
+    Durable record of the daemon's work: every queued file goes through
+    pending, sampling, uploading, then done or failed (with its reason).
+    After a crash, unfinished files are resumed; permanently failing files stay parked until they change.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """
+        :param db_path: Path to the SQLite database, created when missing. May be shared with UploadIndex
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "path TEXT PRIMARY KEY, state TEXT, reason TEXT, permanent INTEGER DEFAULT 0,"
+                " size INTEGER, mtime_ns INTEGER, updated REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+
+    def push(self, file_path: str) -> bool:
+        """
+        Records a file as pending
+        :param file_path: Path to the file to upload
+        :return: False if the file is parked after a permanent failure and did not change since
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT state, permanent, size, mtime_ns FROM jobs WHERE path = ?", (file_path,)
+            ).fetchone()
+            if row and row[2] == stat.st_size and row[3] == stat.st_mtime_ns:
+                if row[0] == FAILED and row[1]:
+                    return False
+                if row[0] in (PENDING, DONE):
+                    return True  # nothing to record, the upload index tells if it must be sent again
+            self._db.execute(
+                "REPLACE INTO jobs (path, state, reason, permanent, size, mtime_ns, updated)"
+                " VALUES (?, ?, NULL, 0, ?, ?, ?)",
+                (file_path, PENDING, stat.st_size, stat.st_mtime_ns, time.time())
+            )
+        return True
+
+    def mark(self, file_paths: list, state: str) -> None:
+        """
+        Moves files to another state
+        :param file_paths: List of paths
+        :param state: one of PENDING, SAMPLING, UPLOADING or DONE
+        """
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE jobs SET state = ?, reason = NULL, updated = ? WHERE path = ?",
+                [(state, now, file_path) for file_path in file_paths]
+            )
+
+    def fail(self, file_path: str, reason: str) -> None:
+        """
+        Records a failed upload; permanent failures are parked
+        :param file_path: Path of the file not uploaded
+        :param reason: not_uploaded reason returned by Manager.upload
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, reason = ?, permanent = ?, updated = ? WHERE path = ?",
+                (FAILED, reason, int(is_permanent(reason)), time.time(), file_path)
+            )
+
+    def forget(self, file_paths: list) -> None:
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM jobs WHERE path = ?", [(file_path,) for file_path in file_paths])
+
+    def resume(self) -> list:
+        """
+        Puts back in pending state every file interrupted by a crash or that failed for a transient reason
+        :return: list of the pending paths, oldest first
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET state = ? WHERE state IN (?, ?) OR (state = ? AND permanent = 0)",
+                (PENDING, SAMPLING, UPLOADING, FAILED)
+            )
+            return [row[0] for row in self._db.execute(
+                "SELECT path FROM jobs WHERE state = ? ORDER BY updated", (PENDING,)
+            )]
+
+    def counts(self) -> dict:
+        """
+        :return: {state: number of files}
+        """
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Runs the oneshot daemon with the asyncio engine against a local FakeMusicManager failing some calls.
+Run from the repository root: python -m pytest tests
+"""
+
+import logging
+import functools
+import threading
+
+import pytest
+
+from google_music_manager_uploader import metrics
+from google_music_manager_uploader import uploader_daemon
+from google_music_manager_uploader.manager import Manager
+from google_music_manager_uploader.retry import RetryPolicy, Backoff, CircuitBreaker
+from benchmarks.fake_server import FakeMusicManager, redirect, write_credentials
+from benchmarks.library import generate
+
+FILES = 20
+
+
+class _RetryPolicy(RetryPolicy):
+    """
+    Gives up on a track at its first failure, so that its batch is queued again with the interrupted tracks,
+    while the engine retries batches until their files are handled
+    """
+
+    def delay(self, error: Exception, attempt: int):
+        if threading.current_thread().name != 'async-engine':
+            return None
+        return super().delay(error, attempt)
+
+
+def _files() -> dict:
+    return {labels['result']: int(value) for _, labels, value in metrics.files.samples()}
+
+
+def test_asyncio_engine_uploads_every_file_despite_errors(tmp_path, monkeypatch):
+    library = str(tmp_path / 'library')
+    paths = generate(library, FILES, ('mp3',), duration=2.0)
+    oauth_path = str(tmp_path / 'oauth')
+
+    # (files given to Manager.upload, their uploaded and matched files, None when the call failed)
+    calls = []
+    upload = Manager.upload
+
+    def recording_upload(self, filepaths, *args, **kwargs):
+        try:
+            uploaded, matched, not_uploaded = upload(self, filepaths, *args, **kwargs)
+        except Exception:
+            calls.append((list(filepaths), None))
+            raise
+        calls.append((list(filepaths), set(uploaded) | set(matched)))
+        return uploaded, matched, not_uploaded
+
+    monkeypatch.setattr(Manager, 'upload', recording_upload)
+    # short delays, and enough attempts that no batch is given up at these error rates
+    monkeypatch.setattr(uploader_daemon, 'RetryPolicy', functools.partial(
+        _RetryPolicy, max_attempts=20, backoff=Backoff(0.1, 1.0), session_backoff=Backoff(0.1, 1.0),
+        breaker=CircuitBreaker(reset_timeout=1.0),
+    ))
+    logging.disable(logging.CRITICAL)
+    before = _files()
+    server = FakeMusicManager(latency=0.01, error_rate=0.2, session_error_rate=0.3, match_ratio=0.2, seed=1)
+    try:
+        with server, redirect(server.url):
+            write_credentials(oauth_path, server.url)
+            with pytest.raises(SystemExit):
+                uploader_daemon.upload(
+                    library, oauth_path, uploader_id='00:11:22:33:AA:BB', oneshot=True, batch_size=5,
+                    batch_wait=0.5, workers=2, metrics_interval=0, engine='asyncio',
+                )
+    finally:
+        logging.disable(logging.NOTSET)
+    after = _files()
+
+    def count(result: str) -> int:
+        return after.get(result, 0) - before.get(result, 0)
+
+    assert count('uploaded') + count('matched') == FILES
+    assert count('not_uploaded') == 0
+    handled = set()
+    for file_paths, done in calls:
+        # a batch is only attempted again with the files it did not handle yet
+        assert not handled & set(file_paths)
+        handled |= done or set()
+    assert handled == set(paths)
+    # some batches were handled in part, then queued again with their interrupted files
+    assert any(done is not None and set(file_paths) - done for file_paths, done in calls)
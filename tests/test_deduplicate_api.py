@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Runs the deduplicate API clients against local servers, with and without the optional /batch endpoint.
+Run from the repository root: python -m pytest tests
+"""
+
+import json
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from google_music_manager_uploader.deduplicate_api import DeduplicateApi, CachedDeduplicateApi
+
+
+class _Server:
+    """
+    Deduplicate API keeping the uploaded paths in memory and recording the path of each request.
+    Its /batch endpoint answers batch_status with batch_body, or implements the batch calls when batch_body is None
+    """
+
+    def __init__(self, batch_status: int = 200, batch_body: bytes = None) -> None:
+        self.paths = set()
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self) -> None:
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                server.requests.append(self.path)
+                if self.path == '/batch':
+                    status, answer = server.batch(self.command, body)
+                else:
+                    status, answer = server.single(self.command, parse_qs(body.decode())['path'][0]), b''
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(answer)))
+                self.end_headers()
+                self.wfile.write(answer)
+
+            do_GET = do_POST = do_DELETE = _handle
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.batch_status = batch_status
+        self.batch_body = batch_body
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def single(self, method: str, path: str) -> int:
+        if method == 'POST':
+            self.paths.add(path)
+        elif method == 'DELETE':
+            self.paths.discard(path)
+        return 200 if path in self.paths or method != 'GET' else 404
+
+    def batch(self, method: str, body: bytes) -> tuple:
+        if self.batch_body is not None:
+            return self.batch_status, self.batch_body
+        paths = json.loads(body.decode())['paths']
+        if method == 'POST':
+            self.paths.update(paths)
+        elif method == 'DELETE':
+            self.paths.difference_update(paths)
+        return 200, json.dumps({'paths': [path for path in paths if path in self.paths]}).encode()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_batch_calls():
+    with _Server() as server:
+        api = DeduplicateApi(server.url)
+        api.save_many(['a', 'b'])
+        assert api.exists_many(['a', 'b', 'c']) == {'a', 'b'}
+        api.remove_many(['a', 'c'])
+        assert api.exists_many(['a', 'b', 'c']) == {'b'}
+    assert server.requests == ['/batch'] * 4
+
+
+@pytest.mark.parametrize('status, body', [
+    (404, b''), (400, b'bad request'), (500, b''), (200, b'OK'), (200, b'{}'), (200, b'{"paths": 1}'),
+])
+def test_unsupported_batch_falls_back_to_single_calls(status, body):
+    with _Server(status, body) as server:
+        server.paths.add('a')
+        api = DeduplicateApi(server.url)
+        assert api.exists_many(['a', 'b']) == {'a'}
+        assert not api.batch_supported
+        api.save_many(['b', 'c'])
+    assert server.paths == {'a', 'b', 'c'}
+    # /batch is probed once
+    assert server.requests == ['/batch', '/', '/', '/', '/']
+
+
+def test_single_path_skips_batch():
+    with _Server() as server:
+        api = DeduplicateApi(server.url)
+        api.save_many(['a'])
+        assert api.exists_many(['a']) == {'a'}
+        api.remove_many(['a'])
+    assert server.requests == ['/', '/', '/']
+    assert api.batch_supported
+
+
+@pytest.mark.parametrize('batch_status', [200, 404])
+def test_cache_counts_each_lookup_once(batch_status):
+    with _Server(batch_status, None if batch_status == 200 else b'') as server:
+        server.paths.add('a')
+        api = CachedDeduplicateApi(server.url)
+        assert api.exists_many(['a', 'b']) == {'a'}
+        assert (api.hits, api.misses) == (0, 2)
+        assert api.exists_many(['a', 'b']) == {'a'}
+        assert (api.hits, api.misses) == (2, 2)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Checks that redirect points the Music Manager calls to the last FakeMusicManager only while it is active.
+Run from the repository root: python -m pytest tests
+"""
+
+from gmusicapi.protocol import musicmanager
+
+from benchmarks.fake_server import redirect
+
+_GOOGLE_URL = 'https://android.clients.google.com/upsj/upauth'
+
+
+def _url() -> str:
+    return musicmanager.AuthenticateUploader.build_request('00:11:22:33:AA:BB', 'uploader')['url']
+
+
+def test_redirect_is_undone():
+    assert _url() == _GOOGLE_URL
+    with redirect('http://127.0.0.1:1'):
+        assert _url() == 'http://127.0.0.1:1/upsj/upauth'
+        with redirect('http://127.0.0.1:2'):
+            assert _url() == 'http://127.0.0.1:2/upsj/upauth'
+        assert _url() == 'http://127.0.0.1:1/upsj/upauth'
+    assert _url() == _GOOGLE_URL
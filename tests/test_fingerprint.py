@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Checks that retagging a track, even with tags growing by many KiB, does not change its audio fingerprint.
+Run from the repository root: python -m pytest tests
+"""
+
+import mutagen
+import pytest
+
+from google_music_manager_uploader.fingerprint import audio_hash
+from benchmarks.library import FORMATS, tagged_track
+
+
+@pytest.mark.parametrize('extension', FORMATS)
+def test_retag_keeps_the_fingerprint(tmp_path, extension):
+    path = str(tmp_path / ('track.' + extension))
+    tagged_track(path, duration=5.0)
+    fingerprint = audio_hash(path)
+    audio = mutagen.File(path, easy=True)
+    audio['Title' if extension == 'wma' else 'title'] = 'retagged ' * 4096
+    audio.save()
+    assert audio_hash(path) == fingerprint
+
+
+@pytest.mark.parametrize('extension', FORMATS)
+def test_audio_changes_the_fingerprint(tmp_path, extension):
+    paths = [str(tmp_path / ('%d.%s' % (seed, extension))) for seed in range(2)]
+    for seed, path in enumerate(paths):
+        tagged_track(path, duration=5.0, seed=seed)
+    assert audio_hash(paths[0]) != audio_hash(paths[1])
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Checks that a file error while uploading a track is reported for this track alone.
+Run from the repository root: python -m pytest tests
+"""
+
+import threading
+from concurrent.futures import Future
+
+from gmusicapi.protocol import locker_pb2
+
+from google_music_manager_uploader.manager import Manager
+from google_music_manager_uploader.retry import RetryPolicy
+
+
+def _manager() -> Manager:
+    manager = Manager()
+    manager.retry_policy = RetryPolicy()
+    return manager
+
+
+def _upload_track(manager: Manager, path: str, track: locker_pb2.Track, transcode: Future = None) -> tuple:
+    return manager._upload_track('server-id', path, track, False, transcode, threading.BoundedSemaphore(1), {})
+
+
+def test_deleted_file_is_not_uploaded(tmp_path):
+    manager = _manager()
+    # the file is deleted once the batch started, before the upload opens it
+    manager._upload_session = lambda server_id, path, track, do_not_rematch, source, *args: open(source, 'rb')
+    path, server_id, err_msg = _upload_track(manager, str(tmp_path / 'deleted.mp3'), locker_pb2.Track())
+    assert err_msg.startswith('file error:')
+
+
+def test_deleted_transcode_is_not_uploaded(tmp_path):
+    manager = _manager()
+    manager._upload_session = lambda server_id, path, track, do_not_rematch, source, *args: open(source, 'rb')
+    track = locker_pb2.Track()
+    track.original_content_type = locker_pb2.Track.FLAC
+    transcode = Future()
+    transcode.set_result(str(tmp_path / 'deleted-transcode.mp3'))
+    path, server_id, err_msg = _upload_track(manager, str(tmp_path / 'track.flac'), track, transcode)
+    assert err_msg.startswith('file error:')
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Checks that the scanner keeps exactly the files the upload accepts.
+Run from the repository root: python -m pytest tests
+"""
+
+from gmusicapi.protocol import locker_pb2
+
+from google_music_manager_uploader.scanner import AUDIO_EXTENSIONS, is_audio
+
+
+def test_every_content_type_is_scanned():
+    assert {'.' + name.lower() for name in locker_pb2.Track.ContentType.keys()} <= AUDIO_EXTENSIONS
+
+
+def test_unsupported_extensions_are_skipped():
+    assert is_audio('/music/track.M4P')
+    assert not is_audio('/music/track.oga')
+    assert not is_audio('/music/cover.jpg')
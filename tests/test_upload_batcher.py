@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Checks how the upload engines of the daemon stop, and that the batching thread survives errors raised
+while retrying a failed batch.
+Run from the repository root: python -m pytest tests
+"""
+
+import time
+import logging
+import threading
+
+import pytest
+
+from google_music_manager_uploader.retry import RetryPolicy
+from google_music_manager_uploader.uploader_daemon import UploadBatcher
+from google_music_manager_uploader.async_engine import AsyncUploadEngine
+
+
+class _BrokenRetryPolicy(RetryPolicy):
+    def delay(self, error: Exception, attempt: int):
+        # e.g. the token refresh of a relogin failing on DNS
+        raise OSError("relogin failed")
+
+
+def test_batcher_survives_a_failing_retry():
+    uploaded = []
+
+    def callback(batch: list) -> None:
+        if 'fails' in batch:
+            raise ValueError("upload failed")
+        uploaded.extend(batch)
+
+    batcher = UploadBatcher(
+        callback, logging.getLogger(__name__), batch_size=1, max_wait=0, retry_policy=_BrokenRetryPolicy(),
+    )
+    batcher.start()
+    batcher.add('fails')
+    batcher.add('uploaded')
+    batcher.stop()
+    assert uploaded == ['uploaded']
+
+
+@pytest.mark.parametrize('engine_class, options', [(UploadBatcher, {}), (AsyncUploadEngine, {'max_batches': 1})])
+@pytest.mark.parametrize('flush', [True, False])
+def test_stop_finishes_the_batch_in_flight(engine_class, options, flush):
+    started = threading.Event()
+    release = threading.Event()
+    uploaded = []
+
+    def callback(batch: list) -> None:
+        started.set()
+        release.wait()
+        uploaded.extend(batch)
+
+    engine = engine_class(callback, logging.getLogger(__name__), batch_size=1, max_wait=0, **options)
+    engine.start()
+    for number in range(3):
+        engine.add('%d.mp3' % number)
+    assert started.wait(5)
+    stopping = threading.Thread(target=engine.stop, args=(flush,))
+    stopping.start()
+    # the stop request is seen before the batch in flight ends
+    time.sleep(0.2)
+    release.set()
+    stopping.join(5)
+    assert not stopping.is_alive()
+    assert uploaded == (['0.mp3', '1.mp3', '2.mp3'] if flush else ['0.mp3'])